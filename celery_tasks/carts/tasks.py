@@ -0,0 +1,8 @@
+from carts.cleanup import collect_idle_carts
+from celery_tasks.main import celery_app
+
+
+@celery_app.task(name='collect_idle_carts')
+def collect_idle_carts_task():
+    """定时归档并删除闲置的购物车"""
+    return collect_idle_carts()
@@ -3,3 +3,37 @@
 broker_url = 'redis://127.0.0.1:6379/7'
 
 
+
+# 定时任务
+beat_schedule = {
+    # 定时重新生成首页静态文件，防止信号遗漏导致首页长期过期
+    'generate-static-index-html': {
+        'task': 'generate_static_index_html',
+        'schedule': 300,
+    },
+    # 定时将redis中的类别访问量写入数据库
+    'flush-visit-counts': {
+        'task': 'flush_visit_counts',
+        'schedule': 60,
+    },
+    # 定时归档并删除闲置的购物车
+    'collect-idle-carts': {
+        'task': 'collect_idle_carts',
+        'schedule': 600,
+    },
+    # 定时把热门商品redis库存的预占写回数据库
+    'reconcile-stock-reservations': {
+        'task': 'reconcile_stock_reservations',
+        'schedule': 10,
+    },
+    # 定时取消排队或处理超时的异步订单并归还购物车
+    'reconcile-order-queue': {
+        'task': 'reconcile_order_queue',
+        'schedule': 30,
+    },
+    # 定时取消过期的未支付订单并归还库存
+    'expire-unpaid-orders': {
+        'task': 'expire_unpaid_orders',
+        'schedule': 10,
+    },
+}
@@ -0,0 +1,8 @@
+from celery_tasks.main import celery_app
+from goods.utils import flush_pending_visit_counts
+
+
+@celery_app.task(name='flush_visit_counts')
+def flush_visit_counts():
+    """定时将redis中累计的类别访问量写入数据库"""
+    flush_pending_visit_counts()
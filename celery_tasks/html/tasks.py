@@ -0,0 +1,25 @@
+from celery_tasks.main import celery_app
+from contents.static_html import generate_static_index_html
+from goods.models import SKU
+from goods.static_html import generate_static_detail_html, remove_expired_detail_html
+
+
+@celery_app.task(name='generate_static_detail_html')
+def generate_detail_html(sku_ids):
+    """重新生成指定sku的详情页静态文件"""
+    for sku_id in sku_ids:
+        generate_static_detail_html(sku_id)
+
+
+@celery_app.task(name='generate_all_static_detail_html')
+def generate_all_detail_html():
+    """重新生成所有上架sku的详情页静态文件"""
+    for sku_id in SKU.objects.filter(is_launched=True).values_list('id', flat=True):
+        generate_static_detail_html(sku_id)
+    remove_expired_detail_html()
+
+
+@celery_app.task(name='generate_static_index_html')
+def generate_index_html():
+    """重新生成首页静态文件"""
+    generate_static_index_html()
@@ -7,4 +7,5 @@ celery_app = Celery('meiduo')
 # 2.加载配置信息  制定谁来当中间人   指定仓库
 celery_app.config_from_object('celery_tasks.config')
 # 3.自定注册任务（当前celery只处理那些任务）
-celery_app.autodiscover_tasks(['celery_tasks.sms', 'celery_tasks.email'])
+celery_app.autodiscover_tasks(['celery_tasks.sms', 'celery_tasks.email', 'celery_tasks.html', 'celery_tasks.goods',
+                               'celery_tasks.carts', 'celery_tasks.orders'])
@@ -0,0 +1,28 @@
+from celery_tasks.main import celery_app
+from orders.expiry import expire_unpaid_orders
+from orders.inventory import reconcile_reservations
+from orders.pipeline import process_order, reconcile_order_queue
+
+
+@celery_app.task(name='reconcile_stock_reservations')
+def reconcile_stock_reservations_task():
+    """定时把热门商品redis库存的预占写回数据库"""
+    return reconcile_reservations()
+
+
+@celery_app.task(name='process_order')
+def process_order_task(order_id, user_id, address_id, pay_method, cart_dict):
+    """处理异步下单队列中的订单"""
+    return process_order(order_id, user_id, address_id, pay_method, cart_dict)
+
+
+@celery_app.task(name='expire_unpaid_orders')
+def expire_unpaid_orders_task():
+    """定时取消过期的未支付订单并归还库存"""
+    return expire_unpaid_orders()
+
+
+@celery_app.task(name='reconcile_order_queue')
+def reconcile_order_queue_task():
+    """定时取消排队或处理超时的异步订单并归还购物车"""
+    return reconcile_order_queue()
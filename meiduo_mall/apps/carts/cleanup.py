@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import re
+import secrets
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from meiduo_mall.utils.locks import release_lock
+from . import contants
+from .redis_cart import _get_script
+
+logger = logging.getLogger('django')
+
+# 登录用户购物车的键名：新格式cart_<uid>，旧格式carts_<uid>
+CART_KEY_RE = re.compile(r'^(carts?)_(\d+)$')
+
+# 购物车闲置时间超过阈值时取出并删除，闲置时间与删除在同一个脚本中判断，期间用户操作购物车不会丢失数据
+# KEYS[1]: 购物车hash  KEYS[2]: 新格式为购物车摘要，旧格式为勾选set
+# ARGV: 闲置时间阈值单位秒
+# 返回: {占用内存字节数, 闲置时间, hash数据, 勾选set数据}，未闲置时返回nil
+POP_IDLE_CART_SCRIPT = """
+local idle = redis.call('object', 'idletime', KEYS[1])
+if not idle or idle < tonumber(ARGV[1]) then
+    return nil
+end
+local usage = redis.call('memory', 'usage', KEYS[1]) or 0
+local selected = {}
+if redis.call('type', KEYS[2])['ok'] == 'set' then
+    selected = redis.call('smembers', KEYS[2])
+end
+usage = usage + (redis.call('memory', 'usage', KEYS[2]) or 0)
+local items = redis.call('hgetall', KEYS[1])
+redis.call('del', KEYS[1], KEYS[2])
+return {usage, idle, items, selected}
+"""
+
+
+def get_archive_path():
+    """闲置购物车归档文件的路径，每天一个文件"""
+    return os.path.join(settings.CART_ARCHIVE_DIR, 'carts_%s.jsonl' % timezone.now().strftime('%Y%m%d'))
+
+
+def archive_carts(records):
+    """把取出的购物车以json lines格式追加到归档文件中"""
+    os.makedirs(settings.CART_ARCHIVE_DIR, exist_ok=True)
+    with open(get_archive_path(), 'a') as f:
+        for record in records:
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def restore_carts(redis_conn, records):
+    """归档失败时把取出的购物车写回redis"""
+    pl = redis_conn.pipeline()
+    for record in records:
+        if record['items']:
+            pl.hset(record['key'], mapping=record['items'])
+        if record['selected']:
+            pl.sadd('selected_%s' % record['user_id'], *record['selected'])
+    pl.execute()
+
+
+def collect_idle_cart_keys(redis_conn, keys, idle_seconds):
+    """
+    检查一批购物车键，归档并删除闲置的购物车，一次redis往返
+    :return: (归档的购物车数, 释放的内存字节数)
+    """
+    carts = []
+    for key in keys:
+        match = CART_KEY_RE.match(key.decode())
+        if match is None:
+            continue
+        prefix, user_id = match.groups()
+        companion = 'cart_summary_%s' % user_id if prefix == 'cart' else 'selected_%s' % user_id
+        carts.append((key.decode(), companion, int(user_id)))
+    if not carts:
+        return 0, 0
+
+    script = _get_script(redis_conn, POP_IDLE_CART_SCRIPT)
+    pl = redis_conn.pipeline()
+    for key, companion, user_id in carts:
+        script(keys=[key, companion], args=[idle_seconds], client=pl)
+    records = []
+    reclaimed = 0
+    for (key, companion, user_id), result in zip(carts, pl.execute()):
+        if result is None:
+            continue
+        usage, idle, items, selected = result
+        reclaimed += usage
+        records.append({
+            'key': key,
+            'user_id': user_id,
+            'idle': idle,
+            'items': {items[i].decode(): int(items[i + 1]) for i in range(0, len(items), 2)},
+            'selected': [sku_id.decode() for sku_id in selected],
+            'archived_at': timezone.now().strftime('%Y-%m-%d %H:%M:%S'),
+        })
+    if records:
+        try:
+            archive_carts(records)
+        except Exception:
+            restore_carts(redis_conn, records)
+            raise
+    return len(records), reclaimed
+
+
+def collect_idle_carts():
+    """
+    增量清理闲置的登录用户购物车
+    使用SCAN分批遍历，游标保存在redis中，每次任务只处理有限的批次，下次任务从游标处继续；
+    闲置超过settings.CART_IDLE_DAYS天的购物车归档到文件后删除
+    :return: 本次任务的统计数据，同时累加到redis的cart_gc_stats中
+    """
+    redis_conn = get_redis_connection('carts')
+    # 锁的值是随机令牌，释放时只删除自己加的锁
+    token = secrets.token_hex(8)
+    if not redis_conn.set('cart_gc_lock', token, nx=True, ex=contants.CART_GC_LOCK_EXPIRES):
+        return None
+    stats = {'scanned': 0, 'archived': 0, 'reclaimed_bytes': 0, 'rounds': 0}
+    try:
+        idle_seconds = settings.CART_IDLE_DAYS * 24 * 3600
+        cursor = int(redis_conn.get('cart_gc_cursor') or 0)
+        for batch in range(contants.CART_GC_MAX_BATCHES):
+            if batch:
+                time.sleep(contants.CART_GC_BATCH_INTERVAL)
+            cursor, keys = redis_conn.scan(cursor, match='cart*', count=contants.CART_GC_SCAN_COUNT)
+            archived, reclaimed = collect_idle_cart_keys(redis_conn, keys, idle_seconds)
+            stats['scanned'] += len(keys)
+            stats['archived'] += archived
+            stats['reclaimed_bytes'] += reclaimed
+            # 每批处理完后保存游标，任务中断后可以继续
+            redis_conn.set('cart_gc_cursor', cursor)
+            if cursor == 0:
+                # 完成一轮完整的遍历
+                stats['rounds'] += 1
+                break
+    finally:
+        release_lock(redis_conn, 'cart_gc_lock', token)
+
+    pl = redis_conn.pipeline()
+    for name, value in stats.items():
+        pl.hincrby('cart_gc_stats', name, value)
+    pl.hincrby('cart_gc_stats', 'runs', 1)
+    pl.hset('cart_gc_stats', 'last_run_at', timezone.now().strftime('%Y-%m-%d %H:%M:%S'))
+    pl.execute()
+    logger.info('清理闲置购物车: %s' % stats)
+    return stats
@@ -0,0 +1,36 @@
+# cookie购物车编码格式的版本号
+CART_COOKIE_VERSION = 1
+# cookie购物车签名的长度单位字节
+CART_COOKIE_SIGNATURE_SIZE = 8
+# cookie购物车签名使用的盐
+CART_COOKIE_SALT = 'carts.cookie'
+# 购物车摘要中展示的商品数量
+CART_SUMMARY_SKUS_COUNT = 10
+# 购物车摘要的过期时间单位秒，商品名称、价格、图片修改后最多延迟这么久生效
+CART_SUMMARY_EXPIRES = 600
+# 购物车摘要重建标记的过期时间单位秒
+CART_SUMMARY_BUILD_EXPIRES = 10
+# cookie购物车编码后超过这个字节数时转存到redis中，cookie中只保存购物车令牌
+CART_COOKIE_SPILL_BYTES = 128
+# 转存到redis中的未登录购物车的过期时间单位秒，每次修改后重新计算
+CART_SPILL_EXPIRES = 3600 * 24 * 7
+# cookie中购物车令牌的前缀，用于区分购物车数据和购物车令牌
+CART_TOKEN_PREFIX = 'T'
+# 清理闲置购物车时每次SCAN的键数量
+CART_GC_SCAN_COUNT = 500
+# 每次定时任务最多执行的SCAN次数，剩余的键下次任务从保存的游标处继续
+CART_GC_MAX_BATCHES = 20
+# 两次SCAN之间的间隔单位秒，避免集中占用redis
+CART_GC_BATCH_INTERVAL = 0.1
+# 清理闲置购物车任务的锁过期时间单位秒
+CART_GC_LOCK_EXPIRES = 600
+# 购物车事件流的键名
+CART_EVENTS_STREAM = 'cart_events'
+# 购物车事件流保留的最大事件数（近似值）
+CART_EVENTS_MAXLEN = 100000
+# 统计加购速率的消费者组名
+CART_EVENTS_GROUP = 'cart_add_rates'
+# 每分钟加购数量统计的过期时间单位秒
+CART_ADD_RATE_EXPIRES = 3600 * 24 * 2
+# 批量修改购物车时一次最多提交的商品数量
+CART_BATCH_MAX_ITEMS = 100
@@ -0,0 +1,40 @@
+import datetime
+
+from django_redis import get_redis_connection
+
+from . import contants
+
+
+def add_cart_event(pl, user_id, action, sku_id, count=0):
+    """
+    在管道中追加一条购物车事件，事件流按最大长度近似裁剪
+    :param pl: redis管道，与购物车的修改一起执行
+    :param user_id: 用户id，未登录用户为空字符串
+    :param action: add添加、set修改、remove删除
+    """
+    pl.xadd(contants.CART_EVENTS_STREAM, {
+        'uid': user_id or '',
+        'action': action,
+        'sku': sku_id,
+        'count': count,
+    }, maxlen=contants.CART_EVENTS_MAXLEN, approximate=True)
+
+
+def get_minute_bucket_key(minute):
+    """每分钟加购数量统计的键名"""
+    return 'cart_adds_%s' % minute.strftime('%Y%m%d%H%M')
+
+
+def get_sku_add_counts(sku_ids, minutes=60):
+    """
+    获取最近若干分钟内各sku的加购数量
+    :return: {sku_id: [从早到晚每分钟的加购数量]}
+    """
+    redis_conn = get_redis_connection('carts')
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    buckets = [now - datetime.timedelta(minutes=i) for i in range(minutes - 1, -1, -1)]
+    pl = redis_conn.pipeline()
+    for minute in buckets:
+        pl.hmget(get_minute_bucket_key(minute), *sku_ids)
+    rows = pl.execute()
+    return {sku_id: [int(row[i] or 0) for row in rows] for i, sku_id in enumerate(sku_ids)}
@@ -0,0 +1,91 @@
+import base64
+import pickle
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from carts.store import CookieCartStore
+from carts.utils import encode_cart, decode_cart
+
+
+def encode_cart_legacy(cart_dict):
+    """原base64(pickle(dict))的cookie购物车编码，仅用于对比"""
+    return base64.b64encode(pickle.dumps(cart_dict)).decode()
+
+
+def decode_cart_legacy(cart_str):
+    """原cookie购物车解码，仅用于对比"""
+    return pickle.loads(base64.b64decode(cart_str.encode()))
+
+
+class Command(BaseCommand):
+    help = '对比cookie购物车新旧编码格式的编解码耗时、cookie体积及每次请求传输的字节数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--times', type=int, default=2000, help='每种购物车大小的编解码次数')
+        parser.add_argument('--sizes', default='1,5,10,20,50,100', help='购物车商品数量，逗号分隔')
+
+    def measure(self, func, arg, times):
+        """执行func若干次，返回平均耗时单位微秒"""
+        start = time.perf_counter()
+        for _ in range(times):
+            func(arg)
+        return (time.perf_counter() - start) * 1000000 / times
+
+    def hybrid_wire_bytes(self, cart_dict):
+        """
+        模拟一次修改购物车的请求，返回转存模式下(请求Cookie字节数, 响应Set-Cookie字节数)
+        大购物车转存到redis后cookie中只有令牌，修改时也不需要重新下发cookie
+        """
+        factory = RequestFactory()
+        store = CookieCartStore(factory.get('/'), record_events=False)
+        store.set_many(cart_dict)
+        response = HttpResponse()
+        store.save(response)
+        request = factory.get('/')
+        request.COOKIES['carts'] = response.cookies['carts'].value
+        # 修改购物车中的一个商品
+        store = CookieCartStore(request, record_events=False)
+        sku_id = next(iter(cart_dict))
+        store.set(sku_id, cart_dict[sku_id]['count'] + 1, True)
+        response = HttpResponse()
+        store.save(response)
+        set_cookie_bytes = len(response.cookies.output()) if 'carts' in response.cookies else 0
+        # 清理转存到redis中的购物车
+        store.clear()
+        store.save(HttpResponse())
+        return len('carts=' + request.COOKIES['carts']), set_cookie_bytes
+
+    def handle(self, *args, **options):
+        times = options['times']
+        self.stdout.write('%5s %-7s %8s %12s %12s' % ('items', 'codec', 'bytes', 'encode(us)', 'decode(us)'))
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            # 模拟真实购物车：sku_id分散，数量较小，部分商品未勾选
+            cart_dict = {sku_id: {'count': sku_id % 5 + 1, 'selected': sku_id % 3 != 0}
+                         for sku_id in range(1001, 1001 + size * 37, 37)}
+            for name, encode, decode in [('legacy', encode_cart_legacy, decode_cart_legacy),
+                                         ('compact', encode_cart, decode_cart)]:
+                cart_str = encode(cart_dict)
+                assert decode(cart_str) == cart_dict
+                self.stdout.write('%5d %-7s %8d %12.2f %12.2f' % (
+                    size, name, len(cart_str), self.measure(encode, cart_dict, times),
+                    self.measure(decode, cart_str, times)))
+
+        # 每次修改购物车的请求都要上传Cookie并下发Set-Cookie
+        self.stdout.write('')
+        self.stdout.write('%5s %-7s %8s %12s %10s' % ('items', 'mode', 'cookie', 'set-cookie', 'total'))
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            cart_dict = {sku_id: {'count': sku_id % 5 + 1, 'selected': sku_id % 3 != 0}
+                         for sku_id in range(1001, 1001 + size * 37, 37)}
+            response = HttpResponse()
+            for name, cart_str in [('legacy', encode_cart_legacy(cart_dict)), ('compact', encode_cart(cart_dict))]:
+                response.set_cookie('carts', cart_str)
+                cookie_bytes = len('carts=' + cart_str)
+                set_cookie_bytes = len(response.cookies.output())
+                self.stdout.write('%5d %-7s %8d %12d %10d' % (
+                    size, name, cookie_bytes, set_cookie_bytes, cookie_bytes + set_cookie_bytes))
+            cookie_bytes, set_cookie_bytes = self.hybrid_wire_bytes(cart_dict)
+            self.stdout.write('%5d %-7s %8d %12d %10d' % (
+                size, 'hybrid', cookie_bytes, set_cookie_bytes, cookie_bytes + set_cookie_bytes))
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.http import HttpResponse
+
+from carts.store import RedisCartStore, CookieCartStore
+
+
+class Command(BaseCommand):
+    help = '对比redis与cookie购物车存储的操作吞吐量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='模拟的请求次数')
+        parser.add_argument('--items', type=int, default=20, help='购物车中的商品数量')
+        parser.add_argument('--user-id', default='benchmark', help='redis购物车使用的用户id，结束后会被删除')
+
+    def run_requests(self, name, make_store, requests, items):
+        """模拟请求：每次请求创建一个购物车存储，执行一种操作并写入响应"""
+        sku_ids = list(range(1, items + 1))
+        operations = [
+            ('add', lambda store, i: store.add(sku_ids[i % items], 1, True)),
+            ('set', lambda store, i: store.set(sku_ids[i % items], i % 5 + 1, i % 2 == 0)),
+            ('set_many', lambda store, i: store.set_many(
+                {sku_id: {'count': i % 5 + 1, 'selected': True} for sku_id in sku_ids})),
+            ('select_all', lambda store, i: store.select_all(i % 2 == 0)),
+            ('select_many', lambda store, i: store.select_many(sku_ids[:items // 2], i % 2 == 0)),
+            ('get_all', lambda store, i: store.get_all()),
+        ]
+        for op_name, operation in operations:
+            start = time.perf_counter()
+            for i in range(requests):
+                store = make_store()
+                operation(store, i)
+                store.save(HttpResponse())
+            elapsed = time.perf_counter() - start
+            self.stdout.write('%-6s %-12s %10.0f ops/s %10.1f us/op' % (
+                name, op_name, requests / elapsed, elapsed * 1000000 / requests))
+
+    def handle(self, *args, **options):
+        requests = options['requests']
+        items = options['items']
+
+        redis_store = RedisCartStore(options['user_id'], record_events=False)
+        try:
+            self.run_requests('redis', lambda: RedisCartStore(options['user_id'], record_events=False), requests, items)
+        finally:
+            redis_store.cart.redis_conn.delete(*redis_store.cart.keys)
+
+        # cookie购物车每次请求都要解码请求中的cookie，并在修改后重新编码
+        factory = RequestFactory()
+        cookie_store = CookieCartStore(factory.get('/'), record_events=False)
+        cookie_store.set_many({sku_id: {'count': 1, 'selected': True} for sku_id in range(1, items + 1)})
+        response = HttpResponse()
+        cookie_store.save(response)
+        request = factory.get('/')
+        request.COOKIES['carts'] = response.cookies['carts'].value
+        self.run_requests('cookie', lambda: CookieCartStore(request, record_events=False), requests, items)
@@ -0,0 +1,98 @@
+import datetime
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from carts import contants
+from carts.events import get_minute_bucket_key
+
+
+class Command(BaseCommand):
+    help = '消费购物车事件流，按分钟统计各sku的加购数量'
+
+    def add_arguments(self, parser):
+        # 默认使用主机名，重启后仍是同一个消费者，会先处理自己上次未确认的事件；同一主机运行多个消费者时需要分别指定
+        parser.add_argument('--consumer', default=socket.gethostname(), help='消费者名称，重启前后需要保持不变')
+        parser.add_argument('--count', type=int, default=500, help='每次读取的事件数量')
+        parser.add_argument('--block', type=int, default=5000, help='没有新事件时阻塞等待的毫秒数')
+        parser.add_argument('--claim-idle', type=int, default=60000,
+                            help='接管其他消费者超过这么多毫秒未确认的事件')
+        parser.add_argument('--claim-interval', type=int, default=60,
+                            help='每隔多少秒检查一次需要接管的事件')
+        parser.add_argument('--once', action='store_true', help='处理完当前所有事件后退出')
+
+    def aggregate(self, redis_conn, entries):
+        """
+        统计一批事件并确认，统计与确认在同一个事务中执行，消费者重启后不会重复统计
+        分钟按事件id中的时间戳计算，与处理时间无关
+        """
+        buckets = {}
+        for entry_id, fields in entries:
+            if not fields or fields.get(b'action') != b'add':
+                continue
+            minute = datetime.datetime.fromtimestamp(int(entry_id.split(b'-')[0]) / 1000).replace(second=0)
+            bucket = buckets.setdefault(get_minute_bucket_key(minute), {})
+            sku_id = fields[b'sku'].decode()
+            bucket[sku_id] = bucket.get(sku_id, 0) + int(fields[b'count'])
+
+        pl = redis_conn.pipeline()
+        for key, counts in buckets.items():
+            for sku_id, count in counts.items():
+                pl.hincrby(key, sku_id, count)
+            pl.expire(key, contants.CART_ADD_RATE_EXPIRES)
+        pl.xack(contants.CART_EVENTS_STREAM, contants.CART_EVENTS_GROUP, *[entry_id for entry_id, _ in entries])
+        pl.execute()
+
+    def claim_idle(self, redis_conn, consumer, options):
+        """接管已退出的消费者未确认的事件，返回接管的事件数量"""
+        stream, group = contants.CART_EVENTS_STREAM, contants.CART_EVENTS_GROUP
+        claimed = 0
+        start_id = '0-0'
+        while True:
+            start_id, entries = redis_conn.xautoclaim(
+                stream, group, consumer, options['claim_idle'], start_id, count=options['count'])[:2]
+            if entries:
+                self.aggregate(redis_conn, entries)
+                claimed += len(entries)
+            if start_id in (b'0-0', '0-0'):
+                break
+        return claimed
+
+    def handle(self, *args, **options):
+        redis_conn = get_redis_connection('carts')
+        stream, group, consumer = contants.CART_EVENTS_STREAM, contants.CART_EVENTS_GROUP, options['consumer']
+        try:
+            redis_conn.xgroup_create(stream, group, id='0', mkstream=True)
+        except ResponseError as e:
+            # 消费者组已存在
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+        # 接管已退出的消费者未确认的事件
+        processed = self.claim_idle(redis_conn, consumer, options)
+        claimed_at = time.time()
+
+        # 先处理本消费者上次未确认的事件，再读取新事件
+        last_id = '0'
+        while True:
+            # 运行期间其他消费者退出后留下的事件，定期接管
+            if time.time() - claimed_at >= options['claim_interval']:
+                processed += self.claim_idle(redis_conn, consumer, options)
+                claimed_at = time.time()
+            response = redis_conn.xreadgroup(group, consumer, {stream: last_id}, count=options['count'],
+                                             block=None if last_id == '0' else options['block'])
+            entries = response[0][1] if response else []
+            if not entries:
+                if last_id == '0':
+                    last_id = '>'
+                    continue
+                if options['once']:
+                    break
+                continue
+            self.aggregate(redis_conn, entries)
+            processed += len(entries)
+
+        self.stdout.write('processed: %d' % processed)
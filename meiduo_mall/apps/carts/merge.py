@@ -0,0 +1,39 @@
+import logging
+
+from django.conf import settings
+
+from goods.models import SKU
+from .redis_cart import RedisCart
+
+logger = logging.getLogger('django')
+
+# 支持的合并策略：overwrite以cookie为准、sum数量累加、max取较大的数量
+MERGE_POLICIES = ('overwrite', 'sum', 'max')
+
+
+def merge_cart(user_id, cart_dict, policy=None):
+    """
+    把cookie购物车合并到redis购物车
+    一次查询校验所有sku，丢弃不存在或已下架的商品，再用一个lua脚本按策略合并，数量不超过库存
+    :param cart_dict: {sku_id: {'count': count, 'selected': selected}}
+    :param policy: 合并策略，默认使用settings.CART_MERGE_POLICY
+    :return: 合并统计 {'merged', 'added', 'updated', 'capped', 'dropped'}
+    """
+    policy = policy or getattr(settings, 'CART_MERGE_POLICY', 'overwrite')
+    if policy not in MERGE_POLICIES:
+        raise ValueError('不支持的购物车合并策略: %s' % policy)
+
+    # 一次查询出所有上架商品的库存
+    stocks = dict(SKU.objects.filter(id__in=list(cart_dict.keys()), is_launched=True).values_list('id', 'stock'))
+    valid_dict = {sku_id: sku_dict for sku_id, sku_dict in cart_dict.items() if sku_id in stocks}
+
+    added, updated, capped = RedisCart(user_id).merge(valid_dict, stocks, policy)
+    stats = {
+        'merged': added + updated,
+        'added': added,
+        'updated': updated,
+        'capped': capped,
+        'dropped': len(cart_dict) - len(valid_dict),
+    }
+    logger.info('用户%s合并cookie购物车(%s): %s' % (user_id, policy, stats))
+    return stats
@@ -0,0 +1,387 @@
+import json
+import uuid
+
+from django_redis import get_redis_connection
+from redis.exceptions import NoScriptError
+
+from . import contants
+from .events import add_cart_event
+from .utils import build_cart_summary
+
+# 所有脚本执行前先把旧的carts_<uid> hash + selected_<uid> set迁移到新的cart_<uid> hash
+# KEYS[1]: 新购物车hash  KEYS[2]: 旧购物车hash  KEYS[3]: 旧勾选set  KEYS[4]: 购物车摘要
+MIGRATE_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 and redis.call('exists', KEYS[2]) == 1 then
+    local items = redis.call('hgetall', KEYS[2])
+    for i = 1, #items, 2 do
+        local count = tonumber(items[i + 1])
+        if redis.call('sismember', KEYS[3], items[i]) == 0 then
+            count = -count
+        end
+        if count ~= 0 then
+            redis.call('hset', KEYS[1], items[i], count)
+        end
+    end
+    redis.call('del', KEYS[2], KEYS[3], KEYS[4])
+end
+"""
+
+# 修改商品或数量的脚本在同一个脚本中删除购物车摘要，勾选状态不影响摘要
+INVALIDATE_SUMMARY = """
+redis.call('del', KEYS[4])
+"""
+
+# 添加商品：数量累加，已勾选的商品保持勾选
+# ARGV: sku_id, count, selected
+ADD_SCRIPT = MIGRATE_SCRIPT + INVALIDATE_SUMMARY + """
+local old = tonumber(redis.call('hget', KEYS[1], ARGV[1]) or '0')
+local count = math.abs(old) + tonumber(ARGV[2])
+if count <= 0 then
+    redis.call('hdel', KEYS[1], ARGV[1])
+    return 0
+end
+if ARGV[3] ~= '1' and old <= 0 then
+    count = -count
+end
+redis.call('hset', KEYS[1], ARGV[1], count)
+return count
+"""
+
+# 批量添加商品，规则与单个添加相同
+# ARGV: sku_id, count, selected, sku_id, count, selected...
+# 返回: 每个商品添加后的数量
+ADD_MANY_SCRIPT = MIGRATE_SCRIPT + INVALIDATE_SUMMARY + """
+local counts = {}
+for i = 1, #ARGV, 3 do
+    local old = tonumber(redis.call('hget', KEYS[1], ARGV[i]) or '0')
+    local count = math.abs(old) + tonumber(ARGV[i + 1])
+    if count <= 0 then
+        redis.call('hdel', KEYS[1], ARGV[i])
+        count = 0
+    else
+        local value = count
+        if ARGV[i + 2] ~= '1' and old <= 0 then
+            value = -count
+        end
+        redis.call('hset', KEYS[1], ARGV[i], value)
+    end
+    counts[#counts + 1] = count
+end
+return counts
+"""
+
+# 修改商品数量和勾选状态
+# ARGV: sku_id, count, selected
+SET_SCRIPT = MIGRATE_SCRIPT + INVALIDATE_SUMMARY + """
+local count = tonumber(ARGV[2])
+if count <= 0 then
+    return redis.call('hdel', KEYS[1], ARGV[1])
+end
+if ARGV[3] ~= '1' then
+    count = -count
+end
+return redis.call('hset', KEYS[1], ARGV[1], count)
+"""
+
+# 删除商品
+# ARGV: sku_id...
+REMOVE_SCRIPT = MIGRATE_SCRIPT + INVALIDATE_SUMMARY + """
+return redis.call('hdel', KEYS[1], unpack(ARGV))
+"""
+
+# 全选或取消全选
+# ARGV: selected
+SELECT_ALL_SCRIPT = MIGRATE_SCRIPT + """
+local items = redis.call('hgetall', KEYS[1])
+for i = 1, #items, 2 do
+    local count = math.abs(tonumber(items[i + 1]))
+    if ARGV[1] ~= '1' then
+        count = -count
+    end
+    redis.call('hset', KEYS[1], items[i], count)
+end
+return #items / 2
+"""
+
+# 批量修改勾选状态
+# ARGV: selected, sku_id...
+SELECT_MANY_SCRIPT = MIGRATE_SCRIPT + """
+local changed = 0
+for i = 2, #ARGV do
+    local old = redis.call('hget', KEYS[1], ARGV[i])
+    if old then
+        local count = math.abs(tonumber(old))
+        if ARGV[1] ~= '1' then
+            count = -count
+        end
+        redis.call('hset', KEYS[1], ARGV[i], count)
+        changed = changed + 1
+    end
+end
+return changed
+"""
+
+# 获取整个购物车
+SNAPSHOT_SCRIPT = MIGRATE_SCRIPT + """
+return redis.call('hgetall', KEYS[1])
+"""
+
+# 获取整个购物车，同时在摘要键中写入重建标记，重建期间购物车被修改时标记会被删除
+# ARGV: 重建标记, 标记过期时间
+SUMMARY_SNAPSHOT_SCRIPT = MIGRATE_SCRIPT + """
+redis.call('set', KEYS[4], ARGV[1], 'EX', ARGV[2])
+return redis.call('hgetall', KEYS[1])
+"""
+
+# 重建标记未被删除时才保存购物车摘要，避免把修改前的摘要写入缓存
+# ARGV: 重建标记, 摘要json, 过期时间
+STORE_SUMMARY_SCRIPT = """
+if redis.call('get', KEYS[4]) == ARGV[1] then
+    redis.call('set', KEYS[4], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# 取出并删除勾选的商品，用于下单，与其他购物车操作互斥
+CHECKOUT_POP_SCRIPT = MIGRATE_SCRIPT + INVALIDATE_SUMMARY + """
+local items = redis.call('hgetall', KEYS[1])
+local popped = {}
+for i = 1, #items, 2 do
+    if tonumber(items[i + 1]) > 0 then
+        popped[#popped + 1] = items[i]
+        popped[#popped + 1] = items[i + 1]
+        redis.call('hdel', KEYS[1], items[i])
+    end
+end
+return popped
+"""
+
+# 把商品写回购物车并勾选，用于下单失败时归还checkout_pop取出的商品
+# ARGV: sku_id, count, sku_id, count...
+RESTORE_SCRIPT = MIGRATE_SCRIPT + INVALIDATE_SUMMARY + """
+for i = 1, #ARGV, 2 do
+    local old = tonumber(redis.call('hget', KEYS[1], ARGV[i]) or '0')
+    redis.call('hset', KEYS[1], ARGV[i], math.abs(old) + tonumber(ARGV[i + 1]))
+end
+return #ARGV / 2
+"""
+
+# 覆盖写入多个商品的数量和勾选状态
+# ARGV: sku_id, count, selected, sku_id, count, selected...
+SET_MANY_SCRIPT = MIGRATE_SCRIPT + INVALIDATE_SUMMARY + """
+for i = 1, #ARGV, 3 do
+    local count = tonumber(ARGV[i + 1])
+    if count > 0 then
+        if ARGV[i + 2] ~= '1' then
+            count = -count
+        end
+        redis.call('hset', KEYS[1], ARGV[i], count)
+    else
+        redis.call('hdel', KEYS[1], ARGV[i])
+    end
+end
+return #ARGV / 3
+"""
+
+# 按策略合并cookie购物车，数量不超过库存
+# ARGV: 策略(overwrite/sum/max), sku_id, count, selected, stock, sku_id, count, selected, stock...
+# 返回: {新增商品数, 修改商品数, 受库存限制的商品数}
+MERGE_SCRIPT = MIGRATE_SCRIPT + INVALIDATE_SUMMARY + """
+local added, updated, capped = 0, 0, 0
+for i = 2, #ARGV, 4 do
+    local old = math.abs(tonumber(redis.call('hget', KEYS[1], ARGV[i]) or '0'))
+    local count = tonumber(ARGV[i + 1])
+    if ARGV[1] == 'sum' then
+        count = old + count
+    elseif ARGV[1] == 'max' then
+        count = math.max(old, count)
+    end
+    local stock = tonumber(ARGV[i + 3])
+    if count > stock then
+        count = stock
+        capped = capped + 1
+    end
+    if count > 0 then
+        if old == 0 then
+            added = added + 1
+        else
+            updated = updated + 1
+        end
+        if ARGV[i + 2] ~= '1' then
+            count = -count
+        end
+        redis.call('hset', KEYS[1], ARGV[i], count)
+    end
+end
+return {added, updated, capped}
+"""
+
+# 已注册的脚本对象，执行时使用evalsha，脚本不存在时自动回退到eval
+_scripts = {}
+
+
+def _get_script(redis_conn, source):
+    """获取已注册的lua脚本"""
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = redis_conn.register_script(source)
+    return script
+
+
+class RedisCart(object):
+    """
+    登录用户的redis购物车
+    每个用户一个hash cart_<uid>，field为sku_id，value为数量，负数表示未勾选，
+    每个操作都是一个lua脚本，只需要一次redis往返，且各操作之间互斥
+    """
+
+    def __init__(self, user_id, redis_conn=None, record_events=True):
+        """
+        :param record_events: 是否把添加、修改、删除商品写入购物车事件流
+        """
+        self.user_id = user_id
+        self.record_events = record_events
+        self.redis_conn = redis_conn or get_redis_connection('carts')
+        self.keys = ['cart_%s' % user_id, 'carts_%s' % user_id, 'selected_%s' % user_id, 'cart_summary_%s' % user_id]
+
+    def _run(self, source, *args, events=None):
+        """
+        执行lua脚本
+        :param events: 需要记录的购物车事件[(action, sku_id, count)]，与脚本在同一个管道中写入事件流
+        """
+        script = _get_script(self.redis_conn, source)
+        if not events or not self.record_events:
+            return script(keys=self.keys, args=args, client=self.redis_conn)
+
+        # 不使用脚本对象的管道执行方式，避免每次执行前多一次SCRIPT EXISTS往返
+        pl = self.redis_conn.pipeline(transaction=False)
+        pl.evalsha(script.sha, len(self.keys), *(self.keys + list(args)))
+        for action, sku_id, count in events:
+            add_cart_event(pl, self.user_id, action, sku_id, count)
+        result = pl.execute(raise_on_error=False)[0]
+        if isinstance(result, NoScriptError):
+            # redis重启等原因脚本丢失时重新加载执行，事件已经写入不需要重复记录
+            result = script(keys=self.keys, args=args, client=self.redis_conn)
+        elif isinstance(result, Exception):
+            raise result
+        return result
+
+    def add(self, sku_id, count, selected=True):
+        """添加商品，返回添加后的数量"""
+        return self._run(ADD_SCRIPT, sku_id, count, int(bool(selected)), events=[('add', sku_id, count)])
+
+    def add_many(self, cart_dict):
+        """
+        批量添加商品，一次redis往返
+        :param cart_dict: {sku_id: {'count': count, 'selected': selected}}
+        :return: {sku_id: 添加后的数量}
+        """
+        args = []
+        for sku_id, sku_dict in cart_dict.items():
+            args.extend([sku_id, sku_dict['count'], int(bool(sku_dict['selected']))])
+        if not args:
+            return {}
+        counts = self._run(ADD_MANY_SCRIPT, *args, events=[
+            ('add', sku_id, sku_dict['count']) for sku_id, sku_dict in cart_dict.items()])
+        return dict(zip(cart_dict.keys(), counts))
+
+    def set(self, sku_id, count, selected):
+        """修改商品数量和勾选状态，数量小于1时删除商品"""
+        self._run(SET_SCRIPT, sku_id, count, int(bool(selected)), events=[('set', sku_id, count)])
+
+    def remove(self, *sku_ids):
+        """删除商品"""
+        if sku_ids:
+            self._run(REMOVE_SCRIPT, *sku_ids, events=[('remove', sku_id, 0) for sku_id in sku_ids])
+
+    def select_all(self, selected):
+        """全选或取消全选，返回购物车中的商品数"""
+        return self._run(SELECT_ALL_SCRIPT, int(bool(selected)))
+
+    def select_many(self, sku_ids, selected):
+        """批量修改勾选状态，购物车中不存在的商品忽略，返回修改的商品数"""
+        if not sku_ids:
+            return 0
+        return self._run(SELECT_MANY_SCRIPT, int(bool(selected)), *sku_ids)
+
+    def snapshot(self):
+        """
+        获取整个购物车
+        :return: {sku_id: {'count': count, 'selected': selected}}，与cookie购物车格式一致
+        """
+        return self._parse_items(self._run(SNAPSHOT_SCRIPT))
+
+    @staticmethod
+    def _parse_items(items):
+        """把hgetall的结果转换成购物车字典"""
+        cart_dict = {}
+        for i in range(0, len(items), 2):
+            count = int(items[i + 1])
+            cart_dict[int(items[i])] = {
+                'count': abs(count),
+                'selected': count > 0,
+            }
+        return cart_dict
+
+    def summary(self):
+        """
+        获取购物车摘要，命中时只需要一次GET，不查询数据库
+        摘要在购物车商品或数量变化时由同一个lua脚本删除，下次访问时重建
+        """
+        summary_json = self.redis_conn.get(self.keys[3])
+        if summary_json is not None and not summary_json.startswith(b'building:'):
+            return json.loads(summary_json.decode())
+
+        token = 'building:%s' % uuid.uuid4().hex
+        cart_dict = self._parse_items(self._run(SUMMARY_SNAPSHOT_SCRIPT, token, contants.CART_SUMMARY_BUILD_EXPIRES))
+        summary = build_cart_summary(cart_dict)
+        self._run(STORE_SUMMARY_SCRIPT, token, json.dumps(summary), contants.CART_SUMMARY_EXPIRES)
+        return summary
+
+    def selected_items(self):
+        """获取勾选的商品 {sku_id: count}"""
+        return {sku_id: sku_dict['count'] for sku_id, sku_dict in self.snapshot().items() if sku_dict['selected']}
+
+    def checkout_pop(self):
+        """取出并删除勾选的商品，返回{sku_id: count}，下单失败时需要调用restore归还"""
+        items = self._run(CHECKOUT_POP_SCRIPT)
+        return {int(items[i]): int(items[i + 1]) for i in range(0, len(items), 2)}
+
+    def restore(self, items):
+        """
+        归还checkout_pop取出的商品，期间又添加过的商品数量累加
+        :param items: {sku_id: count}
+        """
+        args = []
+        for sku_id, count in items.items():
+            args.extend([sku_id, count])
+        if args:
+            self._run(RESTORE_SCRIPT, *args)
+
+    def set_many(self, cart_dict):
+        """
+        批量覆盖商品的数量和勾选状态，数量小于1时删除商品
+        :param cart_dict: {sku_id: {'count': count, 'selected': selected}}
+        """
+        args = []
+        for sku_id, sku_dict in cart_dict.items():
+            args.extend([sku_id, sku_dict['count'], int(bool(sku_dict['selected']))])
+        if args:
+            self._run(SET_MANY_SCRIPT, *args, events=[
+                ('set', sku_id, sku_dict['count']) for sku_id, sku_dict in cart_dict.items()])
+
+    def merge(self, cart_dict, stocks, policy):
+        """
+        按策略合并cookie购物车，一次redis往返
+        :param cart_dict: {sku_id: {'count': count, 'selected': selected}}
+        :param stocks: {sku_id: 库存}，合并后的数量不超过库存
+        :param policy: overwrite覆盖、sum累加、max取较大值
+        :return: (新增商品数, 修改商品数, 受库存限制的商品数)
+        """
+        args = [policy]
+        for sku_id, sku_dict in cart_dict.items():
+            args.extend([sku_id, sku_dict['count'], int(bool(sku_dict['selected'])), stocks[sku_id]])
+        if len(args) == 1:
+            return 0, 0, 0
+        return tuple(self._run(MERGE_SCRIPT, *args))
@@ -0,0 +1,232 @@
+import secrets
+
+from django_redis import get_redis_connection
+
+from . import contants
+from .events import add_cart_event
+from .redis_cart import RedisCart
+from .utils import encode_cart, decode_cart, build_cart_summary, sign_cart_token, parse_cart_token
+
+
+class CartStore(object):
+    """
+    购物车存储的基类，登录用户与未登录用户使用同一套接口
+    购物车数据格式统一为 {sku_id: {'count': count, 'selected': selected}}
+    """
+
+    def get_all(self):
+        """获取整个购物车"""
+        raise NotImplementedError
+
+    def get_selected(self):
+        """获取勾选的商品 {sku_id: count}"""
+        return {sku_id: sku_dict['count'] for sku_id, sku_dict in self.get_all().items() if sku_dict['selected']}
+
+    def get_summary(self):
+        """获取购物车摘要 {'total_count': 商品总数量, 'cart_skus': [...]}"""
+        return build_cart_summary(self.get_all())
+
+    def add(self, sku_id, count, selected=True):
+        """添加商品，数量累加，已勾选的商品保持勾选"""
+        raise NotImplementedError
+
+    def add_many(self, cart_dict):
+        """
+        批量添加商品
+        :param cart_dict: {sku_id: {'count': count, 'selected': selected}}
+        :return: {sku_id: 添加后的数量}
+        """
+        raise NotImplementedError
+
+    def set(self, sku_id, count, selected):
+        """修改商品数量和勾选状态，数量小于1时删除商品"""
+        self.set_many({sku_id: {'count': count, 'selected': selected}})
+
+    def set_many(self, cart_dict):
+        """批量覆盖商品的数量和勾选状态，数量小于1时删除商品"""
+        raise NotImplementedError
+
+    def remove(self, *sku_ids):
+        """删除商品"""
+        raise NotImplementedError
+
+    def select_all(self, selected):
+        """全选或取消全选"""
+        raise NotImplementedError
+
+    def select_many(self, sku_ids, selected):
+        """批量修改勾选状态，购物车中不存在的商品忽略"""
+        raise NotImplementedError
+
+    def save(self, response):
+        """把修改写入响应，cookie购物车需要设置cookie"""
+        pass
+
+
+class RedisCartStore(CartStore):
+    """登录用户的redis购物车，每个操作都是一次redis往返"""
+
+    def __init__(self, user_id, record_events=True):
+        self.cart = RedisCart(user_id, record_events=record_events)
+
+    def get_all(self):
+        return self.cart.snapshot()
+
+    def get_summary(self):
+        return self.cart.summary()
+
+    def add(self, sku_id, count, selected=True):
+        self.cart.add(sku_id, count, selected)
+
+    def add_many(self, cart_dict):
+        return self.cart.add_many(cart_dict)
+
+    def set(self, sku_id, count, selected):
+        self.cart.set(sku_id, count, selected)
+
+    def set_many(self, cart_dict):
+        self.cart.set_many(cart_dict)
+
+    def remove(self, *sku_ids):
+        self.cart.remove(*sku_ids)
+
+    def select_all(self, selected):
+        self.cart.select_all(selected)
+
+    def select_many(self, sku_ids, selected):
+        self.cart.select_many(sku_ids, selected)
+
+
+class CookieCartStore(CartStore):
+    """
+    未登录用户的cookie购物车，请求中只解码一次，修改后在save时编码写入cookie
+    编码后超过一定大小的购物车转存到redis hash中，cookie中只保存签名的购物车令牌，
+    之后的修改不再需要重新下发cookie
+    """
+
+    def __init__(self, request, record_events=True):
+        """
+        :param record_events: 是否把添加、修改、删除商品写入购物车事件流
+        """
+        self.record_events = record_events
+        self.cart_str = request.COOKIES.get('carts')
+        # 购物车已转存到redis时的令牌
+        self.token = parse_cart_token(self.cart_str)
+        self._cart_dict = None
+        self.changed = False
+        # 待写入购物车事件流的事件[(action, sku_id, count)]，在save时与购物车一起写入
+        self.events = []
+
+    @staticmethod
+    def spill_key(token):
+        """转存到redis中的购物车键名"""
+        return 'anon_cart_%s' % token
+
+    @property
+    def cart_dict(self):
+        """延迟解码cookie购物车"""
+        if self._cart_dict is None:
+            if self.token:
+                # 与redis购物车相同，数量为负数表示未勾选
+                redis_dict = get_redis_connection('carts').hgetall(self.spill_key(self.token))
+                self._cart_dict = {int(sku_id): {'count': abs(int(count)), 'selected': int(count) > 0}
+                                   for sku_id, count in redis_dict.items()}
+            else:
+                self._cart_dict = decode_cart(self.cart_str)
+        return self._cart_dict
+
+    def get_all(self):
+        return self.cart_dict
+
+    def add(self, sku_id, count, selected=True):
+        self.add_many({sku_id: {'count': count, 'selected': selected}})
+
+    def add_many(self, cart_dict):
+        counts = {}
+        for sku_id, sku_dict in cart_dict.items():
+            old_dict = self.cart_dict.get(int(sku_id))
+            count, selected = sku_dict['count'], sku_dict['selected']
+            if old_dict:
+                count += old_dict['count']
+                selected = selected or old_dict['selected']
+            self._write(sku_id, count, selected)
+            self.events.append(('add', int(sku_id), sku_dict['count']))
+            counts[sku_id] = max(count, 0)
+        self.changed = True
+        return counts
+
+    def set_many(self, cart_dict):
+        for sku_id, sku_dict in cart_dict.items():
+            self._write(sku_id, sku_dict['count'], sku_dict['selected'])
+            self.events.append(('set', int(sku_id), sku_dict['count']))
+        self.changed = True
+
+    def _write(self, sku_id, count, selected):
+        """写入一个商品，数量小于1时删除商品"""
+        if count < 1:
+            self.cart_dict.pop(int(sku_id), None)
+        else:
+            self.cart_dict[int(sku_id)] = {'count': count, 'selected': bool(selected)}
+
+    def remove(self, *sku_ids):
+        for sku_id in sku_ids:
+            self.cart_dict.pop(int(sku_id), None)
+            self.events.append(('remove', int(sku_id), 0))
+        self.changed = True
+
+    def select_all(self, selected):
+        self.select_many(list(self.cart_dict.keys()), selected)
+
+    def select_many(self, sku_ids, selected):
+        for sku_id in sku_ids:
+            sku_dict = self.cart_dict.get(int(sku_id))
+            if sku_dict:
+                sku_dict['selected'] = bool(selected)
+        self.changed = True
+
+    def clear(self):
+        """清空购物车，用于合并到redis购物车之后"""
+        self._cart_dict = {}
+        self.changed = True
+
+    def save(self, response):
+        if not self.changed:
+            return
+        redis_conn = get_redis_connection('carts')
+        # 购物车事件与转存的购物车在同一个管道中写入
+        pl = redis_conn.pipeline()
+        if self.record_events:
+            for action, sku_id, count in self.events:
+                add_cart_event(pl, None, action, sku_id, count)
+        cart_str = encode_cart(self.cart_dict) if self.cart_dict else None
+        if cart_str and len(cart_str) > contants.CART_COOKIE_SPILL_BYTES:
+            # 购物车过大，整个转存到redis中并刷新过期时间，一次往返
+            token = self.token or secrets.token_urlsafe(16)
+            key = self.spill_key(token)
+            pl.delete(key)
+            pl.hset(key, mapping={sku_id: sku_dict['count'] if sku_dict['selected'] else -sku_dict['count']
+                                  for sku_id, sku_dict in self.cart_dict.items()})
+            pl.expire(key, contants.CART_SPILL_EXPIRES)
+            pl.execute()
+            # 已经下发过令牌时不需要重新设置cookie
+            if token != self.token:
+                response.set_cookie('carts', sign_cart_token(token))
+            return
+
+        if self.token:
+            # 购物车变小或清空后删除redis中的数据，重新保存到cookie中
+            pl.delete(self.spill_key(self.token))
+        if len(pl):
+            pl.execute()
+        if cart_str:
+            response.set_cookie('carts', cart_str)
+        elif self.cart_str is not None:
+            # 购物车为空时删除cookie
+            response.delete_cookie('carts')
+
+
+def get_cart_store(request):
+    """根据用户是否登录获取对应的购物车存储"""
+    if request.user.is_authenticated:
+        return RedisCartStore(request.user.id)
+    return CookieCartStore(request)
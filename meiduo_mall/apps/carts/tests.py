@@ -1,3 +1,54 @@
-from django.test import TestCase
+import json
 
-# Create your tests here.
+from django.test import TestCase, RequestFactory
+from django_redis import get_redis_connection
+
+from goods.models import GoodsCategory, Brand, SPU, SKU
+from goods.sku_cache import sku_cards
+from users.models import User
+from .redis_cart import RedisCart
+from .views import CartsSimpleView
+
+
+class CartsSimpleViewTest(TestCase):
+    """页面头部购物车下拉列表"""
+
+    def setUp(self):
+        category = GoodsCategory.objects.create(name='手机')
+        brand = Brand.objects.create(name='品牌', logo='logo', first_letter='P')
+        spu = SPU.objects.create(name='手机', brand=brand, category1=category, category2=category,
+                                 category3=category)
+        self.sku = SKU.objects.create(name='手机', caption='手机', spu=spu, category=category, price=10,
+                                      cost_price=5, market_price=12, stock=100)
+        self.user = User.objects.create_user(username='cart_user', password='12345678', mobile='13800000000')
+        self.cart = RedisCart(self.user.id)
+        self.cart.add(self.sku.id, 2)
+
+    def tearDown(self):
+        get_redis_connection('carts').delete(*self.cart.keys)
+        sku_cards.invalidate(self.sku.id)
+
+    def get_summary(self):
+        request = RequestFactory().get('/carts/simple/')
+        request.user = self.user
+        return json.loads(CartsSimpleView.as_view()(request).content.decode())
+
+    def test_summary_hit_without_sql(self):
+        """摘要缓存命中时不查询数据库"""
+        self.get_summary()
+        # 清除商品卡片缓存，确认命中时不依赖其他缓存
+        sku_cards.invalidate(self.sku.id)
+        with self.assertNumQueries(0):
+            data = self.get_summary()
+        self.assertEqual(data['total_count'], 2)
+        self.assertEqual([sku['id'] for sku in data['cart_skus']], [self.sku.id])
+
+    def test_summary_invalidated_on_change(self):
+        """购物车变化后重建摘要"""
+        self.get_summary()
+        self.cart.add(self.sku.id, 3)
+        self.assertEqual(self.get_summary()['total_count'], 5)
+        self.cart.remove(self.sku.id)
+        data = self.get_summary()
+        self.assertEqual(data['total_count'], 0)
+        self.assertEqual(data['cart_skus'], [])
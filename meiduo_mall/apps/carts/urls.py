@@ -9,5 +9,7 @@ urlpatterns = [
     url(r'^carts/selection/$', views.CartsSelectedAllView.as_view()),
     # 购物车精简版
     url(r'^carts/simple/$', views.CartsSimpleView.as_view()),
+    # 批量修改购物车
+    url(r'^carts/batch/$', views.CartsBatchView.as_view()),
 
 ]
@@ -1,33 +1,203 @@
-import base64, pickle
-from django_redis import get_redis_connection
+import base64
+import binascii
+import hashlib
+import hmac
+import io
+import pickle
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from goods.sku_cache import sku_cards
+from . import contants
+
+
+def _write_varint(buf, value):
+    """把非负整数按varint格式写入bytearray，每个字节低7位保存数据，最高位表示后面还有字节"""
+    if value < 0x80:
+        buf.append(value)
+        return
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varint(data, pos):
+    """从pos位置读取一个varint，返回(数值, 下一个位置)"""
+    value = data[pos]
+    if value < 0x80:
+        return value, pos + 1
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+        if shift > 63:
+            raise ValueError('varint过长')
+
+
+# 预先计算好密钥的hmac对象，每次签名时复制使用，与django的salted_hmac结果一致
+_cart_hmac = None
+
+
+def _sign(payload):
+    """计算购物车数据的签名，截取前几个字节以减小cookie体积"""
+    global _cart_hmac
+    if _cart_hmac is None:
+        key = hashlib.sha1((contants.CART_COOKIE_SALT + settings.SECRET_KEY).encode()).digest()
+        _cart_hmac = hmac.new(key, digestmod=hashlib.sha1)
+    mac = _cart_hmac.copy()
+    mac.update(payload)
+    return mac.digest()[:contants.CART_COOKIE_SIGNATURE_SIZE]
+
+
+def encode_cart(cart_dict):
+    """
+    把购物车字典编码成cookie字符串
+    格式：版本号(1字节) + 依次排列的[sku_id, count << 1 | selected]两个varint + 签名，整体使用urlsafe base64编码
+    :param cart_dict: {sku_id: {'count': count, 'selected': selected}}，数量小于1的商品不会写入
+    """
+    payload = bytearray([contants.CART_COOKIE_VERSION])
+    for sku_id, sku_dict in cart_dict.items():
+        count = int(sku_dict['count'])
+        if count < 1:
+            continue
+        _write_varint(payload, int(sku_id))
+        _write_varint(payload, count << 1 | bool(sku_dict['selected']))
+    payload = bytes(payload)
+    return base64.urlsafe_b64encode(payload + _sign(payload)).rstrip(b'=').decode()
+
+
+def _decode_compact(cart_bytes):
+    """解码新格式的购物车数据，签名或格式不正确时抛出ValueError"""
+    payload = cart_bytes[:-contants.CART_COOKIE_SIGNATURE_SIZE]
+    signature = cart_bytes[-contants.CART_COOKIE_SIGNATURE_SIZE:]
+    if not payload or payload[0] != contants.CART_COOKIE_VERSION:
+        raise ValueError('购物车版本号不正确')
+    if not constant_time_compare(signature, _sign(payload)):
+        raise ValueError('购物车签名不正确')
+
+    cart_dict = {}
+    pos = 1
+    while pos < len(payload):
+        sku_id, pos = _read_varint(payload, pos)
+        value, pos = _read_varint(payload, pos)
+        cart_dict[sku_id] = {
+            'count': value >> 1,
+            'selected': bool(value & 1),
+        }
+    return cart_dict
+
+
+class _LegacyCartUnpickler(pickle.Unpickler):
+    """旧格式购物车的反序列化器，只允许字典、整数、字符串、布尔等基础类型，禁止加载任何类和函数"""
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError('cookie购物车中不允许出现%s.%s' % (module, name))
+
+
+def _decode_legacy(cart_str):
+    """解码旧格式base64(pickle(dict))的购物车数据，迁移期间使用"""
+    cart_dict = _LegacyCartUnpickler(io.BytesIO(base64.b64decode(cart_str.encode()))).load()
+    if not isinstance(cart_dict, dict):
+        raise ValueError('购物车数据格式不正确')
+    # 统一转换成和新格式一致的数据类型
+    return {int(sku_id): {
+        'count': int(sku_dict['count']),
+        'selected': bool(sku_dict['selected']),
+    } for sku_id, sku_dict in cart_dict.items()}
+
+
+def decode_cart(cart_str):
+    """
+    把cookie字符串解码成购物车字典，兼容旧的pickle格式
+    数据被篡改或无法解析时返回空字典
+    """
+    if not cart_str:
+        return {}
+    try:
+        cart_bytes = base64.urlsafe_b64decode(cart_str.encode() + b'=' * (-len(cart_str) % 4))
+        return _decode_compact(cart_bytes)
+    except (ValueError, IndexError, binascii.Error):
+        pass
+    try:
+        return _decode_legacy(cart_str)
+    except Exception:
+        return {}
+
+
+def build_cart_summary(cart_dict):
+    """
+    生成购物车摘要，用于页面头部的购物车下拉列表
+    :param cart_dict: {sku_id: {'count': count, 'selected': selected}}
+    :return: {'total_count': 商品总数量, 'cart_skus': 数量最多的若干个商品}
+    """
+    top_ids = sorted(cart_dict, key=lambda sku_id: (cart_dict[sku_id]['count'], sku_id), reverse=True)
+    top_ids = top_ids[:contants.CART_SUMMARY_SKUS_COUNT]
+    cards = sku_cards.get_many(top_ids)
+    cart_skus = []
+    for sku_id in top_ids:
+        card = cards.get(sku_id)
+        if card is None:
+            continue
+        cart_skus.append({
+            'id': card['id'],
+            'name': card['name'],
+            'price': card['price'],
+            'default_image_url': card['default_image_url'],
+            'count': cart_dict[sku_id]['count'],
+        })
+    return {
+        'total_count': sum(sku_dict['count'] for sku_dict in cart_dict.values()),
+        'cart_skus': cart_skus,
+    }
+
+
+def _token_signature(token):
+    """计算购物车令牌的签名"""
+    return base64.urlsafe_b64encode(_sign(b'token:' + token.encode())).rstrip(b'=').decode()
+
+
+def sign_cart_token(token):
+    """
+    生成cookie中保存的购物车令牌
+    格式：前缀 + 随机串 + 签名，随机串同时作为redis中的键名，签名防止伪造
+    """
+    return '%s%s.%s' % (contants.CART_TOKEN_PREFIX, token, _token_signature(token))
+
+
+def parse_cart_token(cart_str):
+    """
+    解析cookie中的购物车令牌
+    :return: 令牌中的随机串，cookie中保存的不是令牌或签名不正确时返回None
+    """
+    if not cart_str or not cart_str.startswith(contants.CART_TOKEN_PREFIX):
+        return None
+    token, _, signature = cart_str[len(contants.CART_TOKEN_PREFIX):].partition('.')
+    if not token or not constant_time_compare(signature, _token_signature(token)):
+        return None
+    return token
 
 
 def merge_cart_cookie_to_redis(request, response):
+    """登录成功后把cookie购物车合并到redis购物车，返回合并统计"""
+    # 购物车存储依赖本模块的编解码函数，在函数内导入避免循环导入
+    from .merge import merge_cart
+    from .store import CookieCartStore
 
-    # 获取出cookie购物车数据
-    cart_str = request.COOKIES.get('carts')
     # 注意：必须在执行完login之后再去拿user不然就是匿名用户
     user = request.user
+    cookie_store = CookieCartStore(request)
     # 判断有没有cookie购物车数据，如果有天前响应
-    if cart_str is None:
+    if cookie_store.cart_str is None:
         return
-    # 将cookie_str转成dict
-    cart_dict = pickle.loads(base64.b64decode(cart_str.encode()))
-
-    # 创建redis连接对象
-    redis_conn = get_redis_connection('carts')
-    # 管道技术
-    pl = redis_conn.pipeline()
-    # 遍历cookie大字典
-    for sku_id, sku_dict in cart_dict.items():
-        # 使用hset添加hash数据
-        pl.hset('carts_%s' % user.id, sku_id, sku_dict['count'])
-        # sadd或者srem来操作勾选状态
-        if sku_dict['selected']:
-            pl.sadd('selected_%s' % user.id, sku_id)
-        else:
-            pl.srem('selected_%s' % user.id, sku_id)
-    pl.execute()
+    # 一次查询校验商品，一次redis往返按策略合并
+    stats = merge_cart(user.id, cookie_store.get_all())
     # 删除cookie中的数据
-    response.delete_cookie('carts')
-
+    cookie_store.clear()
+    cookie_store.save(response)
+    return stats
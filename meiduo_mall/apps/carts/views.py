@@ -1,12 +1,22 @@
-import base64
 import json
-import pickle
+from decimal import Decimal
 from meiduo_mall.utils.response_code import RETCODE
 from django import http
 from django.shortcuts import render
 from django.views import View
-from django_redis import get_redis_connection
-from goods.models import SKU
+from goods.sku_cache import sku_cards, sku_stocks
+from . import contants
+from .store import get_cart_store
+
+
+def get_cart_sku_card(sku_id):
+    """校验sku_id并获取sku卡片，sku不存在或格式不正确时返回None"""
+    # 只把sku_id格式错误视为sku不存在，获取卡片时的其他异常正常抛出
+    try:
+        sku_id = int(sku_id)
+    except (TypeError, ValueError):
+        return None
+    return sku_cards.get(sku_id)
 
 
 class CartsView(View):
@@ -22,119 +32,49 @@ class CartsView(View):
         # 校验
         if all([sku_id, count]) is False:
             return http.HttpResponseForbidden('缺少必传参数')
-        try:
-            sku = SKU.objects.get(id=sku_id)
-        except SKU.DoesNotExist:
+        if get_cart_sku_card(sku_id) is None:
             return http.HttpResponseNotFound('sku_id不存在')
 
         # 判断count是不是int类型
         if isinstance(count, int) is False:
             return http.HttpResponseForbidden('参数格式不正确')
-        # 获取当前请求对象中的user
-        user = request.user
-        # 判断用户是否登陆
-        if user.is_authenticated:
-            # 如果是登陆用户操作redis购物车数据
-            """
-            hash:{sku_id_1:1., sku_id_16: 2}
-            set: {sku_id_1}
-            """
-            # 创建redis连接对象
-            redis_conn = get_redis_connection('carts')
-            # 管道
-            pl = redis_conn.pipeline()
-            # 向hash中添加sku_id及count hincrby
-            pl.hincrby('carts_%s' % user.id, sku_id, count)
-            # 把当前商品的sku_id添加到set集合
-            if selected:
-                pl.sadd('selected_%s' % user.id, sku_id)
-            # 执行管道
-            pl.execute()
-            # 创建响应对象
-            response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': '添加购物车成功'})
-
-        # 如果未登录用户操作cookie购物车数据
-        else:
-            # 先获取cookie中的购物车数据
-            cart_str = request.COOKIES.get('carts')
-            # 判断是否有cookie购物车数据
-            if cart_str:
-                # 如果有cookie购物车数据，应该将字符串转会字典
-                # 先将字典转换为bytes类型
-                cart_str_bytes = cart_str.encode()
-                # 使用base64把bytes字符串转换成bytes类型
-                cart_bytes = base64.b64decode(cart_str_bytes)
-                # 使用pickle模型把bytes转换成字典
-                cart_dict = pickle.loads(cart_bytes)
-                # cart_dict = pickle.loads(base64.b64decode(cart_str.encode()))
-                # 如果cookie中没有购物车数据，准备一个新字典用来装购物车和苏剧
-            else:
-                cart_dict = {}
-            # 判断本次添加的购物车商品是否之前已存在，已存在要做增量计算
-            if sku_id in cart_dict:
-                # 获取存在商品的原有count
-                origin_count = cart_dict[sku_id]['count']
-                count += origin_count
-            # 如果是一个新商品直接添加到字典
-            cart_dict[sku_id] = {
-                'count': count,
-                'selected': selected,
-            }
-            # 把cookie购物车字典转换成字符串
-            cart_str = base64.b64encode(pickle.dumps(cart_dict)).decode()
-            # 创建响应对象
-            response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': '添加购物车成功'})
-            # 设置cookie
-            response.set_cookie('carts', cart_str)
-            # 响应
+        # 根据用户是否登陆获取redis或cookie购物车
+        cart_store = get_cart_store(request)
+        # 累加商品数量，已勾选的商品保持勾选
+        cart_store.add(sku_id, count, selected)
+        # 创建响应对象
+        response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': '添加购物车成功'})
+        # cookie购物车需要把修改写入cookie
+        cart_store.save(response)
         return response
 
     def get(self, request):
         """展示购物车"""
-        # 判断用户是否登陆
-        user = request.user
-        if user.is_authenticated:
-            # 登陆操作redis购物车数据
-            # 把redis购物车中hash和set集合数据取出来
-            redis_conn = get_redis_connection('carts')
-            # 获取redis的hash字典数据：
-            redis_dict = redis_conn.hgetall('carts_%s' % user.id)
-            # 获取set集合
-            selected_ids = redis_conn.smembers('selected_%s' % user.id)
-            # 把数据格式转换成和cookie购物车水浒u格式一致，方便后期统一处理
-            # 定义一个字典用于装redis购物车的所有数据
-            cart_dict = {}
-            # 遍历hash字典数据向cart_dict添加
-            for sku_id_bytes in redis_dict:
-                cart_dict[int(sku_id_bytes)] = {
-                    'count': int(redis_dict[sku_id_bytes]),
-                    'selected': sku_id_bytes in selected_ids,
-                }
-
-        else:
-            # 未登录操作cookie购物车数据
-            cart_str = request.COOKIES.get('carts')
-            if cart_str:
-                cart_dict = pickle.loads(base64.b64decode(cart_str.encode()))
-            else:
-                # 如果没有去到cookie值
-                return render(request, 'cart.html')
+        # 取出整个购物车，redis与cookie购物车的数据格式一致
+        cart_dict = get_cart_store(request).get_all()
 
-        # 通过cart_dict中的key   sku_id获取sku模型
-        sku_qs = SKU.objects.filter(id__in=cart_dict.keys())
+        # 通过cart_dict中的key   sku_id从sku卡片缓存中获取sku
+        cards = sku_cards.get_many(cart_dict.keys())
+        # 从价格库存快照中获取最新价格，并判断库存是否充足
+        stocks = sku_stocks.check_cart({sku_id: sku_dict['count'] for sku_id, sku_dict in cart_dict.items()})
         # 用来包装每一个购物车商品字典数据
         sku_list = []
-        # 将sku模型和商品的其他数据包装到同一个字典中
-        for sku_model in sku_qs:
-            count = cart_dict[sku_model.id]['count']
+        # 将sku卡片和商品的其他数据包装到同一个字典中
+        for sku_id, card in cards.items():
+            # 卡片缓存未过期但sku已被删除时跳过
+            if sku_id not in stocks:
+                continue
+            count = cart_dict[sku_id]['count']
+            price = stocks[sku_id]['price']
             sku_list.append({
-                'id': sku_model.id,
-                'name': sku_model.name,
-                'price': str(sku_model.price),
-                'default_image_url': sku_model.default_image.url,
-                'selected': str(cart_dict[sku_model.id]['selected']),
+                'id': card['id'],
+                'name': card['name'],
+                'price': str(price),
+                'default_image_url': card['default_image_url'],
+                'selected': str(cart_dict[sku_id]['selected']),
                 'count': count,
-                'amount': str(sku_model.price * count),
+                'amount': str(price * count),
+                'available': str(stocks[sku_id]['available']),
             })
         return render(request, 'cart.html', {'cart_skus': sku_list})
 
@@ -149,9 +89,8 @@ class CartsView(View):
         if all([sku_id, count]) is False:
             return http.HttpResponseForbidden('缺少必传参数')
 
-        try:
-            sku = SKU.objects.get(id=sku_id)
-        except SKU.DoesNotExist:
+        card = get_cart_sku_card(sku_id)
+        if card is None:
             return http.HttpResponseForbidden('sku_id不存在')
 
         try:
@@ -163,78 +102,19 @@ class CartsView(View):
             return http.HttpResponseForbidden('类型有误')
         # 包装一个当前修改的商品数据字典
         cart_sku = {
-            'id': sku.id,
-            'name': sku.name,
-            'price': str(sku.price),
-            'default_image_url': sku.default_image.url,
+            'id': card['id'],
+            'name': card['name'],
+            'price': card['price'],
+            'default_image_url': card['default_image_url'],
             'selected': selected,
             'count': count,
-            'amount': str(sku.price * count),
+            'amount': str(Decimal(card['price']) * count),
         }
-        # 判断是否登陆
-        user = request.user
-        if user.is_authenticated:
-
-            # 登陆用户修改redis购物车数据
-            # 创建redis连接对象
-            redis_conn = get_redis_connection('carts')
-            # 管道技术
-            pl = redis_conn.pipeline()
-            # 修改hash数据
-            pl.hset('carts_%s' % user.id, sku_id, count)
-            # 修改set聚合数据
-            if selected:
-                pl.sadd('selected_%s' % user.id, sku_id)
-            else:
-                pl.srem('selected_%s' % user.id, sku_id)
-            # 执行管道
-            pl.execute()
-            # 包装一个当前修改的商品数据字典
-            # cart_sku = {
-            #     'id': sku.id,
-            #     'name': sku.name,
-            #     'price': str(sku.price),
-            #     'default_url': sku.default_image.url,
-            #     'selected': selected,
-            #     'count': count,
-            #     'amount': str(sku.price * count),
-            # }
-            # 响应
-            response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': '修改购物车数据车成功', 'cart_sku': cart_sku})
-            # return response
-
-        else:
-            # 未登录用户修该cookie购物车数据
-            # 获取cookie购物车数据
-            cart_str = request.COOKIES.get('carts')
-            if cart_str:
-                # 把cart_str转换成字典
-                cart_dict = pickle.loads(base64.b64decode(cart_str.encode()))
-            else:
-                return http.JsonResponse({'code': RETCODE.OK, 'errmsg': 'cookie数据没有获取到'})
-
-            # 新数据赋值修改
-            cart_dict[sku_id] = {
-                'count': count,
-                'selected': selected,
-            }
-            # 把字典转换成字符串
-            cart_str = base64.b64encode(pickle.dumps(cart_dict)).decode()
-            # 包装一个当前修改的商品数据字典
-            # cart_sku = {
-            #     'id': sku.id,
-            #     'name': sku.name,
-            #     'price': str(sku.price),
-            #     'default_url': sku.default_image.url,
-            #     'selected': selected,
-            #     'count': count,
-            #     'amount': str(sku.price * count),
-            # }
-            # 设置cookie
-            response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': '修改购物车数据车成功', 'cart_sku': cart_sku})
-            response.set_cookie('carts', cart_str)
-            # 响应
-            # return response
+        # 同时修改数量和勾选状态
+        cart_store = get_cart_store(request)
+        cart_store.set(sku_id, count, selected)
+        response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': '修改购物车数据车成功', 'cart_sku': cart_sku})
+        cart_store.save(response)
         return response
 
     def delete(self, request):
@@ -243,51 +123,90 @@ class CartsView(View):
         json_dict = json.loads(request.body.decode())
         sku_id = json_dict.get('sku_id')
         # 校验
-        try:
-            sku = SKU.objects.get(id=sku_id)
-        except SKU.DoesNotExist:
+        if get_cart_sku_card(sku_id) is None:
             return http.HttpResponseForbidden('sku_id不存在')
 
-        # 判断登陆
-        user = request.user
-        if user.is_authenticated:
-            # 登陆操作redis数据
-            # 创建redis的连接对象
-            redis_conn = get_redis_connection('carts')
-            pl = redis_conn.pipeline()
-            # 删除hash中的对应键值对
-            pl.hdel('carts_%s' % user.id, sku_id)
-            # 把当前sku_id从set集合中一出
-            pl.srem('selected_%s' % user.id, sku_id)
-            pl.execute()
-            # 响应
-            response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': '购物车删除成功'})
-        else:
-            # 未登录操作cookie数据
-            # 先获取cookie购物车数据
+        # 删除购物车中的商品，cookie购物车为空时删除cookie
+        cart_store = get_cart_store(request)
+        cart_store.remove(sku_id)
+        response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': '购物车删除成功'})
+        cart_store.save(response)
+        return response
+
+
+class CartsBatchView(View):
+    """
+    批量修改购物车
+    请求体 {'items': [{'sku_id': sku_id, 'count': count, 'selected': selected}, ...]}
+    所有sku_id一次校验，校验通过的商品一次写入购物车，返回每个商品的处理结果
+    """
 
-            cart_str = request.COOKIES.get('carts')
-            # 判断是否获取到cookie购物车数据
-            if cart_str:
-                cart_dict = pickle.loads(base64.b64decode(cart_str.encode()))
+    def post(self, request):
+        """批量添加购物车"""
+        return self.apply(request, 'add')
+
+    def put(self, request):
+        """批量修改购物车"""
+        return self.apply(request, 'set')
+
+    def apply(self, request, action):
+        try:
+            items = json.loads(request.body.decode()).get('items')
+        except (ValueError, AttributeError):
+            return http.HttpResponseForbidden('参数格式不正确')
+        if not isinstance(items, list) or not items:
+            return http.HttpResponseForbidden('缺少必传参数')
+        if len(items) > contants.CART_BATCH_MAX_ITEMS:
+            return http.HttpResponseForbidden('商品数量超过上限')
+
+        # 先校验参数格式，格式正确的sku_id一次查询是否存在
+        results = []
+        for item in items:
+            sku_id = item.get('sku_id') if isinstance(item, dict) else None
+            result = {'sku_id': sku_id, 'code': RETCODE.OK, 'errmsg': 'OK'}
+            results.append(result)
+            if not isinstance(item, dict) or not isinstance(sku_id, int) or isinstance(sku_id, bool):
+                result.update(code=RETCODE.PARAMERR, errmsg='sku_id格式不正确')
+                continue
+            count = item.get('count')
+            if not isinstance(count, int) or isinstance(count, bool) or (action == 'add' and count < 1):
+                result.update(code=RETCODE.PARAMERR, errmsg='count格式不正确')
+                continue
+            if not isinstance(item.get('selected', True), bool):
+                result.update(code=RETCODE.PARAMERR, errmsg='selected格式不正确')
+        valid_ids = [result['sku_id'] for result in results if result['code'] == RETCODE.OK]
+        cards = sku_cards.get_many(valid_ids) if valid_ids else {}
+
+        # 同一个sku_id提交多次时，添加累加数量，修改以最后一次为准
+        cart_dict = {}
+        for item, result in zip(items, results):
+            if result['code'] != RETCODE.OK:
+                continue
+            sku_id = result['sku_id']
+            if sku_id not in cards:
+                result.update(code=RETCODE.NODATAERR, errmsg='sku_id不存在')
+                continue
+            sku_dict = cart_dict.get(sku_id)
+            if action == 'add' and sku_dict:
+                sku_dict['count'] += item['count']
+                sku_dict['selected'] = sku_dict['selected'] or item.get('selected', True)
             else:
-                # 获取到之后字符串转换成字典
-                # 魅惑去到提前响应
-                return http.JsonResponse({'code': RETCODE.DBERR, 'errmsg': 'cookie数据没获取到'})
-                # 删除指定sku_id对应的键值对
-            if sku_id in cart_dict:
-                del cart_dict[sku_id]
-            response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': '删除购物车成功'})
-            # 判断当前字典是否为空，如果为空将cookie删除
-            if not cart_dict:
-                # 删除cookie，删除cookie的原理，实际就是在设置cookie把它的过期时间改为0
-                response.delete_cookie('carts')
-                return response
-            # 字典转字符串
-            cart_str = base64.b64encode(pickle.dumps(cart_dict)).decode()
-            # 设置cookie
-            response.set_cookie('carts', cart_str)
-            # 响应
+                cart_dict[sku_id] = {'count': item['count'], 'selected': item.get('selected', True)}
+
+        # 一次redis往返或一次cookie编码写入所有商品
+        cart_store = get_cart_store(request)
+        if action == 'add':
+            counts = cart_store.add_many(cart_dict) if cart_dict else {}
+        else:
+            if cart_dict:
+                cart_store.set_many(cart_dict)
+            counts = {sku_id: max(sku_dict['count'], 0) for sku_id, sku_dict in cart_dict.items()}
+        for result in results:
+            if result['code'] == RETCODE.OK:
+                result['count'] = counts[result['sku_id']]
+
+        response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'results': results})
+        cart_store.save(response)
         return response
 
 
@@ -301,44 +220,11 @@ class CartsSelectedAllView(View):
         # 校验
         if isinstance(selected, bool) is False:
             return http.HttpResponseForbidden('参数格式不正确')
-        # 判断登陆
-        user = request.user
-        if user.is_authenticated:
-            # 登陆操作redis
-            # 创建redis连接对象
-            redis_conn = get_redis_connection('carts')
-            # 获取hash
-            redis_dict = redis_conn.hgetall('carts_%s' % user.id)
-            # 如果时全选将hash中的所有key添加到set集合中
-            if selected:
-                redis_conn.sadd('selected_%s' % user.id, *redis_dict.keys())
-            # 如果是取消全选将set删除
-            else:
-                redis_conn.delete('selected_%s' % user.id)
-            # 创建响应对象
-            response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': '删除购物车成功'})
-
-        else:
-            # 未登录操作cookie
-            # 先获取cookie购物车数据
-            cart_str = request.COOKIES.get('carts')
-            # 判断是否获取到
-            if cart_str:
-                # 如果获取到把字符串转成字典
-                cart_dict = pickle.loads(base64.b64decode(cart_str.encode()))
-            # 如果没有获取到提前响应
-            else:
-                return http.JsonResponse({'code': RETCODE.DBERR, 'errmsg': 'cookie没有获取到'})
-            # 遍历cookie购物车大字典，将内部的每一个selected修改为True或者False
-            for sku_id in cart_dict:
-                cart_dict[sku_id]['selected'] = selected
-            # 把字典转换成字符串
-            cart_str = base64.b64encode(pickle.dumps(cart_dict)).decode()
-            # 创建响应对象
-            response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': '删除购物车成功'})
-            # 设置cookie
-            response.set_cookie('carts', cart_str)
-        # 响应
+        # 全选或取消全选
+        cart_store = get_cart_store(request)
+        cart_store.select_all(selected)
+        response = http.JsonResponse({'code': RETCODE.OK, 'errmsg': '全选购物车成功'})
+        cart_store.save(response)
         return response
 
 
@@ -346,46 +232,7 @@ class CartsSimpleView(View):
     """展示精简版购物车数据"""
 
     def get(self, request):
-        # 判断用户是否登陆
-        user = request.user
-        if user.is_authenticated:
-            # 登陆操作redis购物车数据
-            # 把redis购物车中hash和set集合数据取出来
-            redis_conn = get_redis_connection('carts')
-            # 获取redis的hash字典数据：
-            redis_dict = redis_conn.hgetall('carts_%s' % user.id)
-            # 获取set集合
-            selected_ids = redis_conn.smembers('selected_%s' % user.id)
-            # 把数据格式转换成和cookie购物车水浒u格式一致，方便后期统一处理
-            # 定义一个字典用于装redis购物车的所有数据
-            cart_dict = {}
-            # 遍历hash字典数据向cart_dict添加
-            for sku_id_bytes in redis_dict:
-                cart_dict[int(sku_id_bytes)] = {
-                    'count': int(redis_dict[sku_id_bytes]),
-                    'selected': sku_id_bytes in selected_ids,
-                }
-
-        else:
-            # 未登录操作cookie购物车数据
-            cart_str = request.COOKIES.get('carts')
-            if cart_str:
-                cart_dict = pickle.loads(base64.b64decode(cart_str.encode()))
-            else:
-                # 如果没有去到cookie值
-                return render(request, 'cart.html')
-
-        # 通过cart_dict中的key   sku_id获取sku模型
-        sku_qs = SKU.objects.filter(id__in=cart_dict.keys())
-        # 用来包装每一个购物车商品字典数据
-        sku_list = []
-        # 将sku模型和商品的其他数据包装到同一个字典中
-        for sku_model in sku_qs:
-            count = cart_dict[sku_model.id]['count']
-            sku_list.append({
-                'id': sku_model.id,
-                'name': sku_model.name,
-                'default_image_url': sku_model.default_image.url,
-                'count': count,
-            })
-        return http.JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'cart_skus': sku_list})
\ No newline at end of file
+        # 登陆用户的购物车摘要缓存在redis中，命中时不需要查询数据库
+        summary = get_cart_store(request).get_summary()
+        return http.JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'cart_skus': summary['cart_skus'],
+                                  'total_count': summary['total_count']})
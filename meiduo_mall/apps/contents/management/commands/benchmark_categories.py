@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from contents import utils
+from goods.models import GoodsChannel
+from goods.utils import bump_category_version
+
+
+def get_categories_legacy():
+    """原逐层查询的商品类别实现，仅用于对比"""
+    categories = {}
+    for channel in GoodsChannel.objects.all().order_by('group_id', 'sequence'):
+        group_id = channel.group_id
+        if group_id not in categories:
+            categories[group_id] = {'channels': [], 'sub_cats': []}
+        cat1 = channel.category
+        cat1.url = channel.url
+        categories[group_id]['channels'].append(cat1)
+        for cat2 in cat1.subs.all():
+            cat2.sub_cats = list(cat2.subs.all())
+            categories[group_id]['sub_cats'].append(cat2)
+    return categories
+
+
+class Command(BaseCommand):
+    help = '对比商品类别数据新旧实现的查询次数与耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--times', type=int, default=100, help='每种实现的执行次数')
+
+    def measure(self, name, func, times):
+        """执行func若干次，输出平均查询次数与耗时"""
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            for _ in range(times):
+                func()
+            elapsed = time.perf_counter() - start
+        self.stdout.write('%-12s queries/call: %6.1f  latency: %8.3f ms' % (
+            name, len(ctx.captured_queries) / times, elapsed * 1000 / times))
+
+    def handle(self, *args, **options):
+        times = options['times']
+
+        def cold():
+            # 每次都使版本号失效，模拟缓存未命中
+            bump_category_version()
+            return utils.get_categories()
+
+        def redis_hit():
+            # 只清除进程内缓存，模拟其他进程已写入redis
+            utils._local_categories = (None, None)
+            return utils.get_categories()
+
+        self.measure('legacy', get_categories_legacy, times)
+        self.measure('cold', cold, times)
+        self.measure('redis', redis_hit, times)
+        self.measure('local', utils.get_categories, times)
@@ -0,0 +1,20 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from celery_tasks.html.tasks import generate_index_html
+from goods.models import GoodsCategory, GoodsChannel
+from .models import Content, ContentCategory
+
+
+@receiver(post_save, sender=Content)
+@receiver(post_delete, sender=Content)
+@receiver(post_save, sender=ContentCategory)
+@receiver(post_delete, sender=ContentCategory)
+@receiver(post_save, sender=GoodsCategory)
+@receiver(post_delete, sender=GoodsCategory)
+@receiver(post_save, sender=GoodsChannel)
+@receiver(post_delete, sender=GoodsChannel)
+def index_changed(sender, **kwargs):
+    """广告内容或商品类别变化后异步重新生成首页"""
+    transaction.on_commit(lambda: generate_index_html.delay())
@@ -0,0 +1,41 @@
+import os
+
+from django.conf import settings
+from django.template import loader
+
+from goods.static_html import save_static_html
+from .models import ContentCategory
+from .utils import get_categories
+
+
+def get_index_context():
+    """
+    构造首页的模板数据
+        查询出首页广告数据
+        'index_lbt': [lbt1, lbt2...],
+        'index_qx': []
+    """
+    # 定义一个字典用来包装所有广告数据
+    contents = {}
+    # 获取所有广告类别
+    content_category_qs = ContentCategory.objects.all()
+    # 遍历广告类别查询集构建广告数据格式
+    for cat in content_category_qs:
+        contents[cat.key] = cat.content_set.filter(status=True).order_by('sequence')
+
+    return {
+        'categories': get_categories(),
+        'contents': contents
+    }
+
+
+def get_index_html_path():
+    """获取首页静态文件的路径"""
+    return os.path.join(settings.GENERATED_STATIC_HTML_FILES_DIR, 'index.html')
+
+
+def generate_static_index_html():
+    """生成首页静态文件，写入临时文件后原子替换旧文件"""
+    template = loader.get_template('index.html')
+    html_text = template.render(get_index_context())
+    save_static_html(get_index_html_path(), html_text)
@@ -1,12 +1,23 @@
-from goods.models import GoodsChannel
+from django.core.cache import cache
 
+from goods import contants
+from goods.models import GoodsChannel, GoodsCategory
+from goods.utils import get_category_version
 
-def get_categories():
-    """查询出商品数据类别"""
+# 进程内缓存的商品类别数据 (版本号, 类别数据)
+_local_categories = (None, None)
+
+
+def build_categories():
+    """查询出商品数据类别（固定两次查询）"""
     # 定义一个字典变量用于保存数据
     categories = {}
-    # 获取商品种类查询集
-    goods_channels_qs = GoodsChannel.objects.all().order_by('group_id', 'sequence')
+    # 一次查询出所有二三级类别，并按照父类别进行分组
+    sub_cats_dict = {}
+    for cat in GoodsCategory.objects.filter(parent__isnull=False).order_by('id'):
+        sub_cats_dict.setdefault(cat.parent_id, []).append(cat)
+    # 获取商品频道查询集，同时查询出频道对应的一级类别
+    goods_channels_qs = GoodsChannel.objects.select_related('category').order_by('group_id', 'sequence')
     # 遍历查询集获取一级数据
     for channel in goods_channels_qs:
         # 获取一级数据的组号
@@ -21,15 +32,31 @@ def get_categories():
         cat1.url = channel.url
         # 将cat1添加到字典channels的列表中
         categories[group_id]['channels'].append(cat1)
-        # 获取当前cat1下的cat2查询集
-        cat2_qs = cat1.subs.all()
-        # 遍历cat2的查询集
-        for cat2 in cat2_qs:
-            # 根据当前的cat2获取cat3的查询集
-            cat3_qs = cat2.subs.all()
-            # 将得到的cat3_qs查询集赋值给cat2的sub_cats
-            cat2.sub_cats = cat3_qs
-            # 将cat2添加到二级中的sub_cats的列表中
+        # 从分组字典中取出当前cat1下的cat2，以及每个cat2下的cat3
+        for cat2 in sub_cats_dict.get(cat1.id, []):
+            cat2.sub_cats = sub_cats_dict.get(cat2.id, [])
             categories[group_id]['sub_cats'].append(cat2)
 
     return categories
+
+
+def get_categories():
+    """
+    获取商品数据类别
+    先读进程内缓存，再读redis缓存，都未命中时才查询数据库，缓存以类别版本号区分新旧
+    """
+    global _local_categories
+    version = get_category_version()
+    # 进程内缓存的版本号与当前版本号一致时直接返回
+    local_version, categories = _local_categories
+    if local_version == version:
+        return categories
+
+    cache_key = 'categories_%s' % version
+    categories = cache.get(cache_key)
+    if categories is None:
+        categories = build_categories()
+        cache.set(cache_key, categories, contants.CATEGORIES_CACHE_EXPIRES)
+    _local_categories = (version, categories)
+
+    return categories
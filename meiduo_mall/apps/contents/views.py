@@ -1,13 +1,11 @@
 import logging
 
+from django import http
 from django.shortcuts import render
 
 # Create your views here.
 from django.views import View
-from .utils import get_categories
-
-from goods.models import GoodsCategory, GoodsChannel
-from .models import ContentCategory, Content
+from .static_html import get_index_context, get_index_html_path
 
 logger = logging.getLogger()
 
@@ -27,24 +25,10 @@ class IndexView(View):
                }
             }
         """
+        # 首页已静态化时直接响应静态文件，静态文件缺失或刚被删除时才动态渲染
+        try:
+            return http.FileResponse(open(get_index_html_path(), 'rb'), content_type='text/html; charset=utf-8')
+        except FileNotFoundError:
+            pass
 
-
-        """
-            查询出首页广告数据
-            'index_lbt': [lbt1, lbt2...],
-            'index_qx': []
-        """
-        # 定义一个字典用来包装所有广告数据
-        contents = {}
-        # 获取所有广告类别
-        content_category_qs = ContentCategory.objects.all()
-        # 遍历广告类别查询集构建广告数据格式
-        for cat in content_category_qs:
-            contents[cat.key] = cat.content_set.filter(status=True).order_by('sequence')
-
-        context = {
-            'categories': get_categories(),
-            'contents': contents
-        }
-
-        return render(request, 'index.html', context)
+        return render(request, 'index.html', get_index_context())
@@ -0,0 +1,32 @@
+# 商品类别缓存版本号的redis键名
+CATEGORY_VERSION_KEY = 'category_version'
+# 商品类别数据缓存的过期时间单位秒
+CATEGORIES_CACHE_EXPIRES = 3600 * 24
+# spu规格选项矩阵缓存的过期时间单位秒
+VARIANT_MATRIX_CACHE_EXPIRES = 3600 * 24
+# 商品列表总数量缓存的过期时间单位秒（总页数允许短时间内不精确）
+LIST_COUNT_CACHE_EXPIRES = 300
+# 商品列表分页游标缓存的过期时间单位秒
+LIST_CHECKPOINTS_CACHE_EXPIRES = 3600
+# 商品列表分页结果缓存的过期时间单位秒
+LIST_PAGE_CACHE_EXPIRES = 3600
+# 热销排行默认返回的商品数量
+HOT_SKUS_COUNT = 2
+# 热销排行最多返回的商品数量
+HOT_SKUS_MAX_COUNT = 20
+# 类别没有上架商品或类别不存在时空排行标记的过期时间单位秒，避免每次请求都查询数据库
+HOT_SKUS_EMPTY_EXPIRES = 60
+# redis中每日类别访问量hash的过期时间单位秒，写入数据库的任务中断不超过该时间时访问量不会丢失
+VISIT_COUNTS_EXPIRES = 3600 * 24 * 7
+# 有未写入数据库的访问量的日期集合
+VISIT_COUNTS_DAYS_KEY = 'visit_counts_days'
+# 访问量写入数据库时的锁过期时间单位秒
+VISIT_FLUSH_LOCK_EXPIRES = 300
+# redis中sku卡片缓存的过期时间单位秒
+SKU_CARD_CACHE_EXPIRES = 3600 * 24
+# 进程内sku卡片缓存的过期时间单位秒
+SKU_CARD_LOCAL_EXPIRES = 5
+# 进程内最多缓存的sku卡片数量
+SKU_CARD_LOCAL_MAX_SIZE = 10000
+# sku价格库存快照的过期时间单位秒，下单等批量修改库存后会主动删除
+SKU_STOCK_CACHE_EXPIRES = 30
@@ -0,0 +1,36 @@
+import time
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from goods.models import SKU
+from goods.static_html import generate_static_detail_html, remove_expired_detail_html
+
+
+def init_worker():
+    """子进程不能复用父进程的数据库连接"""
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = '使用进程池生成所有上架sku的详情页静态文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None, help='进程数，默认为cpu核数')
+        parser.add_argument('--sku', type=int, nargs='*', help='只生成指定sku的详情页')
+
+    def handle(self, *args, **options):
+        sku_ids = options['sku'] or list(SKU.objects.filter(is_launched=True).values_list('id', flat=True))
+        # fork之前关闭数据库连接，避免子进程共用同一连接
+        connections.close_all()
+
+        start = time.perf_counter()
+        with Pool(options['processes'], initializer=init_worker) as pool:
+            generated = sum(pool.imap_unordered(generate_static_detail_html, sku_ids, chunksize=20))
+        elapsed = time.perf_counter() - start
+
+        if not options['sku']:
+            remove_expired_detail_html()
+        self.stdout.write('生成%d个详情页，耗时%.2fs，%.1f pages/sec' % (
+            generated, elapsed, generated / elapsed if elapsed else 0))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from goods.utils import get_list_cache_stats
+
+
+class Command(BaseCommand):
+    help = '查看商品列表缓存的命中率'
+
+    def handle(self, *args, **options):
+        stats = get_list_cache_stats()
+        self.stdout.write('hits: %(hits)d  misses: %(misses)d  hit_ratio: %(hit_ratio).2f%%' % dict(
+            stats, hit_ratio=stats['hit_ratio'] * 100))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from goods.utils import rebuild_hot_skus
+
+
+class Command(BaseCommand):
+    help = '从数据库重建所有三级类别的热销排行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, default=None, help='只重建指定类别的排行')
+
+    def handle(self, *args, **options):
+        count = rebuild_hot_skus(options['category'])
+        self.stdout.write('已重建%d个类别的热销排行' % count)
@@ -0,0 +1,92 @@
+import math
+
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, PageNotAnInteger
+from django.db.models import Q
+
+from . import contants
+
+
+class KeysetPaginator(object):
+    """
+    基于(排序字段, id)游标的分页器
+    每一页的起始游标缓存起来，翻页时从最近的游标开始查找，避免COUNT(*)和大OFFSET扫描
+    """
+
+    def __init__(self, queryset, sort_field, per_page, cache_key):
+        """
+        :param queryset: 要分页的查询集
+        :param sort_field: 排序字段，以'-'开头表示降序
+        :param per_page: 每页显示多少个数据
+        :param cache_key: 缓存总数量与分页游标时使用的键名前缀
+        """
+        self.desc = sort_field.startswith('-')
+        self.field = sort_field.lstrip('-')
+        # 以id作为第二排序字段，保证排序结果唯一
+        self.queryset = queryset.order_by(sort_field, '-id' if self.desc else 'id')
+        self.per_page = per_page
+        self.count_key = '%s_count' % cache_key
+        self.checkpoints_key = '%s_checkpoints' % cache_key
+
+    @property
+    def count(self):
+        """数据总数量，缓存一段时间，是一个近似值"""
+        count = cache.get(self.count_key)
+        if count is None:
+            count = self.queryset.count()
+            cache.set(self.count_key, count, contants.LIST_COUNT_CACHE_EXPIRES)
+        return count
+
+    @property
+    def num_pages(self):
+        """总页数"""
+        return max(math.ceil(self.count / self.per_page), 1)
+
+    def seek(self, cursor):
+        """获取游标之后的查询集"""
+        if cursor is None:
+            return self.queryset
+        value, pk = cursor
+        if self.desc:
+            return self.queryset.filter(Q(**{'%s__lt' % self.field: value}) | Q(**{self.field: value, 'id__lt': pk}))
+        return self.queryset.filter(Q(**{'%s__gt' % self.field: value}) | Q(**{self.field: value, 'id__gt': pk}))
+
+    def page(self, number):
+        """
+        获取指定页面的数据
+        :param number: 页码
+        :return: 当前页的数据列表
+        """
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('页码不是整数')
+        if number < 1 or number > self.num_pages:
+            raise EmptyPage('当前页面不存在')
+
+        # 分页游标 {页码: 上一页最后一条数据的(排序字段值, id)}，第一页没有游标
+        checkpoints = cache.get(self.checkpoints_key) or {}
+        start = max([page for page in checkpoints if page <= number] + [1])
+        cursor = checkpoints.get(start)
+        if start < number:
+            # 从最近的游标处跳过中间的页，只查询排序字段和id
+            offset = (number - start) * self.per_page - 1
+            keys = list(self.seek(cursor).values_list(self.field, 'id')[offset:offset + 1])
+            if not keys:
+                raise EmptyPage('当前页面不存在')
+            cursor = keys[0]
+
+        page_objects = list(self.seek(cursor)[:self.per_page])
+        if not page_objects and number > 1:
+            raise EmptyPage('当前页面不存在')
+
+        # 记录当前页与下一页的游标，顺序翻页时只需一次索引查找
+        new_checkpoints = {number: cursor}
+        if len(page_objects) == self.per_page:
+            last = page_objects[-1]
+            new_checkpoints[number + 1] = (getattr(last, self.field), last.id)
+        if any(checkpoints.get(page) != value for page, value in new_checkpoints.items()):
+            checkpoints.update(new_checkpoints)
+            cache.set(self.checkpoints_key, checkpoints, contants.LIST_CHECKPOINTS_CACHE_EXPIRES)
+
+        return page_objects
@@ -0,0 +1,131 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, post_init
+from django.dispatch import receiver
+
+from celery_tasks.html.tasks import generate_detail_html, generate_all_detail_html
+from .models import GoodsCategory, GoodsChannel, SKU, SKUSpecification, SPUSpecification, SpecificationOption, \
+    SPU, SKUImage
+from .sku_cache import sku_cards, sku_stocks
+from .static_html import remove_detail_html
+from .utils import bump_category_version, delete_variant_matrix, bump_list_generation, update_hot_sku, \
+    remove_hot_sku
+
+
+def refresh_detail_html(sku_ids):
+    """删除过期的详情页静态文件，并在事务提交后异步重新生成"""
+    sku_ids = list(sku_ids)
+    for sku_id in sku_ids:
+        remove_detail_html(sku_id)
+    transaction.on_commit(lambda: generate_detail_html.delay(sku_ids))
+
+
+@receiver(post_save, sender=GoodsCategory)
+@receiver(post_delete, sender=GoodsCategory)
+@receiver(post_save, sender=GoodsChannel)
+@receiver(post_delete, sender=GoodsChannel)
+def category_changed(sender, **kwargs):
+    """商品类别或频道变化后递增类别版本号，并重新生成所有详情页"""
+    bump_category_version()
+    transaction.on_commit(lambda: generate_all_detail_html.delay())
+
+
+@receiver(post_save, sender=SKU)
+@receiver(post_delete, sender=SKU)
+@receiver(post_save, sender=SPUSpecification)
+@receiver(post_delete, sender=SPUSpecification)
+def sku_or_spec_changed(sender, instance, **kwargs):
+    """sku或spu规格变化后删除spu的规格选项矩阵缓存"""
+    delete_variant_matrix(instance.spu_id)
+
+
+@receiver(post_save, sender=SKUSpecification)
+@receiver(post_delete, sender=SKUSpecification)
+@receiver(post_save, sender=SpecificationOption)
+@receiver(post_delete, sender=SpecificationOption)
+def spec_option_changed(sender, instance, **kwargs):
+    """sku规格或规格选项变化后删除spu的规格选项矩阵缓存"""
+    spu_id = SPUSpecification.objects.filter(id=instance.spec_id).values_list('spu_id', flat=True).first()
+    if spu_id is not None:
+        delete_variant_matrix(spu_id)
+
+
+@receiver(post_save, sender=SKU)
+@receiver(post_delete, sender=SKU)
+def sku_changed(sender, instance, **kwargs):
+    """sku变化后重新生成同一spu下所有sku的详情页，规格选项链接会随之变化"""
+    sku_ids = set(SKU.objects.filter(spu_id=instance.spu_id).values_list('id', flat=True))
+    sku_ids.add(instance.id)
+    refresh_detail_html(sku_ids)
+
+
+@receiver(post_save, sender=SPU)
+def spu_changed(sender, instance, **kwargs):
+    """spu变化后重新生成其下所有sku的详情页"""
+    refresh_detail_html(SKU.objects.filter(spu_id=instance.id).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=SKUImage)
+@receiver(post_delete, sender=SKUImage)
+def sku_image_changed(sender, instance, **kwargs):
+    """sku图片变化后重新生成该sku的详情页"""
+    refresh_detail_html([instance.sku_id])
+
+
+@receiver(post_save, sender=SKUSpecification)
+@receiver(post_delete, sender=SKUSpecification)
+def sku_spec_changed(sender, instance, **kwargs):
+    """sku规格变化后重新生成同一spu下所有sku的详情页"""
+    refresh_detail_html(SKU.objects.filter(spu__specs__id=instance.spec_id).values_list('id', flat=True))
+
+
+# 影响商品列表排序与筛选的sku字段
+LIST_FIELDS = ('category_id', 'is_launched', 'price', 'sales', 'create_time')
+
+
+def get_list_fields(instance):
+    """获取sku影响商品列表的字段值"""
+    return tuple(instance.__dict__.get(field) for field in LIST_FIELDS)
+
+
+@receiver(post_init, sender=SKU)
+def sku_loaded(sender, instance, **kwargs):
+    """记录sku加载时影响商品列表的字段值"""
+    instance._list_fields = get_list_fields(instance)
+
+
+@receiver(post_save, sender=SKU)
+def sku_list_changed(sender, instance, created, **kwargs):
+    """影响商品列表的字段变化后使新旧类别的列表缓存失效"""
+    old_fields = instance._list_fields
+    new_fields = get_list_fields(instance)
+    if created or old_fields != new_fields:
+        bump_list_generation(instance.category_id)
+        if old_fields[0] is not None and old_fields[0] != instance.category_id:
+            bump_list_generation(old_fields[0])
+    instance._list_fields = new_fields
+    # 更新热销排行
+    update_hot_sku(instance, old_fields[0])
+
+
+@receiver(post_delete, sender=SKU)
+def sku_list_deleted(sender, instance, **kwargs):
+    """sku删除后使所属类别的列表缓存失效，并移出热销排行"""
+    bump_list_generation(instance.category_id)
+    remove_hot_sku(instance)
+
+
+@receiver(post_save, sender=SKU)
+@receiver(post_delete, sender=SKU)
+def sku_card_changed(sender, instance, **kwargs):
+    """sku修改或删除后删除其卡片缓存和价格库存快照"""
+    sku_cards.invalidate(instance.id)
+    sku_stocks.invalidate(instance.id)
+    # 事务提交前其他请求可能读到旧数据重新写入卡片和快照，提交后再删除一次
+    # 删除sku后instance.id会被置为None，先保存id
+    sku_id = instance.id
+
+    def invalidate_on_commit():
+        sku_cards.invalidate(sku_id)
+        sku_stocks.invalidate(sku_id)
+
+    transaction.on_commit(invalidate_on_commit)
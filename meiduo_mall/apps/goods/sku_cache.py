@@ -0,0 +1,179 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+from django_redis import get_redis_connection
+
+from . import contants
+from .models import SKU
+
+
+class SKUCardCache(object):
+    """
+    sku卡片缓存
+    卡片只包含列表、热销、浏览记录、购物车等页面需要的字段，以json保存在redis中，
+    每个进程前面再加一层短时间过期的LRU缓存
+    """
+
+    def __init__(self, max_size=contants.SKU_CARD_LOCAL_MAX_SIZE, local_expires=contants.SKU_CARD_LOCAL_EXPIRES):
+        """
+        :param max_size: 进程内最多缓存的卡片数量
+        :param local_expires: 进程内缓存的过期时间单位秒，其他进程修改sku后最多延迟这么久生效
+        """
+        self.max_size = max_size
+        self.local_expires = local_expires
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_card(sku):
+        """将sku模型转换成卡片字典"""
+        return {
+            'id': sku.id,
+            'name': sku.name,
+            'price': str(sku.price),
+            # 没有图片的sku使用空字符串，不能让一个sku导致整批卡片获取失败
+            'default_image_url': sku.default_image.url if sku.default_image else '',
+            'category_id': sku.category_id,
+            'is_launched': sku.is_launched,
+        }
+
+    def _get_local(self, sku_ids):
+        """从进程内缓存中获取未过期的卡片"""
+        now = time.time()
+        cards = {}
+        with self._lock:
+            for sku_id in sku_ids:
+                item = self._local.get(sku_id)
+                if item is None:
+                    continue
+                if item[0] < now:
+                    del self._local[sku_id]
+                    continue
+                self._local.move_to_end(sku_id)
+                cards[sku_id] = item[1]
+        return cards
+
+    def _set_local(self, cards):
+        """保存卡片到进程内缓存，超出容量时淘汰最久未使用的卡片"""
+        expire_time = time.time() + self.local_expires
+        with self._lock:
+            for sku_id, card in cards.items():
+                self._local[sku_id] = (expire_time, card)
+                self._local.move_to_end(sku_id)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    def get_many(self, sku_ids):
+        """
+        批量获取sku卡片，依次读取进程内缓存、redis，仍未命中的sku一次查询数据库
+        :param sku_ids: sku_id列表
+        :return: {sku_id: 卡片字典}，不存在的sku不包含在内
+        """
+        sku_ids = [int(sku_id) for sku_id in sku_ids]
+        cards = self._get_local(sku_ids)
+        miss_ids = [sku_id for sku_id in sku_ids if sku_id not in cards]
+        if not miss_ids:
+            return cards
+
+        redis_conn = get_redis_connection('default')
+        redis_cards = {}
+        for sku_id, card_json in zip(miss_ids, redis_conn.mget(['sku_card_%s' % sku_id for sku_id in miss_ids])):
+            if card_json is not None:
+                redis_cards[sku_id] = json.loads(card_json.decode())
+
+        db_ids = [sku_id for sku_id in miss_ids if sku_id not in redis_cards]
+        if db_ids:
+            db_cards = {}
+            sku_qs = SKU.objects.filter(id__in=db_ids).only(
+                'id', 'name', 'price', 'default_image', 'category_id', 'is_launched')
+            for sku in sku_qs:
+                db_cards[sku.id] = self.make_card(sku)
+            if db_cards:
+                pl = redis_conn.pipeline()
+                for sku_id, card in db_cards.items():
+                    pl.setex('sku_card_%s' % sku_id, contants.SKU_CARD_CACHE_EXPIRES, json.dumps(card))
+                pl.execute()
+            redis_cards.update(db_cards)
+
+        self._set_local(redis_cards)
+        cards.update(redis_cards)
+        return cards
+
+    def get(self, sku_id):
+        """获取单个sku卡片，不存在时返回None"""
+        return self.get_many([sku_id]).get(int(sku_id))
+
+    def invalidate(self, sku_id):
+        """sku修改或删除后删除其卡片缓存"""
+        get_redis_connection('default').delete('sku_card_%s' % sku_id)
+        with self._lock:
+            self._local.pop(int(sku_id), None)
+
+
+class SKUStockCache(object):
+    """
+    sku价格库存快照
+    购物车、结算页每次渲染都需要最新的价格和库存，快照以json保存在redis中，过期时间很短，
+    sku保存或下单扣减库存后主动删除
+    """
+
+    @staticmethod
+    def make_snapshot(sku):
+        """将sku模型转换成价格库存快照"""
+        return {
+            'price': str(sku.price),
+            'stock': sku.stock,
+            'is_launched': sku.is_launched,
+        }
+
+    def get_many(self, sku_ids):
+        """
+        批量获取价格库存快照，未命中的sku一次查询数据库
+        :return: {sku_id: {'price', 'stock', 'is_launched'}}，不存在的sku不包含在内
+        """
+        sku_ids = [int(sku_id) for sku_id in sku_ids]
+        if not sku_ids:
+            return {}
+        redis_conn = get_redis_connection('default')
+        snapshots = {}
+        for sku_id, snapshot_json in zip(sku_ids, redis_conn.mget(['sku_stock_%s' % sku_id for sku_id in sku_ids])):
+            if snapshot_json is not None:
+                snapshots[sku_id] = json.loads(snapshot_json.decode())
+
+        miss_ids = [sku_id for sku_id in sku_ids if sku_id not in snapshots]
+        if miss_ids:
+            pl = redis_conn.pipeline()
+            for sku in SKU.objects.filter(id__in=miss_ids).only('id', 'price', 'stock', 'is_launched'):
+                snapshots[sku.id] = self.make_snapshot(sku)
+                pl.setex('sku_stock_%s' % sku.id, contants.SKU_STOCK_CACHE_EXPIRES, json.dumps(snapshots[sku.id]))
+            pl.execute()
+        return snapshots
+
+    def check_cart(self, cart_counts):
+        """
+        校验整个购物车的价格与库存
+        :param cart_counts: {sku_id: count}
+        :return: {sku_id: {'price': Decimal, 'available': 库存是否充足且已上架, 'is_launched': 是否上架}}
+        """
+        result = {}
+        for sku_id, snapshot in self.get_many(cart_counts.keys()).items():
+            result[sku_id] = {
+                'price': Decimal(snapshot['price']),
+                'available': snapshot['is_launched'] and snapshot['stock'] >= cart_counts[sku_id],
+                'is_launched': snapshot['is_launched'],
+            }
+        return result
+
+    def invalidate(self, *sku_ids):
+        """sku修改或库存变化后删除其快照"""
+        if sku_ids:
+            get_redis_connection('default').delete(*['sku_stock_%s' % sku_id for sku_id in sku_ids])
+
+
+# sku卡片缓存单例
+sku_cards = SKUCardCache()
+# sku价格库存快照单例
+sku_stocks = SKUStockCache()
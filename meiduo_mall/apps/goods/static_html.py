@@ -0,0 +1,114 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.template import loader
+
+from contents.utils import get_categories
+from .models import SKU
+from .utils import get_breadcrumb, get_variant_matrix, get_category_version
+
+
+def get_detail_context(sku):
+    """
+    构造商品详情页的模板数据
+    :param sku: 要显示的sku模型对象，需已关联查询出spu
+    :return: 模板上下文字典
+    """
+    breadcrumb = get_breadcrumb(sku.category_id)  # 面包屑导航
+    category = breadcrumb['cat3']  # 获取当前sku所对应的三级分类
+
+    # 查询当前sku所对应的spu
+    spu = sku.spu
+
+    # 获取spu的规格选项矩阵 {'specs': [...], 'sku_options': {...}, 'spec_sku_map': {(8, 11): 3, (8, 12): 4}}
+    matrix = get_variant_matrix(spu.id)
+    spec_sku_map = matrix['spec_sku_map']
+
+    """1.准备当前商品的规格选项列表 [8, 11]"""
+    current_sku_option_ids = list(matrix['sku_options'].get(sku.id, ()))
+
+    """2.组合 并找到sku_id 绑定"""
+    spu_spec_qs = []
+    for index, spec in enumerate(matrix['specs']):  # 遍历当前所有的规格
+        temp_option_ids = current_sku_option_ids[:]  # 复制一个新的当前显示商品的规格选项列表
+        spec_options = []
+        for option in spec['options']:  # 遍历当前规格下的所有选项
+            temp_option_ids[index] = option['id']  # [8, 12]
+            spec_options.append({
+                'id': option['id'],
+                'value': option['value'],
+                'sku_id': spec_sku_map.get(tuple(temp_option_ids)),  # 给每个选项绑定他的sku_id
+            })
+        # 把规格下的所有选项绑定到规格的spec_options上
+        spu_spec_qs.append({'id': spec['id'], 'name': spec['name'], 'spec_options': spec_options})
+
+    return {
+        'categories': get_categories(),  # 商品分类
+        'breadcrumb': breadcrumb,  # 面包屑导航
+        'sku': sku,  # 当前要显示的sku模型对象
+        'category': category,  # 当前的显示sku所属的三级类别
+        'spu': spu,  # sku所属的spu
+        'spec_qs': spu_spec_qs,  # 当前商品的所有规格数据
+    }
+
+
+def get_detail_html_dir(version=None):
+    """
+    获取详情页静态文件目录
+    目录以商品类别版本号区分，类别或频道变化后旧目录下的文件自动失效
+    """
+    if version is None:
+        version = get_category_version()
+    return os.path.join(settings.GENERATED_STATIC_HTML_FILES_DIR, 'detail', str(version))
+
+
+def get_detail_html_path(sku_id, version=None):
+    """获取sku详情页静态文件的路径"""
+    return os.path.join(get_detail_html_dir(version), '%s.html' % sku_id)
+
+
+def save_static_html(file_path, html_text):
+    """先写入临时文件再重命名，保证读取方不会读到写了一半的文件"""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temp_path = '%s.%s.tmp' % (file_path, os.getpid())
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(html_text)
+    os.replace(temp_path, file_path)
+
+
+def remove_detail_html(sku_id):
+    """删除sku详情页静态文件，之后的请求会回退到动态渲染"""
+    try:
+        os.remove(get_detail_html_path(sku_id))
+    except FileNotFoundError:
+        pass
+
+
+def generate_static_detail_html(sku_id):
+    """
+    生成sku详情页静态文件
+    :param sku_id: 商品sku的id
+    :return: 是否生成了静态文件，sku不存在或未上架时只删除旧文件
+    """
+    sku = SKU.objects.select_related('spu').filter(id=sku_id, is_launched=True).first()
+    if sku is None:
+        remove_detail_html(sku_id)
+        return False
+
+    template = loader.get_template('detail.html')
+    html_text = template.render(get_detail_context(sku))
+    save_static_html(get_detail_html_path(sku_id), html_text)
+    return True
+
+
+def remove_expired_detail_html():
+    """删除旧类别版本号下的详情页静态文件目录"""
+    base_dir = os.path.join(settings.GENERATED_STATIC_HTML_FILES_DIR, 'detail')
+    current_dir = get_detail_html_dir()
+    if not os.path.isdir(base_dir):
+        return
+    for name in os.listdir(base_dir):
+        path = os.path.join(base_dir, name)
+        if path != current_dir:
+            shutil.rmtree(path, ignore_errors=True)
@@ -1,17 +1,402 @@
-def get_breadcrumb(category):
+import datetime
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Case, When, Value, IntegerField, F
+from django.db.models.functions import Greatest
+from django_redis import get_redis_connection
+
+from meiduo_mall.utils.locks import release_lock
+from . import contants
+from .models import GoodsCategory, SPUSpecification, SpecificationOption, SKUSpecification, SKU, GoodsVisitCount
+from .paginator import KeysetPaginator
+from .sku_cache import sku_cards
+
+# 进程内缓存的面包屑祖先索引 (版本号, 索引)
+_breadcrumb_index = (None, None)
+# 面包屑查询统计：查询次数、索引重建次数、命中索引时执行的sql条数
+breadcrumb_stats = {'lookups': 0, 'rebuilds': 0, 'hot_path_queries': 0}
+
+
+def get_version(key):
+    """获取缓存版本号，版本号变化后以旧版本号为键的缓存全部失效"""
+    version = cache.get(key)
+    if version is None:
+        # 版本号丢失时以当前毫秒时间戳作为初始值，避免与旧版本号重复
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    """递增缓存版本号"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # 版本号不存在时直接初始化
+        get_version(key)
+
+
+def get_category_version():
+    """获取商品类别数据的版本号"""
+    return get_version(contants.CATEGORY_VERSION_KEY)
+
+
+def bump_category_version():
+    """商品类别或频道发生变化时递增版本号，使各级缓存失效"""
+    bump_version(contants.CATEGORY_VERSION_KEY)
+
+
+def build_breadcrumb_index():
+    """
+    一次查询tb_goods_category构建祖先索引
+    :return: {类别id: {'cat1': 一级类别, 'cat2': 二级类别, 'cat3': 三级类别}}
+    """
+    # 左连接商品频道，同时取出一级类别的频道链接
+    rows = GoodsCategory.objects.order_by('id', 'goodschannel__id').values_list(
+        'id', 'name', 'parent_id', 'goodschannel__url')
+    cat_dict = {}
+    for cat_id, name, parent_id, url in rows:
+        # 一个一级类别对应多个频道时只取第一个频道的链接
+        if cat_id in cat_dict:
+            continue
+        cat = GoodsCategory(id=cat_id, name=name, parent_id=parent_id)
+        cat.url = url
+        cat_dict[cat_id] = cat
+
+    index = {}
+    for cat_id, cat in cat_dict.items():
+        # 由当前类别向上查找所有祖先类别
+        chain = [cat]
+        while chain[-1].parent_id in cat_dict and len(chain) < 3:
+            chain.append(cat_dict[chain[-1].parent_id])
+        chain.reverse()
+        chain += [None] * (3 - len(chain))
+        index[cat_id] = {
+            'cat1': chain[0],
+            'cat2': chain[1],
+            'cat3': chain[2]
+        }
+    return index
+
+
+def get_breadcrumb_index():
+    """获取面包屑祖先索引，类别版本号变化时重新构建"""
+    global _breadcrumb_index
+    version = get_category_version()
+    local_version, index = _breadcrumb_index
+    if local_version != version:
+        index = build_breadcrumb_index()
+        _breadcrumb_index = (version, index)
+        breadcrumb_stats['rebuilds'] += 1
+    return index
+
+
+def get_breadcrumb(category_id):
     """
     面包屑导航
-    :param category: 当前选择的三级类别
-    :return:
-    """
-    # 获取一级类别
-    cat1 = category.parent.parent
-    # 给一级类型多指定一个url
-    cat1.url = cat1.goodschannel_set.all()[0].url
-    breadcrumb = {
-        'cat1': cat1,
-        'cat2': category.parent,
-        'cat3': category
-    }
+    :param category_id: 当前选择的三级类别id
+    :return: {'cat1': 带url的一级类别, 'cat2': 二级类别, 'cat3': 三级类别}
+    """
+    if settings.DEBUG:
+        # 调试模式下统计热路径上执行的sql条数，索引命中时应始终为0
+        query_count = len(connection.queries)
+        rebuilds = breadcrumb_stats['rebuilds']
+    breadcrumb = get_breadcrumb_index().get(int(category_id))
+    breadcrumb_stats['lookups'] += 1
+    if settings.DEBUG and rebuilds == breadcrumb_stats['rebuilds']:
+        breadcrumb_stats['hot_path_queries'] += len(connection.queries) - query_count
 
     return breadcrumb
+
+
+def build_variant_matrix(spu_id):
+    """
+    构建spu的规格选项矩阵（固定三次查询，与sku数量无关）
+    :param spu_id: 商品spu的id
+    :return: {
+        'specs': [{'id': 规格id, 'name': 规格名称, 'options': [{'id': 选项id, 'value': 选项值}]}],
+        'sku_options': {sku_id: (选项id, ...)},
+        'spec_sku_map': {(选项id, ...): sku_id}
+    }
+    """
+    # 当前spu中的所有规格
+    specs = []
+    spec_dict = {}
+    for spec_id, name in SPUSpecification.objects.filter(spu_id=spu_id).order_by('id').values_list('id', 'name'):
+        spec_dict[spec_id] = {'id': spec_id, 'name': name, 'options': []}
+        specs.append(spec_dict[spec_id])
+    # 所有规格下的所有选项
+    options_qs = SpecificationOption.objects.filter(spec__spu_id=spu_id).order_by('id')
+    for option_id, spec_id, value in options_qs.values_list('id', 'spec_id', 'value'):
+        spec_dict[spec_id]['options'].append({'id': option_id, 'value': value})
+    # 当前spu下每个sku的规格选项，按规格id排序
+    sku_options = {}
+    sku_specs_qs = SKUSpecification.objects.filter(sku__spu_id=spu_id).order_by('sku_id', 'spec_id')
+    for sku_id, option_id in sku_specs_qs.values_list('sku_id', 'option_id'):
+        sku_options.setdefault(sku_id, []).append(option_id)
+    sku_options = {sku_id: tuple(option_ids) for sku_id, option_ids in sku_options.items()}
+
+    return {
+        'specs': specs,
+        'sku_options': sku_options,
+        'spec_sku_map': {option_ids: sku_id for sku_id, option_ids in sku_options.items()},
+    }
+
+
+def get_variant_matrix(spu_id):
+    """获取spu的规格选项矩阵，优先读取缓存"""
+    cache_key = 'variant_matrix_%s' % spu_id
+    matrix = cache.get(cache_key)
+    if matrix is None:
+        matrix = build_variant_matrix(spu_id)
+        cache.set(cache_key, matrix, contants.VARIANT_MATRIX_CACHE_EXPIRES)
+    return matrix
+
+
+def delete_variant_matrix(spu_id):
+    """spu下的sku或规格发生变化时删除规格选项矩阵缓存"""
+    cache.delete('variant_matrix_%s' % spu_id)
+
+
+def bump_list_generation(category_id):
+    """类别下的商品列表发生变化时递增列表版本号，使该类别的列表缓存全部失效"""
+    bump_version('list_generation_%s' % category_id)
+
+
+def get_list_page(category_id, sort, sort_field, page_num):
+    """
+    获取类别商品列表的一页数据，按(类别, 版本号, 排序, 页码)缓存当前页的sku_id与总页数
+    :return: (当前页的sku卡片列表, 总页数)，页码不存在时抛出EmptyPage
+    """
+    generation = get_version('list_generation_%s' % category_id)
+    cache_prefix = 'list_%s_%s_%s' % (category_id, generation, sort)
+    cache_key = '%s_%s' % (cache_prefix, page_num)
+    page_data = cache.get(cache_key)
+    if page_data is None:
+        _incr_list_stat('misses')
+        # 获取当前三级商品中所有上架的商品，分页时只需要查询id和排序字段
+        sku_qs = SKU.objects.filter(category_id=category_id, is_launched=True).only('id', sort_field.lstrip('-'))
+        # 创建游标分页对象KeysetPaginator(要分页的所有数据， 排序字段， 每页展示多少个数据， 缓存键名)
+        paginator = KeysetPaginator(sku_qs, sort_field, 5, cache_prefix)
+        page_data = {
+            'sku_ids': [sku.id for sku in paginator.page(page_num)],
+            'total_page': paginator.num_pages
+        }
+        cache.set(cache_key, page_data, contants.LIST_PAGE_CACHE_EXPIRES)
+    else:
+        _incr_list_stat('hits')
+
+    # 通过sku卡片缓存取出当前页的sku，并保持原有顺序
+    cards = sku_cards.get_many(page_data['sku_ids'])
+    page_skus = [cards[sku_id] for sku_id in page_data['sku_ids'] if sku_id in cards]
+    return page_skus, page_data['total_page']
+
+
+def _incr_list_stat(name):
+    """累加商品列表缓存的命中/未命中次数"""
+    key = 'list_cache_%s' % name
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def get_list_cache_stats():
+    """获取商品列表缓存的命中统计"""
+    stats = cache.get_many(['list_cache_hits', 'list_cache_misses'])
+    hits = stats.get('list_cache_hits', 0)
+    misses = stats.get('list_cache_misses', 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0
+    }
+
+
+# 仅当热销排行已构建时才更新sku的销量分数，避免生成不完整的排行
+ZADD_IF_EXISTS_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('zadd', KEYS[1], ARGV[1], ARGV[2])
+end
+return 0
+"""
+
+
+def rebuild_hot_skus(category_id=None):
+    """
+    从数据库重建三级类别的热销排行(redis有序集合，分数为销量)
+    :param category_id: 只重建指定类别，为None时重建所有类别
+    :return: 重建的类别数量
+    """
+    sku_qs = SKU.objects.filter(is_launched=True)
+    if category_id is not None:
+        sku_qs = sku_qs.filter(category_id=category_id)
+    hot_dict = {}
+    for sku_id, cat_id, sales in sku_qs.values_list('id', 'category_id', 'sales'):
+        hot_dict.setdefault(cat_id, {})[sku_id] = sales
+
+    redis_conn = get_redis_connection('default')
+    pl = redis_conn.pipeline()
+    if category_id is None:
+        # 删除已下架或已没有商品的类别的排行
+        for key in redis_conn.scan_iter('hot_skus_*'):
+            pl.delete(key)
+    else:
+        pl.delete('hot_skus_%s' % category_id)
+    for cat_id, sku_sales in hot_dict.items():
+        args = []
+        for sku_id, sales in sku_sales.items():
+            args.extend([sales, sku_id])
+        pl.execute_command('ZADD', 'hot_skus_%s' % cat_id, *args)
+    pl.execute()
+    return len(hot_dict)
+
+
+def update_hot_sku(sku, old_category_id=None):
+    """sku变化后更新热销排行中的销量或将其移除"""
+    redis_conn = get_redis_connection('default')
+    pl = redis_conn.pipeline()
+    if old_category_id is not None and old_category_id != sku.category_id:
+        pl.zrem('hot_skus_%s' % old_category_id, sku.id)
+    if sku.is_launched:
+        pl.eval(ZADD_IF_EXISTS_SCRIPT, 1, 'hot_skus_%s' % sku.category_id, sku.sales, sku.id)
+        # 类别有了上架商品，删除空排行标记，下次访问时重建排行
+        pl.delete('hot_skus_empty_%s' % sku.category_id)
+    else:
+        pl.zrem('hot_skus_%s' % sku.category_id, sku.id)
+    pl.execute()
+
+
+def remove_hot_sku(sku):
+    """sku删除后将其移出热销排行"""
+    get_redis_connection('default').zrem('hot_skus_%s' % sku.category_id, sku.id)
+
+
+def incr_hot_skus_sales(sku_sales):
+    """
+    下单成功后增加热销排行中的销量
+    :param sku_sales: [(三级类别id, sku_id, 购买数量), ...]
+    """
+    redis_conn = get_redis_connection('default')
+    pl = redis_conn.pipeline()
+    for category_id, sku_id, count in sku_sales:
+        # XX只更新已在排行中的sku，排行未构建时不做任何操作
+        pl.execute_command('ZADD', 'hot_skus_%s' % category_id, 'XX', 'INCR', count, sku_id)
+    pl.execute()
+
+
+def get_hot_skus(category_id, count=contants.HOT_SKUS_COUNT):
+    """
+    获取三级类别中销量最高的count个sku
+    热销排行与sku卡片都命中缓存时不查询数据库，类别不存在时返回None
+    """
+    key = 'hot_skus_%s' % category_id
+    empty_key = 'hot_skus_empty_%s' % category_id
+    redis_conn = get_redis_connection('default')
+    pl = redis_conn.pipeline()
+    pl.exists(key)
+    pl.zrevrange(key, 0, count - 1)
+    pl.get(empty_key)
+    exists, sku_ids, empty = pl.execute()
+    if not exists:
+        if empty is not None:
+            # 空排行标记: 1类别存在但没有上架商品 0类别不存在
+            return [] if empty == b'1' else None
+        # 排行尚未构建时先从数据库构建当前类别的排行
+        rebuild_hot_skus(category_id)
+        sku_ids = redis_conn.zrevrange(key, 0, count - 1)
+        if not sku_ids:
+            category_exists = GoodsCategory.objects.filter(id=category_id).exists()
+            redis_conn.set(empty_key, int(category_exists), ex=contants.HOT_SKUS_EMPTY_EXPIRES)
+            if not category_exists:
+                return None
+    sku_ids = [int(sku_id) for sku_id in sku_ids]
+    cards = sku_cards.get_many(sku_ids)
+    hot_skus = []
+    for sku_id in sku_ids:
+        if sku_id in cards:
+            card = cards[sku_id]
+            hot_skus.append({
+                'id': card['id'],
+                'name': card['name'],
+                'price': card['price'],
+                'default_image_url': card['default_image_url']
+            })
+    return hot_skus
+
+
+def incr_visit_count(category_id):
+    """在redis中累加类别当天的访问量"""
+    day = datetime.date.today().strftime('%Y%m%d')
+    key = 'visit_counts_%s' % day
+    redis_conn = get_redis_connection('default')
+    pl = redis_conn.pipeline()
+    pl.hincrby(key, category_id, 1)
+    pl.expire(key, contants.VISIT_COUNTS_EXPIRES)
+    # 记录有访问量的日期，写入数据库时按日期处理
+    pl.sadd(contants.VISIT_COUNTS_DAYS_KEY, day)
+    pl.execute()
+
+
+def flush_visit_counts(day):
+    """
+    将redis中某一天的类别访问量写入tb_goods_visit
+    redis中保存的是当天的累计访问量，数据库中的访问量取两者中较大的值：
+    重复执行或中途失败后重新执行结果不变，redis数据丢失后累计值变小也不会覆盖数据库中已有的访问量
+    :param day: datetime.date 统计日期
+    :return: 写入的类别数量
+    """
+    key = 'visit_counts_%s' % day.strftime('%Y%m%d')
+    redis_conn = get_redis_connection('default')
+    counts = {int(cat_id): int(count) for cat_id, count in redis_conn.hgetall(key).items()}
+    if not counts:
+        return 0
+
+    with transaction.atomic():
+        # 已存在的记录使用一条update语句批量修改
+        visit_qs = GoodsVisitCount.objects.filter(date=day, category_id__in=counts.keys())
+        existing_ids = set(visit_qs.values_list('category_id', flat=True))
+        if existing_ids:
+            visit_qs.update(count=Case(
+                *[When(category_id=cat_id, then=Greatest(F('count'), Value(counts[cat_id])))
+                  for cat_id in existing_ids],
+                default=F('count'),
+                output_field=IntegerField()
+            ))
+        new_visits = [GoodsVisitCount(category_id=cat_id, count=count)
+                      for cat_id, count in counts.items() if cat_id not in existing_ids]
+        if day == datetime.date.today():
+            GoodsVisitCount.objects.bulk_create(new_visits)
+        else:
+            # date字段为auto_now_add，补写往日数据时需要创建后再修改日期
+            for visit in new_visits:
+                visit.save()
+                GoodsVisitCount.objects.filter(id=visit.id).update(date=day)
+    return len(counts)
+
+
+def flush_pending_visit_counts():
+    """将所有日期未写入的类别访问量写入数据库，同一时间只允许一个任务执行"""
+    redis_conn = get_redis_connection('default')
+    # 锁的值是随机令牌，释放时只删除自己加的锁
+    token = secrets.token_hex(8)
+    if not redis_conn.set('visit_counts_flush_lock', token, nx=True, ex=contants.VISIT_FLUSH_LOCK_EXPIRES):
+        return 0
+    try:
+        today = datetime.date.today()
+        flushed = 0
+        for day in sorted(redis_conn.smembers(contants.VISIT_COUNTS_DAYS_KEY)):
+            day = datetime.datetime.strptime(day.decode(), '%Y%m%d').date()
+            flushed += flush_visit_counts(day)
+            # 往日的访问量不会再增加，写入后不再处理；访问量已过期的日期同样移除
+            if day < today:
+                redis_conn.srem(contants.VISIT_COUNTS_DAYS_KEY, day.strftime('%Y%m%d'))
+        return flushed
+    finally:
+        release_lock(redis_conn, 'visit_counts_flush_lock', token)
@@ -4,12 +4,12 @@ from django import http
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.shortcuts import render
 from meiduo_mall.utils.response_code import RETCODE
-from django.utils import timezone
 from django.views import View
 from contents.utils import get_categories
-from goods import models
-from goods.models import SKU, GoodsCategory, GoodsVisitCount
-from goods.utils import get_breadcrumb
+from goods import models, contants
+from goods.models import SKU
+from goods.static_html import get_detail_context, get_detail_html_path
+from goods.utils import get_breadcrumb, get_list_page, get_hot_skus, incr_visit_count
 from meiduo_mall.utils.response_code import RETCODE
 from meiduo_mall.utils.views import LoginRequiredView
 from meiduo_mall.utils.response_code import RETCODE
@@ -31,23 +31,16 @@ class ListView(View):
         if sort == 'price':
             sort_field = 'price'
         elif sort == 'hot':
-            sort_field = 'hot'
+            sort_field = '-sales'
         else:
             sort = 'default'
             sort_field = '-create_time'
 
-        # 获取当前三级商品中所有上架的商品
-        # sku_qs = category.sku_set.filter(is_launched=True)
-        sku_qs = SKU.objects.filter(category=category, is_launched=True).order_by(sort_field)
-        # 创建分页对象Paginator(要分页的所有数据， 每页展示多少个数据)
-        paginator = Paginator(sku_qs, 5)
         try:
-            # 获取指定页面的数据
-            page_skus = paginator.page(page_num)
+            # 获取指定页面的数据及总页数，优先读取列表缓存
+            page_skus, total_page = get_list_page(category.id, sort, sort_field, page_num)
         except EmptyPage:
             return http.HttpResponseForbidden('当前页面不存在')
-        # 获取总页数
-        total_page = paginator.num_pages
 
         # 查询商品频道分类
         # categories = get_categories()
@@ -57,7 +50,7 @@ class ListView(View):
         # 渲染页面
         context = {
             'categories': get_categories(),  # 商品频道分类
-            'breadcrumb': get_breadcrumb(category),  # 面包屑导航
+            'breadcrumb': get_breadcrumb(category.id),  # 面包屑导航
             'sort': sort,  # 排序字段
             'category': category,  # 第三级商品
             'page_skus': page_skus,  # 分页后数据
@@ -72,22 +65,16 @@ class HotGoodsView(View):
     """商品热搜排行"""
 
     def get(self, request, category_id):
+        # 获取前端传入的商品数量，默认返回人气最高的两个数据
         try:
-            category = GoodsCategory.objects.get(id=category_id)
-        except GoodsCategory.DoesNotExist:
+            count = int(request.GET.get('count', contants.HOT_SKUS_COUNT))
+        except ValueError:
+            return http.HttpResponseForbidden('参数格式不正确')
+        count = min(max(count, 1), contants.HOT_SKUS_MAX_COUNT)
+        # 从redis热销排行中获取三级类别下人气最高的商品
+        hots = get_hot_skus(category_id, count)
+        if hots is None:
             return http.HttpResponseForbidden('GoodsCategory does not exist')
-        # 获取所有三级商品人气最高的两个数据
-        sku_qs = SKU.objects.filter(category=category, is_launched=True).order_by('-sales')[:2]
-        # 定义一个列表用来包装商品
-        hots = []
-        # 遍历查询集，将模型转换为字典
-        for sku in sku_qs:
-            hots.append({
-                'id': sku.id,
-                'name': sku.name,
-                'price': sku.price,
-                'default_image_url': sku.default_image.url
-            })
 
         return http.JsonResponse({'code': RETCODE.OK, 'errmsg': 'ok', 'hot_skus': hots})
 
@@ -96,61 +83,19 @@ class DetailView(View):
     """商品详情界面"""
 
     def get(self, request, sku_id):
+        # 详情页已静态化且未过期时直接响应静态文件，文件不存在或刚被删除时动态渲染
+        try:
+            return http.FileResponse(open(get_detail_html_path(sku_id), 'rb'),
+                                     content_type='text/html; charset=utf-8')
+        except FileNotFoundError:
+            pass
 
         try:
-            sku = SKU.objects.get(id=sku_id)
+            sku = SKU.objects.select_related('spu').get(id=sku_id)
         except SKU.DoesNotExist:
             return render(request, '404.html')
 
-        category = sku.category  # 获取当前sku所对应的三级分类
-
-        # 查询当前sku所对应的spu
-        spu = sku.spu
-
-        """1.准备当前商品的规格选项列表 [8, 11]"""
-        # 获取出当前正显示的sku商品的规格选项id列表
-        current_sku_spec_qs = sku.specs.order_by('spec_id')
-        current_sku_option_ids = []  # [8, 11]
-        for current_sku_spec in current_sku_spec_qs:
-            current_sku_option_ids.append(current_sku_spec.option_id)
-
-        """2.构造规格选择仓库
-        {(8, 11): 3, (8, 12): 4, (9, 11): 5, (9, 12): 6, (10, 11): 7, (10, 12): 8}
-        """
-        # 构造规格选择仓库
-        temp_sku_qs = spu.sku_set.all()  # 获取当前spu下的所有sku
-        # 选项仓库大字典
-        spec_sku_map = {}  # {(8, 11): 3, (8, 12): 4, (9, 11): 5, (9, 12): 6, (10, 11): 7, (10, 12): 8}
-        for temp_sku in temp_sku_qs:
-            # 查询每一个sku的规格数据
-            temp_spec_qs = temp_sku.specs.order_by('spec_id')
-            temp_sku_option_ids = []  # 用来包装每个sku的选项值
-            for temp_spec in temp_spec_qs:
-                temp_sku_option_ids.append(temp_spec.option_id)
-            spec_sku_map[tuple(temp_sku_option_ids)] = temp_sku.id
-
-        """3.组合 并找到sku_id 绑定"""
-        spu_spec_qs = spu.specs.order_by('id')  # 获取当前spu中的所有规格
-
-        for index, spec in enumerate(spu_spec_qs):  # 遍历当前所有的规格
-            spec_option_qs = spec.options.all()  # 获取当前规格中的所有选项
-            temp_option_ids = current_sku_option_ids[:]  # 复制一个新的当前显示商品的规格选项列表
-            for option in spec_option_qs:  # 遍历当前规格下的所有选项
-                temp_option_ids[index] = option.id  # [8, 12]
-                option.sku_id = spec_sku_map.get(tuple(temp_option_ids))  # 给每个选项对象绑定下他sku_id属性
-
-            spec.spec_options = spec_option_qs  # 把规格下的所有选项绑定到规格对象的spec_options属性上
-
-        context = {
-            'categories': get_categories(),  # 商品分类
-            'breadcrumb': get_breadcrumb(category),  # 面包屑导航
-            'sku': sku,  # 当前要显示的sku模型对象
-            'category': category,  # 当前的显示sku所属的三级类别
-            'spu': spu,  # sku所属的spu
-            'spec_qs': spu_spec_qs,  # 当前商品的所有规格数据
-        }
-
-        return render(request, 'detail.html', context)
+        return render(request, 'detail.html', get_detail_context(sku))
 
 
 class DetailVisitView(View):
@@ -158,29 +103,11 @@ class DetailVisitView(View):
 
     def post(self, request, category_id):
 
-        # 校验category_id的真实有效性
-        try:
-            category = GoodsCategory.objects.get(id=category_id)
-        except GoodsCategory.DoesNotExist:
+        # 校验category_id的真实有效性，使用面包屑祖先索引不需要查询数据库
+        if get_breadcrumb(category_id) is None:
             return http.HttpResponseForbidden('category_id不存在')
-        # 创建时间对象获取到今天的日期
-        today = timezone.now()
-
-        try:
-            # 在统计商品类别表中查询当前的类别在今天有没有访问过的记录
-            goods_visit = GoodsVisitCount.objects.get(category=category, date=today)
-        except GoodsVisitCount.DoesNotExist:
-            # 如果查询不到说明今天此类别是第一次访问,  创建一个新的记录
-            # goods_visit = GoodsVisitCount.objects.create(
-            #     category=category
-            # )
-            goods_visit = GoodsVisitCount(category_id=category_id)
-            # goods_visit = GoodsVisitCount()
-            # goods_visit.category = category
-
-        # 如果查询到说明今天此类别已经访问过 对原count+=1 save
-        goods_visit.count += 1
-        goods_visit.save()
+        # 访问量先累加到redis中当天的hash里，由定时任务批量写入数据库
+        incr_visit_count(category_id)
 
         # 响应
         return http.JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK'})
@@ -0,0 +1,187 @@
+import logging
+import operator
+import random
+import time
+from collections import defaultdict
+from decimal import Decimal
+from functools import reduce
+
+from django.conf import settings
+from django.db import transaction, OperationalError
+from django.db.models import Case, When, F, Q
+
+from carts.redis_cart import RedisCart
+from goods.models import SKU, SPU
+from goods.sku_cache import sku_stocks
+from goods.utils import incr_hot_skus_sales, bump_list_generation
+from meiduo_mall.utils.response_code import RETCODE
+from . import contants, inventory
+from .expiry import schedule_order_expiry
+from .models import OrderInfo, OrderGoods
+
+logger = logging.getLogger('django')
+
+
+class StockError(Exception):
+    """商品不存在或库存不足"""
+    pass
+
+
+class StockConflict(Exception):
+    """校验库存后库存被并发修改，需要重试"""
+    pass
+
+
+class OrderAbandoned(Exception):
+    """异步订单已被超时取消，下单事务需要回滚"""
+    pass
+
+
+def _case_update(field, values, sign):
+    """
+    生成按主键分别增减字段的Case表达式
+    :param values: {id: 增减的数量}
+    :param sign: 1增加 -1减少
+    """
+    return Case(*[When(id=obj_id, then=F(field) + sign * value) for obj_id, value in values.items()],
+                default=F(field))
+
+
+def _commit_once(user, address, pay_method, status, order_id, cart_dict, reserved_ids, claim=None):
+    """在一个事务中完成一次下单，语句数量与商品数量无关"""
+    sku_ids = sorted(sku_id for sku_id in cart_dict if sku_id not in reserved_ids)
+    with transaction.atomic():
+        # 按主键顺序一次锁住所有sku，并发下单时加锁顺序一致，避免死锁
+        skus = list(SKU.objects.select_for_update().filter(id__in=sku_ids).order_by('id').only(
+            'id', 'price', 'stock', 'spu_id', 'category_id')) if sku_ids else []
+        if len(skus) != len(sku_ids):
+            raise StockError('sku不存在')
+        for sku in skus:
+            if cart_dict[sku.id] > sku.stock:
+                raise StockError('库存不足')
+
+        if sku_ids:
+            # 一条语句扣减所有sku的库存并增加销量，每个sku都带库存条件，
+            # 不支持行锁的数据库上库存被并发修改时更新的行数不足，回滚后重试
+            counts = {sku_id: cart_dict[sku_id] for sku_id in sku_ids}
+            guard = reduce(operator.or_, [Q(id=sku_id, stock__gte=count) for sku_id, count in counts.items()])
+            updated = SKU.objects.filter(guard).update(stock=_case_update('stock', counts, -1),
+                                                        sales=_case_update('sales', counts, 1))
+            if updated != len(sku_ids):
+                raise StockConflict()
+
+            # 同一个spu的多个sku合并后一条语句增加spu销量
+            spu_sales = defaultdict(int)
+            for sku in skus:
+                spu_sales[sku.spu_id] += cart_dict[sku.id]
+            SPU.objects.filter(id__in=sorted(spu_sales)).update(sales=_case_update('sales', spu_sales, 1))
+
+        if reserved_ids:
+            # 已在redis中预占库存的热门sku不加锁，库存和销量由对账任务写回
+            reserved_skus = list(SKU.objects.filter(id__in=reserved_ids).only('id', 'price', 'category_id'))
+            if len(reserved_skus) != len(reserved_ids):
+                raise StockError('sku不存在')
+            skus = sorted(skus + reserved_skus, key=lambda sku: sku.id)
+
+        # 先算出总数量和总金额，订单只需插入一次
+        freight = Decimal(contants.ORDER_FREIGHT)
+        total_count = sum(cart_dict.values())
+        total_amount = sum((sku.price * cart_dict[sku.id] for sku in skus), Decimal('0.00'))
+        order = OrderInfo.objects.create(
+            order_id=order_id,
+            user=user,
+            address=address,
+            total_count=total_count,
+            total_amount=total_amount + freight,
+            freight=freight,
+            pay_method=pay_method,
+            status=status,
+        )
+        OrderGoods.objects.bulk_create([
+            OrderGoods(order=order, sku_id=sku.id, count=cart_dict[sku.id], price=sku.price) for sku in skus])
+        if reserved_ids:
+            # 提交前标记redis库存的预占，预占已被对账任务归还时回滚
+            inventory.mark_committing(order_id)
+        if claim is not None and not claim():
+            # 异步订单已被超时取消，购物车已经归还
+            raise OrderAbandoned(order_id)
+    return order, [(sku.category_id, sku.id, cart_dict[sku.id]) for sku in skus]
+
+
+def commit_order(user, address, pay_method, status, order_id, cart_dict, claim=None):
+    """
+    保存订单，扣减库存并增加sku与spu销量
+    开启热门商品redis库存时，热门sku先在redis中原子地预占库存，下单失败时归还
+    遇到死锁、锁等待超时或库存被并发修改时退避后重试，超过次数后抛出异常
+    :param cart_dict: {sku_id: count}
+    :param claim: 事务提交前调用，返回False时抛出OrderAbandoned回滚事务
+    :return: (订单, 热销排行数据[(category_id, sku_id, count)])
+    """
+    if not cart_dict:
+        raise StockError('没有勾选商品')
+    reserved = {}
+    if settings.HOT_STOCK_ENABLED:
+        reserved = {sku_id: cart_dict[sku_id] for sku_id in inventory.get_hot_sku_ids(cart_dict)}
+    if reserved:
+        result = inventory.reserve(order_id, reserved)
+        if result == 0:
+            raise StockError('库存不足')
+        if result == -1:
+            # 刚刚关闭了redis库存，全部使用数据库库存
+            reserved = {}
+
+    backoff = contants.ORDER_COMMIT_RETRY_BACKOFF
+    try:
+        for retry in range(contants.ORDER_COMMIT_MAX_RETRIES + 1):
+            try:
+                return _commit_once(user, address, pay_method, status, order_id, cart_dict, set(reserved), claim)
+            except (OperationalError, StockConflict) as e:
+                if retry == contants.ORDER_COMMIT_MAX_RETRIES:
+                    raise
+                logger.warning('订单%s第%d次下单冲突，准备重试: %r' % (order_id, retry + 1, e))
+                # 随机抖动避免冲突的请求同时重试
+                time.sleep(backoff * (1 + random.random()))
+                backoff *= 2
+    except Exception:
+        # 订单没有保存，归还预占的redis库存
+        if reserved:
+            inventory.release(order_id)
+        raise
+
+
+def place_order(user, address, pay_method, order_id, cart_dict, claim=None):
+    """
+    保存从购物车中取出的勾选商品的订单，下单失败时归还购物车，成功后更新热销排行和价格库存快照
+    同步下单的视图与异步下单的任务共用
+    :param claim: 异步下单时确认订单仍由当前worker处理，在提交事务和归还购物车前调用，
+                  返回False时订单已被超时取消，抛出OrderAbandoned，不再归还购物车
+    :return: (响应码, 错误信息)
+    """
+    status = (OrderInfo.ORDER_STATUS_ENUM['UNPAID']
+              if pay_method == OrderInfo.PAY_METHODS_ENUM['ALIPAY']
+              else OrderInfo.ORDER_STATUS_ENUM['UNSEND'])
+    try:
+        # 一个事务中批量锁定sku、扣减库存、增加销量并保存订单和订单商品
+        order, hot_sales = commit_order(user, address, pay_method, status, order_id, cart_dict, claim)
+    except OrderAbandoned:
+        raise
+    except Exception as e:
+        if claim is not None and not claim():
+            raise OrderAbandoned(order_id)
+        # 事务已回滚，归还购物车中的商品
+        RedisCart(user.id).restore(cart_dict)
+        if isinstance(e, StockError):
+            return RETCODE.STOCKERR, '库存不足'
+        logger.error(e)
+        return RETCODE.DBERR, '下单失败'
+    if status == OrderInfo.ORDER_STATUS_ENUM['UNPAID']:
+        # 超时未支付时取消订单并归还库存
+        schedule_order_expiry(order_id)
+    # 更新商品所属类别的热销排行
+    incr_hot_skus_sales(hot_sales)
+    # 销量变化后按销量排序的列表缓存失效，批量update不会触发sku的post_save信号
+    for category_id in {category_id for category_id, sku_id, count in hot_sales}:
+        bump_list_generation(category_id)
+    # 库存已变化，删除价格库存快照
+    sku_stocks.invalidate(*cart_dict.keys())
+    return RETCODE.OK, '下单成功'
@@ -0,0 +1,51 @@
+# 下单遇到死锁、锁等待超时或库存被并发修改时的最大重试次数
+ORDER_COMMIT_MAX_RETRIES = 3
+# 下单重试的初始退避时间单位秒，每次重试翻倍并加上随机抖动
+ORDER_COMMIT_RETRY_BACKOFF = 0.05
+# 订单运费
+ORDER_FREIGHT = '10.00'
+# 热门商品redis库存的预占记录保存多久后，如果订单仍未保存且下单事务还没有标记预占，则归还库存，单位秒；
+# 归还后下单事务标记预占时会发现并回滚，所以这个时间不需要大于下单的最长耗时
+HOT_STOCK_RELEASE_AFTER = 60
+# 下单事务已标记预占但超过这么多秒订单仍不存在时，说明事务提交失败，归还库存，单位秒
+HOT_STOCK_COMMITTING_TIMEOUT = 600
+# 每次对账最多处理的预占记录数量
+HOT_STOCK_RECONCILE_BATCH = 500
+# 对账任务的锁过期时间单位秒
+HOT_STOCK_RECONCILE_LOCK_EXPIRES = 300
+# 异步下单时每个队列分片最多排队的订单数量，超过后拒绝下单
+ORDER_QUEUE_MAX_DEPTH = 1000
+# 异步下单队列已满时建议客户端重试的间隔单位秒
+ORDER_QUEUE_RETRY_AFTER = 5
+# 异步下单状态的过期时间单位秒
+ORDER_STATUS_EXPIRES = 3600
+# 异步下单排队超过这么多秒仍未被worker处理时视为消息丢失，取消排队并归还购物车
+ORDER_QUEUE_TIMEOUT = 120
+# worker处理订单超过这么多秒仍未结束时视为worker已退出，需要远大于下单最多重试时等待数据库锁的时间
+ORDER_PROCESS_TIMEOUT = 600
+# 订单号的起始时间2020-01-01 00:00:00 UTC，单位毫秒
+ORDER_ID_EPOCH = 1577836800000
+# 订单号中worker id的位数，最多同时运行2 ** 10个生成订单号的进程
+ORDER_ID_WORKER_BITS = 10
+# 订单号中每毫秒序号的位数，每个进程每毫秒最多生成2 ** 12个订单号
+ORDER_ID_SEQUENCE_BITS = 12
+# 订单号的十进制位数，64位整数最多19位，不足时左侧补0，保证按字符串排序与生成顺序一致
+ORDER_ID_DIGITS = 19
+# 订单号的前缀，旧订单号以年份20开头，新订单号以9开头，按字符串排序时排在所有旧订单号之后
+ORDER_ID_PREFIX = '9'
+# worker id租约的过期时间单位秒，进程退出后租约过期，worker id可以被其他进程使用
+ORDER_ID_WORKER_LEASE = 600
+# 未支付订单的过期时间单位秒，过期后取消订单并归还库存
+ORDER_UNPAID_EXPIRES = 1800
+# 每批取消的过期订单数量
+ORDER_EXPIRY_BATCH = 200
+# 每次定时任务最多处理的批次，剩余的过期订单下次任务继续处理
+ORDER_EXPIRY_MAX_BATCHES = 50
+# 取消过期订单任务的锁过期时间单位秒
+ORDER_EXPIRY_LOCK_EXPIRES = 300
+# 从数据库补充过期队列中遗漏的未支付订单的间隔单位秒
+ORDER_EXPIRY_SWEEP_INTERVAL = 300
+# 每次从数据库补充的最多订单数量，达到时下次任务继续补充
+ORDER_EXPIRY_SWEEP_LIMIT = 10000
+# 取消的订单已归还redis库存和热销排行的标记过期时间单位秒，订单移出过期队列前重复处理不会重复归还
+ORDER_EXPIRY_RESTORED_EXPIRES = 24 * 3600
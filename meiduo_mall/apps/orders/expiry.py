@@ -0,0 +1,210 @@
+"""
+未支付订单的过期取消
+
+下单后未支付的订单按过期时间加入redis的order_expiry有序集合，定时任务分批取出已过期的订单，
+在一个事务中锁定仍未支付的订单并取消，批量归还sku库存、扣减sku与spu销量；
+已支付或已取消的订单直接移出队列，重复处理不会重复归还库存；
+队列只在下单后写入，定时从数据库补充遗漏的订单；
+redis中的热门sku库存和热销排行在数据库提交后按订单归还，订单移出队列前中途失败时下次任务重新归还，同一订单只归还一次
+"""
+import datetime
+import logging
+import secrets
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, When, F, Sum
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from goods.models import SKU, SPU
+from goods.sku_cache import sku_stocks
+from goods.utils import bump_list_generation
+from meiduo_mall.utils.locks import release_lock
+from . import contants
+from .models import OrderInfo, OrderGoods
+
+logger = logging.getLogger('django')
+
+# 按过期时间排序的未支付订单
+EXPIRY_KEY = 'order_expiry'
+
+# 归还已取消订单在redis中的热门sku库存并扣减热销排行中的销量，每个订单只归还一次
+# 没有开启redis库存的sku与不在排行中的sku忽略
+# ARGV: 标记过期时间, order_id, 商品数量n, n组(sku_id, 三级类别id, count), order_id...
+# 返回: 本次归还的订单数量
+RESTORE_REDIS_SCRIPT = """
+local restored = 0
+local i = 2
+while i <= #ARGV do
+    local order_id = ARGV[i]
+    local n = tonumber(ARGV[i + 1])
+    local first = redis.call('set', 'order_expiry_restored_' .. order_id, 1, 'NX', 'EX', ARGV[1])
+    for j = i + 2, i + 1 + n * 3, 3 do
+        if first then
+            local key = 'hot_stock_' .. ARGV[j]
+            if redis.call('exists', key) == 1 then
+                redis.call('incrby', key, ARGV[j + 2])
+            end
+            redis.call('zadd', 'hot_skus_' .. ARGV[j + 1], 'XX', 'INCR', -tonumber(ARGV[j + 2]), ARGV[j])
+        end
+    end
+    if first then
+        restored = restored + 1
+    end
+    i = i + 2 + n * 3
+end
+return restored
+"""
+
+
+def schedule_order_expiry(order_id, expires=contants.ORDER_UNPAID_EXPIRES):
+    """未支付的订单加入过期队列"""
+    get_redis_connection('default').zadd(EXPIRY_KEY, {order_id: time.time() + expires})
+
+
+def get_pay_deadline(order):
+    """订单的支付截止时间(本地时间)，不晚于过期取消的时间，按分钟向下取整以便传给支付宝"""
+    deadline = order.create_time + datetime.timedelta(seconds=contants.ORDER_UNPAID_EXPIRES)
+    if timezone.is_aware(deadline):
+        deadline = timezone.localtime(deadline)
+    return deadline.replace(second=0, microsecond=0)
+
+
+def cancel_order_expiry(order_id):
+    """订单支付后移出过期队列"""
+    get_redis_connection('default').zrem(EXPIRY_KEY, order_id)
+
+
+def _case_update(field, values, sign):
+    """按主键分别增减字段"""
+    return Case(*[When(id=obj_id, then=F(field) + sign * value) for obj_id, value in values.items()],
+                default=F(field))
+
+
+def cancel_expired_orders(order_ids):
+    """
+    取消仍未支付的订单并归还库存，与支付回调并发时以先锁定订单的一方为准
+    :return: (取消的订单数量, 归还的sku数量 {sku_id: count})
+    """
+    unpaid = OrderInfo.ORDER_STATUS_ENUM['UNPAID']
+    with transaction.atomic():
+        # 锁定仍未支付的订单，支付回调修改状态时需要等待，取消之后支付回调不会再修改订单状态
+        canceled_ids = list(OrderInfo.objects.select_for_update().filter(
+            order_id__in=sorted(order_ids), status=unpaid).order_by('order_id').values_list('order_id', flat=True))
+        if not canceled_ids:
+            return 0, {}
+        OrderInfo.objects.filter(order_id__in=canceled_ids, status=unpaid).update(
+            status=OrderInfo.ORDER_STATUS_ENUM['CANCELED'])
+
+        sku_counts = dict(OrderGoods.objects.filter(order_id__in=canceled_ids).values_list('sku_id').annotate(
+            count=Sum('count')).order_by('sku_id'))
+        spu_sales = defaultdict(int)
+        for sku_id, spu_id in SKU.objects.filter(id__in=sku_counts).values_list('id', 'spu_id'):
+            spu_sales[spu_id] += sku_counts[sku_id]
+        # 与下单相同，按主键顺序一次更新所有sku和spu，避免死锁
+        SKU.objects.filter(id__in=sorted(sku_counts)).update(stock=_case_update('stock', sku_counts, 1),
+                                                             sales=_case_update('sales', sku_counts, -1))
+        SPU.objects.filter(id__in=sorted(spu_sales)).update(sales=_case_update('sales', spu_sales, -1))
+    return len(canceled_ids), sku_counts
+
+
+def restore_redis_stock(redis_conn, order_ids):
+    """
+    归还已取消订单的redis库存，扣减热销排行中的销量，并使商品列表缓存失效
+    数据库事务提交后中途失败时，下次处理同一批订单会重新执行，已归还的订单不会重复归还
+    """
+    order_goods = defaultdict(list)
+    for order_id, sku_id, category_id, count in OrderGoods.objects.filter(
+            order_id__in=order_ids, order__status=OrderInfo.ORDER_STATUS_ENUM['CANCELED']).values_list(
+            'order_id', 'sku_id', 'sku__category_id', 'count'):
+        order_goods[order_id].append((sku_id, category_id, count))
+    if not order_goods:
+        return 0
+    args = [contants.ORDER_EXPIRY_RESTORED_EXPIRES]
+    for order_id, items in order_goods.items():
+        args.extend([order_id, len(items)])
+        for item in items:
+            args.extend(item)
+    restored = redis_conn.register_script(RESTORE_REDIS_SCRIPT)(args=args)
+    # 销量变化后按销量排序的列表缓存失效，重复处理时多失效一次没有影响
+    for category_id in {item[1] for items in order_goods.values() for item in items}:
+        bump_list_generation(category_id)
+    return restored
+
+
+def sweep_unpaid_orders(redis_conn):
+    """
+    把数据库中已超过支付时间但不在过期队列中的未支付订单加入队列，返回补充的订单数量
+    下单后加入队列前失败的订单，以及上线前创建的未支付订单都由这里补充，过期队列不是唯一的数据来源
+    """
+    deadline = timezone.now() - datetime.timedelta(seconds=contants.ORDER_UNPAID_EXPIRES)
+    order_times = list(OrderInfo.objects.filter(
+        status=OrderInfo.ORDER_STATUS_ENUM['UNPAID'], create_time__lt=deadline).order_by('create_time').values_list(
+        'order_id', 'create_time')[:contants.ORDER_EXPIRY_SWEEP_LIMIT])
+    if len(order_times) == contants.ORDER_EXPIRY_SWEEP_LIMIT:
+        # 还有遗漏的订单，下次任务继续补充
+        redis_conn.delete('order_expiry_sweep')
+    if not order_times:
+        return 0
+    # NX不修改已在队列中的订单的过期时间
+    return redis_conn.zadd(EXPIRY_KEY, {order_id: create_time.timestamp() + contants.ORDER_UNPAID_EXPIRES
+                                        for order_id, create_time in order_times}, nx=True)
+
+
+def expire_unpaid_orders():
+    """
+    分批取消已过期的未支付订单
+    :return: 本次任务的统计数据，同时累加到redis的order_expiry_stats中
+    """
+    redis_conn = get_redis_connection('default')
+    # 锁的值是随机令牌，释放时只删除自己加的锁
+    token = secrets.token_hex(8)
+    if not redis_conn.set('order_expiry_lock', token, nx=True, ex=contants.ORDER_EXPIRY_LOCK_EXPIRES):
+        return None
+    stats = {'processed': 0, 'canceled': 0, 'max_lag': 0.0, 'swept': 0}
+    start = time.time()
+    try:
+        if redis_conn.set('order_expiry_sweep', 1, nx=True, ex=contants.ORDER_EXPIRY_SWEEP_INTERVAL):
+            stats['swept'] = sweep_unpaid_orders(redis_conn)
+        for _ in range(contants.ORDER_EXPIRY_MAX_BATCHES):
+            now = time.time()
+            expired = redis_conn.zrangebyscore(EXPIRY_KEY, '-inf', now, start=0,
+                                               num=contants.ORDER_EXPIRY_BATCH, withscores=True)
+            if not expired:
+                break
+            order_ids = [order_id.decode() for order_id, score in expired]
+            canceled, sku_counts = cancel_expired_orders(order_ids)
+            # 本批及之前中途失败的已取消订单都需要归还redis中的数据，每个订单只归还一次
+            restore_redis_stock(redis_conn, order_ids)
+            if sku_counts:
+                sku_stocks.invalidate(*sku_counts.keys())
+            # 数据库提交并归还redis后再移出队列，中途失败时下次任务重新处理，已取消的订单不会重复归还库存
+            redis_conn.zrem(EXPIRY_KEY, *order_ids)
+            stats['processed'] += len(order_ids)
+            stats['canceled'] += canceled
+            # 调度延迟：订单过期到被处理之间的时间
+            stats['max_lag'] = max(stats['max_lag'], now - expired[0][1])
+    finally:
+        release_lock(redis_conn, 'order_expiry_lock', token)
+
+    elapsed = time.time() - start
+    stats['orders_per_second'] = stats['canceled'] / elapsed if elapsed else 0.0
+    # 仍未处理的过期订单数量
+    stats['backlog'] = redis_conn.zcount(EXPIRY_KEY, '-inf', time.time())
+    pl = redis_conn.pipeline()
+    pl.hincrby('order_expiry_stats', 'processed', stats['processed'])
+    pl.hincrby('order_expiry_stats', 'canceled', stats['canceled'])
+    pl.hincrby('order_expiry_stats', 'swept', stats['swept'])
+    pl.hincrbyfloat('order_expiry_stats', 'seconds', elapsed)
+    pl.hincrby('order_expiry_stats', 'runs', 1)
+    pl.hset('order_expiry_stats', mapping={
+        'last_max_lag': round(stats['max_lag'], 3),
+        'last_backlog': stats['backlog'],
+        'last_run_at': timezone.now().strftime('%Y-%m-%d %H:%M:%S'),
+    })
+    pl.execute()
+    if stats['processed']:
+        logger.info('取消过期未支付订单: %s' % stats)
+    return stats
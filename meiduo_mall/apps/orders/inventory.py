@@ -0,0 +1,263 @@
+"""
+热门商品的redis库存
+
+开启后热门sku的可用库存保存在redis的hot_stock_<sku_id>中，下单时一个lua脚本原子地预占所有商品的库存，
+数据库中只保存订单和订单商品，不再锁定和更新热门sku的行；
+预占记录保存在stock_reservation_<order_id> hash中，并按预占时间记录在stock_reservations有序集合中，
+由定时对账任务把已保存的订单的库存和销量批量写回数据库并标记订单的stock_settled，订单没有保存成功的预占归还到redis库存中；
+预占状态保存在stock_reservation_state_<order_id>中: pending已预占 committing下单事务即将提交，
+对账任务只归还pending的预占，下单事务提交前把状态改为committing，已被归还的预占会让下单事务回滚，不会超卖
+"""
+import logging
+import secrets
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, When, F
+from django_redis import get_redis_connection
+
+from goods.models import SKU, SPU
+from goods.sku_cache import sku_stocks
+from goods.utils import bump_list_generation
+from meiduo_mall.utils.locks import release_lock
+from . import contants
+from .models import OrderInfo
+
+logger = logging.getLogger('django')
+
+# 按预占时间排序的预占记录
+RESERVATIONS_KEY = 'stock_reservations'
+
+# 预占所有商品的库存，任何一个商品库存不足时都不扣减
+# KEYS: stock_reservations, stock_reservation_<order_id>, stock_reservation_state_<order_id>, hot_stock_<sku_id>...
+# ARGV: order_id, 预占时间, sku_id, count, sku_id, count...
+# 返回: 1预占成功 0库存不足 -1有商品不再使用redis库存
+RESERVE_SCRIPT = """
+for i = 4, #KEYS do
+    local stock = redis.call('get', KEYS[i])
+    if not stock then
+        return -1
+    end
+    if tonumber(stock) < tonumber(ARGV[i * 2 - 4]) then
+        return 0
+    end
+end
+for i = 4, #KEYS do
+    redis.call('decrby', KEYS[i], ARGV[i * 2 - 4])
+    redis.call('hset', KEYS[2], ARGV[i * 2 - 5], ARGV[i * 2 - 4])
+end
+redis.call('set', KEYS[3], 'pending')
+redis.call('zadd', KEYS[1], ARGV[2], ARGV[1])
+return 1
+"""
+
+# 下单事务提交前标记预占，预占已被对账任务归还时返回0
+# KEYS: stock_reservation_state_<order_id>
+MARK_COMMITTING_SCRIPT = """
+local state = redis.call('get', KEYS[1])
+if state == 'pending' or state == 'committing' then
+    redis.call('set', KEYS[1], 'committing')
+    return 1
+end
+return 0
+"""
+
+# 取消预占，把库存归还到redis中，已经取消或写回数据库的预占不会重复归还
+# KEYS: stock_reservations, stock_reservation_<order_id>, stock_reservation_state_<order_id>
+# ARGV: order_id, 允许归还的预占状态，any表示不限
+RELEASE_SCRIPT = """
+if ARGV[2] ~= 'any' and redis.call('get', KEYS[3]) ~= ARGV[2] then
+    return 0
+end
+if redis.call('zrem', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+local items = redis.call('hgetall', KEYS[2])
+for i = 1, #items, 2 do
+    local key = 'hot_stock_' .. items[i]
+    -- 已经关闭redis库存的商品不需要归还
+    if redis.call('exists', key) == 1 then
+        redis.call('incrby', key, items[i + 1])
+    end
+end
+redis.call('del', KEYS[2], KEYS[3])
+return 1
+"""
+
+
+def stock_key(sku_id):
+    """热门sku在redis中的可用库存键名"""
+    return 'hot_stock_%s' % sku_id
+
+
+def reservation_key(order_id):
+    """订单预占的库存键名"""
+    return 'stock_reservation_%s' % order_id
+
+
+def reservation_state_key(order_id):
+    """订单预占状态的键名"""
+    return 'stock_reservation_state_%s' % order_id
+
+
+class ReservationReleased(Exception):
+    """预占已被对账任务归还，下单事务需要回滚"""
+    pass
+
+
+def get_hot_sku_ids(sku_ids):
+    """返回使用redis库存的sku_id集合"""
+    sku_ids = list(sku_ids)
+    redis_conn = get_redis_connection('default')
+    stocks = redis_conn.mget([stock_key(sku_id) for sku_id in sku_ids])
+    return {sku_id for sku_id, stock in zip(sku_ids, stocks) if stock is not None}
+
+
+def reserve(order_id, cart_dict):
+    """
+    原子地预占订单中所有商品的redis库存
+    :param cart_dict: {sku_id: count}
+    :return: 1预占成功 0库存不足 -1有商品不再使用redis库存
+    """
+    redis_conn = get_redis_connection('default')
+    keys = [RESERVATIONS_KEY, reservation_key(order_id), reservation_state_key(order_id)]
+    args = [order_id, time.time()]
+    for sku_id, count in cart_dict.items():
+        keys.append(stock_key(sku_id))
+        args.extend([sku_id, count])
+    return redis_conn.register_script(RESERVE_SCRIPT)(keys=keys, args=args)
+
+
+def mark_committing(order_id):
+    """在下单事务中提交前调用，预占已被归还时抛出ReservationReleased让事务回滚"""
+    redis_conn = get_redis_connection('default')
+    if not redis_conn.register_script(MARK_COMMITTING_SCRIPT)(keys=[reservation_state_key(order_id)]):
+        raise ReservationReleased(order_id)
+
+
+def release(order_id, state='any'):
+    """
+    取消订单的预占，库存归还到redis中，返回是否归还
+    :param state: 只归还该状态的预占，any表示不限，用于下单失败后立即归还
+    """
+    redis_conn = get_redis_connection('default')
+    script = redis_conn.register_script(RELEASE_SCRIPT)
+    return bool(script(keys=[RESERVATIONS_KEY, reservation_key(order_id), reservation_state_key(order_id)],
+                       args=[order_id, state]))
+
+
+def _settle(redis_conn, order_ids):
+    """
+    把已保存订单的预占一次写回数据库：扣减sku库存，增加sku与spu销量，然后删除预占记录
+    写回的订单在同一个事务中标记stock_settled，删除预占记录前中途失败时重复执行不会重复写回
+    """
+    sku_counts = defaultdict(int)
+    category_ids = set()
+    with transaction.atomic():
+        # 锁定还没有写回的订单，已写回的只需要删除预占记录
+        settle_ids = list(OrderInfo.objects.select_for_update().filter(
+            order_id__in=sorted(order_ids), stock_settled=False).order_by('order_id').values_list('order_id', flat=True))
+        if settle_ids:
+            pl = redis_conn.pipeline()
+            for order_id in settle_ids:
+                pl.hgetall(reservation_key(order_id))
+            for items in pl.execute():
+                for sku_id, count in items.items():
+                    sku_counts[int(sku_id)] += int(count)
+        if sku_counts:
+            spu_sales = defaultdict(int)
+            for sku_id, spu_id, category_id in SKU.objects.filter(id__in=sku_counts).values_list(
+                    'id', 'spu_id', 'category_id'):
+                spu_sales[spu_id] += sku_counts[sku_id]
+                category_ids.add(category_id)
+            # 与下单相同，按主键顺序一次更新，避免死锁
+            SKU.objects.filter(id__in=sorted(sku_counts)).update(
+                stock=Case(*[When(id=sku_id, then=F('stock') - count) for sku_id, count in sku_counts.items()],
+                           default=F('stock')),
+                sales=Case(*[When(id=sku_id, then=F('sales') + count) for sku_id, count in sku_counts.items()],
+                           default=F('sales')))
+            SPU.objects.filter(id__in=sorted(spu_sales)).update(
+                sales=Case(*[When(id=spu_id, then=F('sales') + count) for spu_id, count in spu_sales.items()],
+                           default=F('sales')))
+        if settle_ids:
+            OrderInfo.objects.filter(order_id__in=settle_ids).update(stock_settled=True)
+    # 数据库提交后删除预占记录
+    pl = redis_conn.pipeline()
+    pl.zrem(RESERVATIONS_KEY, *order_ids)
+    pl.delete(*[reservation_key(order_id) for order_id in order_ids])
+    pl.delete(*[reservation_state_key(order_id) for order_id in order_ids])
+    pl.execute()
+    # 销量变化后按销量排序的列表缓存失效
+    for category_id in category_ids:
+        bump_list_generation(category_id)
+    return sku_counts
+
+
+def reconcile_reservations():
+    """
+    对账redis库存的预占记录
+    订单已保存的预占批量写回数据库；超过HOT_STOCK_RELEASE_AFTER秒订单仍不存在且下单事务还没有标记的预占归还库存，
+    之后下单事务标记时发现已归还会回滚；已标记但超过HOT_STOCK_COMMITTING_TIMEOUT秒订单仍不存在的，说明事务提交失败，归还库存
+    :return: 本次对账的统计数据
+    """
+    redis_conn = get_redis_connection('default')
+    # 锁的值是随机令牌，释放时只删除自己加的锁
+    token = secrets.token_hex(8)
+    if not redis_conn.set('stock_reconcile_lock', token, nx=True, ex=contants.HOT_STOCK_RECONCILE_LOCK_EXPIRES):
+        return None
+    stats = {'settled': 0, 'released': 0, 'pending': 0}
+    try:
+        reservations = [(order_id.decode(), score) for order_id, score in redis_conn.zrange(
+            RESERVATIONS_KEY, 0, contants.HOT_STOCK_RECONCILE_BATCH - 1, withscores=True)]
+        if not reservations:
+            return stats
+        # 订单保存成功后才能看到订单记录
+        order_ids = [order_id for order_id, score in reservations]
+        saved_ids = set(OrderInfo.objects.filter(order_id__in=order_ids).values_list('order_id', flat=True))
+        settle_ids = [order_id for order_id in order_ids if order_id in saved_ids]
+        if settle_ids:
+            sku_counts = _settle(redis_conn, settle_ids)
+            stats['settled'] = len(settle_ids)
+            # 数据库库存已变化，删除价格库存快照
+            sku_stocks.invalidate(*sku_counts.keys())
+
+        now = time.time()
+        for order_id, score in reservations:
+            if order_id in saved_ids:
+                continue
+            released = False
+            if score < now - contants.HOT_STOCK_RELEASE_AFTER:
+                released = release(order_id, 'pending')
+            if not released and score < now - contants.HOT_STOCK_COMMITTING_TIMEOUT:
+                # 重新确认订单没有在这期间保存
+                if not OrderInfo.objects.filter(order_id=order_id).exists():
+                    released = release(order_id, 'committing')
+            if released:
+                stats['released'] += 1
+            else:
+                stats['pending'] += 1
+    finally:
+        release_lock(redis_conn, 'stock_reconcile_lock', token)
+    logger.info('热门商品库存对账: %s' % stats)
+    return stats
+
+
+def enable_hot_stock(sku_ids):
+    """把sku的数据库库存加载到redis中，之后下单时使用redis库存"""
+    # 先把未写回的预占写回数据库，保证数据库库存准确
+    while (reconcile_reservations() or {}).get('settled'):
+        pass
+    redis_conn = get_redis_connection('default')
+    pl = redis_conn.pipeline()
+    for sku_id, stock in SKU.objects.filter(id__in=sku_ids).values_list('id', 'stock'):
+        pl.set(stock_key(sku_id), stock, nx=True)
+    pl.execute()
+
+
+def disable_hot_stock(sku_ids):
+    """关闭sku的redis库存，之后下单时重新使用数据库库存，剩余的预占仍由对账任务写回数据库"""
+    redis_conn = get_redis_connection('default')
+    redis_conn.delete(*[stock_key(sku_id) for sku_id in sku_ids])
+    while (reconcile_reservations() or {}).get('settled'):
+        pass
@@ -0,0 +1,120 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from goods.models import SKU, SPU
+from orders.checkout import commit_order, StockError
+from orders.models import OrderInfo, OrderGoods
+from users.models import User, Address
+
+
+def commit_order_legacy(user, address, pay_method, status, order_id, cart_dict):
+    """原逐个商品查询、乐观锁更新并逐条保存的下单流程，仅用于对比"""
+    with transaction.atomic():
+        save_point = transaction.savepoint()
+        order = OrderInfo.objects.create(order_id=order_id, user=user, address=address, total_count=0,
+                                         total_amount=Decimal('0.00'), freight=Decimal('10.00'),
+                                         pay_method=pay_method, status=status)
+        for sku_id in cart_dict:
+            while True:
+                sku = SKU.objects.get(id=sku_id)
+                buy_count = cart_dict[sku_id]
+                origin_stock = sku.stock
+                origin_sales = sku.sales
+                if buy_count > origin_stock:
+                    transaction.savepoint_rollback(save_point)
+                    raise StockError('库存不足')
+                result = SKU.objects.filter(id=sku_id, stock=origin_stock).update(
+                    stock=origin_stock - buy_count, sales=origin_sales + buy_count)
+                if result == 0:
+                    continue
+                spu = sku.spu
+                spu.sales += buy_count
+                spu.save()
+                OrderGoods.objects.create(order=order, sku=sku, count=buy_count, price=sku.price)
+                order.total_count += buy_count
+                order.total_amount += (sku.price * buy_count)
+                break
+        order.total_amount += order.freight
+        order.save()
+        transaction.savepoint_commit(save_point)
+    return order, []
+
+
+class Command(BaseCommand):
+    help = '对比新旧下单流程的SQL语句数量，以及多线程抢购同一个热门sku时的吞吐量，结束后删除测试订单并恢复库存销量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, required=True, help='下单用户id，用户需要有收货地址')
+        parser.add_argument('--sku-ids', required=True, help='订单中的sku_id，逗号分隔，第一个作为热门sku')
+        parser.add_argument('--threads', type=int, default=8, help='并发下单的线程数')
+        parser.add_argument('--orders', type=int, default=50, help='每个线程下单的次数')
+
+    def run_threads(self, name, func, user, address, cart_dict, threads, orders):
+        """多个线程同时下单，返回(成功次数, 失败次数, 耗时)"""
+        counts = {'ok': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def worker(index):
+            try:
+                for i in range(orders):
+                    order_id = 'bench%s%03d%06d' % (name, index, i)
+                    try:
+                        func(user, address, 1, 2, order_id, cart_dict)
+                        key = 'ok'
+                    except Exception:
+                        key = 'failed'
+                    with lock:
+                        counts[key] += 1
+            finally:
+                # 每个线程使用独立的数据库连接
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+        start = time.perf_counter()
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+        return counts['ok'], counts['failed'], time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(id=options['user_id'])
+        except User.DoesNotExist:
+            raise CommandError('用户不存在')
+        address = Address.objects.filter(user=user).first()
+        if address is None:
+            raise CommandError('用户没有收货地址')
+        sku_ids = [int(sku_id) for sku_id in options['sku_ids'].split(',')]
+        skus = list(SKU.objects.filter(id__in=sku_ids))
+        if len(skus) != len(sku_ids):
+            raise CommandError('sku不存在')
+        cart_dict = {sku_id: 1 for sku_id in sku_ids}
+
+        # 记录原库存和销量，结束后恢复
+        sku_snapshots = {sku.id: (sku.stock, sku.sales) for sku in skus}
+        spu_snapshots = {spu.id: spu.sales for spu in SPU.objects.filter(id__in={sku.spu_id for sku in skus})}
+        # 保证压测期间库存充足
+        total = options['threads'] * options['orders'] * 2 + 2
+        SKU.objects.filter(id__in=sku_ids).update(stock=total)
+        try:
+            self.stdout.write('%-8s %10s %8s %8s %10s' % ('flow', 'statements', 'ok', 'failed', 'orders/s'))
+            for name, func in [('legacy', commit_order_legacy), ('batch', commit_order)]:
+                with CaptureQueriesContext(connection) as queries:
+                    func(user, address, 1, 2, 'bench%s' % name, cart_dict)
+                ok, failed, elapsed = self.run_threads(name, func, user, address, cart_dict,
+                                                       options['threads'], options['orders'])
+                self.stdout.write('%-8s %10d %8d %8d %10.1f' % (
+                    name, len(queries.captured_queries), ok, failed, ok / elapsed))
+        finally:
+            OrderGoods.objects.filter(order__order_id__startswith='bench').delete()
+            OrderInfo.objects.filter(order_id__startswith='bench').delete()
+            for sku_id, (stock, sales) in sku_snapshots.items():
+                SKU.objects.filter(id=sku_id).update(stock=stock, sales=sales)
+            for spu_id, sales in spu_snapshots.items():
+                SPU.objects.filter(id=spu_id).update(sales=sales)
@@ -0,0 +1,74 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from goods.models import SKU, SPU
+from orders.checkout import commit_order
+from orders.expiry import expire_unpaid_orders, schedule_order_expiry
+from orders.models import OrderInfo, OrderGoods
+from orders.utils import order_ids
+from users.models import User, Address
+
+
+class Command(BaseCommand):
+    help = '创建一批已过期的未支付订单，测试取消过期订单的吞吐量和调度延迟，并校验库存销量全部归还，结束后删除测试订单'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, required=True, help='下单用户id，用户需要有收货地址')
+        parser.add_argument('--sku-ids', required=True, help='订单中的sku_id，逗号分隔')
+        parser.add_argument('--orders', type=int, default=1000, help='过期订单数量')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(id=options['user_id'])
+        except User.DoesNotExist:
+            raise CommandError('用户不存在')
+        address = Address.objects.filter(user=user).first()
+        if address is None:
+            raise CommandError('用户没有收货地址')
+        sku_ids = [int(sku_id) for sku_id in options['sku_ids'].split(',')]
+        skus = list(SKU.objects.filter(id__in=sku_ids))
+        if len(skus) != len(sku_ids):
+            raise CommandError('sku不存在')
+        cart_dict = {sku_id: 1 for sku_id in sku_ids}
+
+        sku_snapshots = {sku.id: (sku.stock, sku.sales) for sku in skus}
+        spu_snapshots = {spu.id: spu.sales for spu in SPU.objects.filter(id__in={sku.spu_id for sku in skus})}
+        SKU.objects.filter(id__in=sku_ids).update(stock=options['orders'])
+        created_ids = []
+        try:
+            for _ in range(options['orders']):
+                order_id = order_ids.next_id()
+                commit_order(user, address, OrderInfo.PAY_METHODS_ENUM['ALIPAY'],
+                             OrderInfo.ORDER_STATUS_ENUM['UNPAID'], order_id, cart_dict)
+                schedule_order_expiry(order_id, expires=0)
+                created_ids.append(order_id)
+
+            start = time.perf_counter()
+            canceled = 0
+            max_lag = 0.0
+            while True:
+                stats = expire_unpaid_orders()
+                if stats is None:
+                    raise CommandError('取消过期订单的任务正在运行')
+                canceled += stats['canceled']
+                max_lag = max(max_lag, stats['max_lag'])
+                if not stats['backlog']:
+                    break
+            elapsed = time.perf_counter() - start
+            self.stdout.write('取消%d个订单 %.1f orders/s 最大调度延迟%.3fs' % (canceled, canceled / elapsed, max_lag))
+
+            # 再执行一次，已取消的订单不会重复归还库存
+            for order_id in created_ids[:10]:
+                schedule_order_expiry(order_id, expires=0)
+            expire_unpaid_orders()
+            restored = all(sku.stock == options['orders'] and sku.sales == sku_snapshots[sku.id][1]
+                           for sku in SKU.objects.filter(id__in=sku_ids))
+            self.stdout.write('库存和销量全部归还: %s' % restored)
+        finally:
+            OrderGoods.objects.filter(order_id__in=created_ids).delete()
+            OrderInfo.objects.filter(order_id__in=created_ids).delete()
+            for sku_id, (stock, sales) in sku_snapshots.items():
+                SKU.objects.filter(id=sku_id).update(stock=stock, sales=sales)
+            for spu_id, sales in spu_snapshots.items():
+                SPU.objects.filter(id=spu_id).update(sales=sales)
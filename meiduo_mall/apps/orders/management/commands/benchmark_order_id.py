@@ -0,0 +1,35 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.utils import order_ids
+
+
+def generate_ids(count):
+    """在子进程中生成订单号"""
+    return [order_ids.next_id() for _ in range(count)]
+
+
+class Command(BaseCommand):
+    help = '测试订单号生成器在单进程和多个fork出的进程中的吞吐量，唯一性与递增由orders.tests校验'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help='每个进程生成的订单号数量')
+        parser.add_argument('--processes', type=int, default=4, help='同时生成订单号的进程数')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        start = time.perf_counter()
+        generate_ids(count)
+        elapsed = time.perf_counter() - start
+        self.stdout.write('单进程: %d个订单号 %.0f ids/s %.2f us/id' % (count, count / elapsed, elapsed * 1000000 / count))
+
+        # 父进程已经申请了worker id，fork出的子进程需要重新申请
+        context = multiprocessing.get_context('fork')
+        start = time.perf_counter()
+        with context.Pool(options['processes']) as pool:
+            pool.map(generate_ids, [count] * options['processes'])
+        elapsed = time.perf_counter() - start
+        total = count * options['processes']
+        self.stdout.write('%d个进程: %d个订单号 %.0f ids/s' % (options['processes'], total, total / elapsed))
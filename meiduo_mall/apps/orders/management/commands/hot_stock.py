@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from orders import inventory
+
+
+class Command(BaseCommand):
+    help = '开启或关闭sku的redis库存，不带参数时查看使用redis库存的sku与未写回的预占数量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enable', default='', help='开启redis库存的sku_id，逗号分隔')
+        parser.add_argument('--disable', default='', help='关闭redis库存的sku_id，逗号分隔')
+
+    def handle(self, *args, **options):
+        enable_ids = [int(sku_id) for sku_id in options['enable'].split(',') if sku_id]
+        disable_ids = [int(sku_id) for sku_id in options['disable'].split(',') if sku_id]
+        if enable_ids:
+            inventory.enable_hot_stock(enable_ids)
+        if disable_ids:
+            inventory.disable_hot_stock(disable_ids)
+
+        redis_conn = get_redis_connection('default')
+        for key in sorted(redis_conn.scan_iter(match=inventory.stock_key('*'))):
+            self.stdout.write('%s %s' % (key.decode(), int(redis_conn.get(key) or 0)))
+        self.stdout.write('未写回的预占: %d' % redis_conn.zcard(inventory.RESERVATIONS_KEY))
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from goods.models import SKU, SPU
+from orders import inventory
+from orders.checkout import commit_order, StockError
+from orders.models import OrderInfo, OrderGoods
+from users.models import User, Address
+
+
+class Command(BaseCommand):
+    help = ('模拟大量买家同时抢购同一个sku，对比数据库库存与redis库存的下单吞吐量，并校验没有超卖，'
+            '结束后删除测试订单并恢复库存销量')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, required=True, help='下单用户id，用户需要有收货地址')
+        parser.add_argument('--sku-id', type=int, required=True, help='抢购的sku_id')
+        parser.add_argument('--buyers', type=int, default=500, help='同时下单的买家数量，每个买家一个线程和数据库连接')
+        parser.add_argument('--stock', type=int, default=100, help='压测时的库存')
+
+    def run_buyers(self, name, user, address, sku_id, buyers):
+        """所有买家线程就绪后同时下单，返回(成功次数, 库存不足次数, 失败次数, 耗时)"""
+        counts = {'ok': 0, 'stockout': 0, 'failed': 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(buyers + 1)
+
+        def buyer(index):
+            try:
+                barrier.wait()
+                try:
+                    commit_order(user, address, 1, 2, 'load%s%06d' % (name, index), {sku_id: 1})
+                    key = 'ok'
+                except StockError:
+                    key = 'stockout'
+                except Exception:
+                    key = 'failed'
+                with lock:
+                    counts[key] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer, args=(index,)) for index in range(buyers)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return counts['ok'], counts['stockout'], counts['failed'], time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(id=options['user_id'])
+            sku = SKU.objects.get(id=options['sku_id'])
+        except (User.DoesNotExist, SKU.DoesNotExist):
+            raise CommandError('用户或sku不存在')
+        address = Address.objects.filter(user=user).first()
+        if address is None:
+            raise CommandError('用户没有收货地址')
+        spu_sales = SPU.objects.get(id=sku.spu_id).sales
+
+        self.stdout.write('%-6s %8s %9s %8s %10s %10s' % ('mode', 'ok', 'stockout', 'failed', 'orders/s', 'oversold'))
+        try:
+            for name, enabled in [('db', False), ('redis', True)]:
+                SKU.objects.filter(id=sku.id).update(stock=options['stock'], sales=sku.sales)
+                with override_settings(HOT_STOCK_ENABLED=enabled):
+                    if enabled:
+                        inventory.enable_hot_stock([sku.id])
+                    try:
+                        ok, stockout, failed, elapsed = self.run_buyers(
+                            name, user, address, sku.id, options['buyers'])
+                    finally:
+                        if enabled:
+                            # 关闭时把所有预占写回数据库
+                            inventory.disable_hot_stock([sku.id])
+                stock = SKU.objects.get(id=sku.id).stock
+                self.stdout.write('%-6s %8d %9d %8d %10.1f %10s' % (
+                    name, ok, stockout, failed, ok / elapsed, stock < 0 or stock != options['stock'] - ok))
+        finally:
+            OrderGoods.objects.filter(order__order_id__startswith='load').delete()
+            OrderInfo.objects.filter(order_id__startswith='load').delete()
+            SKU.objects.filter(id=sku.id).update(stock=sku.stock, sales=sku.sales)
+            SPU.objects.filter(id=sku.spu_id).update(sales=spu_sales)
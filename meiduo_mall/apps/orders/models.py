@@ -17,7 +17,8 @@ class OrderInfo(BaseModel):
         "UNSEND": 2,
         "UNRECEIVED": 3,
         "UNCOMMENT": 4,
-        "FINISHED": 5
+        "FINISHED": 5,
+        "CANCELED": 6
     }
     ORDER_STATUS_CHOICES = (
         (1, "待支付"),
@@ -35,6 +36,7 @@ class OrderInfo(BaseModel):
     freight = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="运费")
     pay_method = models.SmallIntegerField(choices=PAY_METHOD_CHOICES, default=1, verbose_name="支付方式")
     status = models.SmallIntegerField(choices=ORDER_STATUS_CHOICES, default=1, verbose_name="订单状态")
+    stock_settled = models.BooleanField(default=False, verbose_name="redis库存预占已写回")
 
     class Meta:
         db_table = "tb_order_info"
@@ -0,0 +1,234 @@
+"""
+异步下单
+
+下单请求校验后把订单放入按sku分片的celery队列，立即返回订单号作为查询凭证，
+每个分片由一个worker串行处理，同一个sku的订单不会在数据库中相互等待锁；
+订单状态保存在redis的order_status_<order_id> hash中，客户端轮询查询；
+排队中的订单记录在order_queue_<分片>有序集合中，集合大小就是排队数量，处理中的订单记录在order_processing中，
+worker提交下单事务或归还购物车前把订单移到order_committing中，与超时取消只有一方能成功；
+消息丢失或worker退出导致超时的订单由定时任务取消并归还购物车
+"""
+import json
+import logging
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from carts.redis_cart import RedisCart
+from meiduo_mall.utils.response_code import RETCODE
+from users.models import User, Address
+from . import contants
+from .checkout import place_order, OrderAbandoned
+from .models import OrderInfo
+
+logger = logging.getLogger('django')
+
+# 处理中的订单，按开始处理的时间排序
+PROCESSING_KEY = 'order_processing'
+# worker已确认处理结果(即将提交下单事务或归还购物车)的订单，按确认时间排序
+COMMITTING_KEY = 'order_committing'
+
+# 排队数量未超过上限时加入排队
+# KEYS: order_queue_<分片>, order_status_<order_id>
+# ARGV: order_id, 排队时间, 上限, user_id, 购物车json, 状态过期时间
+ENQUEUE_SCRIPT = """
+if redis.call('zcard', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('zadd', KEYS[1], ARGV[2], ARGV[1])
+redis.call('hset', KEYS[2], 'user_id', ARGV[4], 'state', 'queued', 'cart', ARGV[5])
+redis.call('expire', KEYS[2], ARGV[6])
+return 1
+"""
+
+# 把订单从排队中取出，worker开始处理与超时取消只有一方能成功
+# KEYS: order_queue_<分片>, order_processing, order_status_<order_id>
+# ARGV: order_id, 时间, 新状态
+CLAIM_SCRIPT = """
+if redis.call('zrem', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+if ARGV[3] == 'processing' then
+    redis.call('zadd', KEYS[2], ARGV[2], ARGV[1])
+end
+redis.call('hset', KEYS[3], 'state', ARGV[3])
+return 1
+"""
+
+
+# worker提交下单事务或归还购物车前确认订单仍由自己处理，与超时取消只有一方能成功，重复确认返回1
+# KEYS: order_processing, order_committing
+# ARGV: order_id, 时间
+CONFIRM_SCRIPT = """
+if redis.call('zscore', KEYS[2], ARGV[1]) then
+    return 1
+end
+if redis.call('zrem', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('zadd', KEYS[2], ARGV[2], ARGV[1])
+return 1
+"""
+
+
+def get_shard(cart_dict):
+    """按订单中最小的sku_id计算队列分片"""
+    return min(int(sku_id) for sku_id in cart_dict) % settings.ORDER_QUEUE_SHARDS
+
+
+def queue_key(shard):
+    """分片中排队的订单的键名"""
+    return 'order_queue_%s' % shard
+
+
+def status_key(order_id):
+    """订单处理状态的键名"""
+    return 'order_status_%s' % order_id
+
+
+def set_order_status(order_id, **fields):
+    """修改订单处理状态 state: queued排队中 processing处理中 success下单成功 failed下单失败"""
+    redis_conn = get_redis_connection('default')
+    pl = redis_conn.pipeline()
+    pl.hset(status_key(order_id), mapping=fields)
+    pl.expire(status_key(order_id), contants.ORDER_STATUS_EXPIRES)
+    pl.execute()
+
+
+def get_order_status(order_id, user_id):
+    """获取订单处理状态，订单不存在或不属于该用户时返回None"""
+    status = get_redis_connection('default').hgetall(status_key(order_id))
+    status = {key.decode(): value.decode() for key, value in status.items()}
+    if status.get('user_id') != str(user_id):
+        return None
+    return status
+
+
+def claim(order_id, shard, state):
+    """把订单从排队中取出并修改状态，已被取出时返回False"""
+    redis_conn = get_redis_connection('default')
+    script = redis_conn.register_script(CLAIM_SCRIPT)
+    return bool(script(keys=[queue_key(shard), PROCESSING_KEY, status_key(order_id)],
+                       args=[order_id, time.time(), state]))
+
+
+def confirm(order_id):
+    """worker确认订单仍由自己处理，订单已被超时取消时返回False"""
+    redis_conn = get_redis_connection('default')
+    script = redis_conn.register_script(CONFIRM_SCRIPT)
+    return bool(script(keys=[PROCESSING_KEY, COMMITTING_KEY], args=[order_id, time.time()]))
+
+
+def enqueue_order(user, address, pay_method, order_id, cart_dict):
+    """
+    把从购物车中取出的订单放入队列，队列已满或放入失败时归还购物车
+    :return: (响应码, 错误信息)
+    """
+    shard = get_shard(cart_dict)
+    redis_conn = get_redis_connection('default')
+    script = redis_conn.register_script(ENQUEUE_SCRIPT)
+    # 购物车与订单状态一起保存，超时取消时用来归还购物车
+    if not script(keys=[queue_key(shard), status_key(order_id)],
+                  args=[order_id, time.time(), contants.ORDER_QUEUE_MAX_DEPTH, user.id, json.dumps(cart_dict),
+                        contants.ORDER_STATUS_EXPIRES]):
+        RedisCart(user.id).restore(cart_dict)
+        return RETCODE.THROTTLINGERR, '下单人数过多，请稍后重试'
+
+    # 延迟导入，celery任务模块需要导入本模块
+    from celery_tasks.orders.tasks import process_order_task
+    try:
+        process_order_task.apply_async(args=(order_id, user.id, address.id, pay_method, cart_dict),
+                                       queue='orders_%s' % shard)
+    except Exception as e:
+        logger.error(e)
+        redis_conn.zrem(queue_key(shard), order_id)
+        redis_conn.delete(status_key(order_id))
+        RedisCart(user.id).restore(cart_dict)
+        return RETCODE.SERVERERR, '下单失败'
+    return RETCODE.OK, '订单排队中'
+
+
+def process_order(order_id, user_id, address_id, pay_method, cart_dict):
+    """worker处理队列中的订单，并记录处理结果"""
+    # 经过celery序列化后sku_id变成了字符串
+    cart_dict = {int(sku_id): count for sku_id, count in cart_dict.items()}
+    if not claim(order_id, get_shard(cart_dict), 'processing'):
+        # 排队超时已被取消，购物车已经归还
+        return None
+    try:
+        try:
+            user = User.objects.get(id=user_id)
+            address = Address.objects.get(id=address_id)
+        except (User.DoesNotExist, Address.DoesNotExist) as e:
+            logger.error(e)
+            if not confirm(order_id):
+                return None
+            RedisCart(user_id).restore(cart_dict)
+            code, errmsg = RETCODE.DBERR, '下单失败'
+        else:
+            try:
+                code, errmsg = place_order(user, address, pay_method, order_id, cart_dict,
+                                           claim=lambda: confirm(order_id))
+            except OrderAbandoned:
+                # 处理超时已被取消，事务已回滚，购物车已经归还
+                logger.warning('订单%s处理超时已被取消' % order_id)
+                return None
+        set_order_status(order_id, state='success' if code == RETCODE.OK else 'failed', code=code, errmsg=errmsg)
+        return code
+    finally:
+        pl = get_redis_connection('default').pipeline()
+        pl.zrem(PROCESSING_KEY, order_id)
+        pl.zrem(COMMITTING_KEY, order_id)
+        pl.execute()
+
+
+def _restore_cart(redis_conn, order_id):
+    """超时的订单归还购物车并修改状态"""
+    status = redis_conn.hgetall(status_key(order_id))
+    if b'cart' in status:
+        cart_dict = {int(sku_id): count for sku_id, count in json.loads(status[b'cart'].decode()).items()}
+        RedisCart(status[b'user_id'].decode()).restore(cart_dict)
+    set_order_status(order_id, state='failed', code=RETCODE.SERVERERR, errmsg='下单超时，商品已放回购物车')
+
+
+def reconcile_order_queue():
+    """
+    取消超时的异步订单
+    排队超过ORDER_QUEUE_TIMEOUT秒的订单视为消息丢失；处理超过ORDER_PROCESS_TIMEOUT秒仍未确认的订单直接归还购物车，
+    worker之后确认失败会回滚下单事务；确认后超过ORDER_PROCESS_TIMEOUT秒仍未结束的订单视为worker已退出，
+    订单已保存的标记为下单成功，否则归还购物车
+    :return: {'queued': 取消的排队订单数量, 'processing': 处理超时的订单数量}
+    """
+    redis_conn = get_redis_connection('default')
+    stats = {'queued': 0, 'processing': 0}
+    now = time.time()
+    for shard in range(settings.ORDER_QUEUE_SHARDS):
+        for order_id in redis_conn.zrangebyscore(queue_key(shard), '-inf', now - contants.ORDER_QUEUE_TIMEOUT):
+            order_id = order_id.decode()
+            # 与worker同时取出时只有一方成功
+            if claim(order_id, shard, 'failed'):
+                _restore_cart(redis_conn, order_id)
+                stats['queued'] += 1
+
+    for order_id in redis_conn.zrangebyscore(PROCESSING_KEY, '-inf', now - contants.ORDER_PROCESS_TIMEOUT):
+        order_id = order_id.decode()
+        # worker还没有确认，移出后worker提交事务前确认失败会回滚，不会再保存订单
+        if not redis_conn.zrem(PROCESSING_KEY, order_id):
+            continue
+        _restore_cart(redis_conn, order_id)
+        stats['processing'] += 1
+
+    for order_id in redis_conn.zrangebyscore(COMMITTING_KEY, '-inf', now - contants.ORDER_PROCESS_TIMEOUT):
+        order_id = order_id.decode()
+        # worker确认后长时间没有结束，说明已经退出，按订单是否保存决定结果
+        if not redis_conn.zrem(COMMITTING_KEY, order_id):
+            continue
+        if OrderInfo.objects.filter(order_id=order_id).exists():
+            set_order_status(order_id, state='success', code=RETCODE.OK, errmsg='下单成功')
+        else:
+            _restore_cart(redis_conn, order_id)
+        stats['processing'] += 1
+    if stats['queued'] or stats['processing']:
+        logger.warning('取消超时的异步订单: %s' % stats)
+    return stats
@@ -1,3 +1,34 @@
-from django.test import TestCase
+import multiprocessing
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .utils import order_ids
+
+
+def generate_ids(count):
+    """在子进程中生成订单号"""
+    return [order_ids.next_id() for _ in range(count)]
+
+
+class OrderIdGeneratorTest(SimpleTestCase):
+    """订单号生成器"""
+
+    def test_increasing_in_process(self):
+        """同一进程内生成的订单号递增且不重复，排在以年份开头的旧订单号之后"""
+        ids = generate_ids(10000)
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertTrue(all(order_id.isdigit() for order_id in ids))
+        self.assertGreater(ids[0], '20991231235959000000001')
+
+    def test_unique_across_forked_processes(self):
+        """fork出的多个进程同时生成订单号，各自申请worker id，订单号不重复且每个进程内递增"""
+        # 父进程先申请worker id，子进程需要重新申请
+        parent_ids = generate_ids(1000)
+        context = multiprocessing.get_context('fork')
+        with context.Pool(4) as pool:
+            results = pool.map(generate_ids, [5000] * 4)
+        for process_ids in results:
+            self.assertEqual(process_ids, sorted(process_ids))
+        all_ids = set(parent_ids).union(*results)
+        self.assertEqual(len(all_ids), len(parent_ids) + 5000 * 4)
@@ -4,6 +4,8 @@ from orders import views
 urlpatterns = [
     url(r'^orders/settlement/$', views.OrderSettlementView.as_view()),
     url(r'^orders/commit/$', views.OrderCommitView.as_view()),
+    # 异步下单的处理状态
+    url(r'^orders/status/$', views.OrderStatusView.as_view()),
     url(r'^orders/success/$', views.OrderSuccessView.as_view()),
     # url(r'^orders/comment/?order_id=(?P<order_id>\d+)/$', views.OrderGoodsView.as_view()),
     url(r'^orders/comment/$', views.OrderGoodsView.as_view()),
@@ -0,0 +1,88 @@
+import os
+import secrets
+import threading
+import time
+
+from django_redis import get_redis_connection
+
+from . import contants
+
+# worker id仍属于当前进程时续期
+# KEYS: order_id_worker_<worker_id>
+# ARGV: 申请时生成的随机令牌, 租约时间
+RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class OrderIdGenerator(object):
+    """
+    按时间递增的订单号，Snowflake格式: 41位毫秒时间戳 | 10位worker id | 12位毫秒内序号
+    编码成前缀9加固定长度的十进制字符串，排在以年份开头的旧订单号之后，生成时不需要访问数据库；
+    每个进程从redis中申请一个带租约的worker id，fork之后的子进程会重新申请，不会与父进程重复
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.worker_id = None
+        # 申请worker id时生成的随机令牌，用于判断租约是否仍属于当前进程
+        self.token = None
+        self.lease_time = 0
+        self.last_ms = 0
+        self.sequence = 0
+
+    def claim_worker_id(self):
+        """申请一个未被其他进程使用的worker id"""
+        max_workers = 1 << contants.ORDER_ID_WORKER_BITS
+        redis_conn = get_redis_connection('default')
+        self.token = secrets.token_hex(8)
+        for _ in range(max_workers):
+            worker_id = redis_conn.incr('order_id_worker_seq') % max_workers
+            if redis_conn.set('order_id_worker_%s' % worker_id, self.token, nx=True,
+                              ex=contants.ORDER_ID_WORKER_LEASE):
+                return worker_id
+        raise RuntimeError('没有可用的订单号worker id')
+
+    def renew_lease(self, now):
+        """租约过去三分之一后续期，进程长时间空闲导致租约过期并被其他进程申请时，重新申请worker id"""
+        if now - self.lease_time < contants.ORDER_ID_WORKER_LEASE / 3:
+            return
+        self.lease_time = now
+        redis_conn = get_redis_connection('default')
+        script = redis_conn.register_script(RENEW_LEASE_SCRIPT)
+        if not script(keys=['order_id_worker_%s' % self.worker_id], args=[self.token, contants.ORDER_ID_WORKER_LEASE]):
+            self.worker_id = self.claim_worker_id()
+
+    def next_id(self):
+        """生成一个订单号"""
+        with self.lock:
+            pid = os.getpid()
+            if pid != self.pid:
+                # 第一次使用或fork之后重新申请worker id
+                self.worker_id = self.claim_worker_id()
+                self.pid = pid
+                self.lease_time = time.time()
+                self.last_ms = 0
+                self.sequence = 0
+            else:
+                self.renew_lease(time.time())
+
+            now_ms = int(time.time() * 1000) - contants.ORDER_ID_EPOCH
+            if now_ms > self.last_ms:
+                self.last_ms = now_ms
+                self.sequence = 0
+            else:
+                # 同一毫秒内或时钟回拨时继续使用上次的时间戳，序号用完后借用下一毫秒
+                self.sequence = (self.sequence + 1) & ((1 << contants.ORDER_ID_SEQUENCE_BITS) - 1)
+                if self.sequence == 0:
+                    self.last_ms += 1
+            order_id = ((self.last_ms << (contants.ORDER_ID_WORKER_BITS + contants.ORDER_ID_SEQUENCE_BITS))
+                        | (self.worker_id << contants.ORDER_ID_SEQUENCE_BITS) | self.sequence)
+        return '%s%0*d' % (contants.ORDER_ID_PREFIX, contants.ORDER_ID_DIGITS, order_id)
+
+
+order_ids = OrderIdGenerator()
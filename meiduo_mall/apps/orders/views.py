@@ -1,14 +1,19 @@
 from django import http
-from django.db import transaction
+from django.conf import settings
 from django.shortcuts import render
-from django_redis import get_redis_connection
 import logging
+from carts.redis_cart import RedisCart
+from carts.store import RedisCartStore
 from goods.models import SKU
+from goods.sku_cache import sku_cards, sku_stocks
 from meiduo_mall.utils.views import LoginRequiredView
 from users.models import Address as Addresses
 from decimal import Decimal
 import json
-from django.utils import timezone
+from . import contants
+from .checkout import place_order
+from .pipeline import enqueue_order, get_order_status
+from .utils import order_ids
 from .models import OrderInfo, OrderGoods
 from meiduo_mall.utils.response_code import RETCODE
 
@@ -25,29 +30,30 @@ class OrderSettlementView(LoginRequiredView):
         # 使用三目
         addresses = addresses if addresses.exists() else None
         user = request.user
-        # 创建redis连接，获取hash和set数据
-        redis_conn = get_redis_connection('carts')
-        redis_dict = redis_conn.hgetall('carts_%s' % user.id)
-        selected_ids = redis_conn.smembers('selected_%s' % user.id)
-        # 定义一个字典变量用来保存勾选的商品id与count
-        cart_dict = {}
-        for sku_id_bytes in selected_ids:
-            cart_dict[int(sku_id_bytes)] = int(redis_dict[sku_id_bytes])
+        # 从redis购物车中获取勾选的商品id与count
+        cart_dict = RedisCartStore(user.id).get_selected()
 
-        # 获取勾选商品中的sku模型
-        skus = SKU.objects.filter(id__in=cart_dict.keys())
+        # 从sku卡片缓存中获取勾选的商品，从价格库存快照中获取最新价格并判断库存是否充足
+        cards = sku_cards.get_many(cart_dict.keys())
+        stocks = sku_stocks.check_cart(cart_dict)
+        skus = []
         # 统计商品数量
         total_count = 0
         # 商品总价
         total_amount = Decimal('0.00')
-        for sku in skus:
-            sku.count = cart_dict[sku.id]
-            sku.amount = sku.price * sku.count
+        for sku_id, card in cards.items():
+            # 卡片缓存未过期但sku已被删除时跳过
+            if sku_id not in stocks:
+                continue
+            sku = dict(card, price=stocks[sku_id]['price'], count=cart_dict[sku_id],
+                       available=stocks[sku_id]['available'])
+            sku['amount'] = sku['price'] * sku['count']
+            skus.append(sku)
 
             # 累加商品总量
-            total_count += sku.count
+            total_count += sku['count']
             # 累加商品小计得到商品总价
-            total_amount += sku.amount
+            total_amount += sku['amount']
         # 运费
         freight = Decimal('10.00')
         # 构造模板需要渲染的数据
@@ -83,102 +89,38 @@ class OrderCommitView(LoginRequiredView):
         if pay_method not in [OrderInfo.PAY_METHODS_ENUM['CASH'], OrderInfo.PAY_METHODS_ENUM['ALIPAY']]:
             return http.HttpResponseForbidden('非法支付方式')
         user = request.user
-        # 生成订单编号: 获取当前时间 + 用户user_id
-        order_id = timezone.now().strftime('%Y%m%d%H%M%S') + ('%09d' % user.id)
-        # 保存订单基本信息OrderInfo
-        status = (OrderInfo.ORDER_STATUS_ENUM['UNPAID']
-                  if pay_method == OrderInfo.PAY_METHODS_ENUM['ALIPAY']
-                  else OrderInfo.ORDER_STATUS_ENUM['UNSEND'])
-        # 手动开启事务
-        with transaction.atomic():
-            # 创建事务的保存点
-            save_point = transaction.savepoint()
-            try:
-                # 保存订单记录
-                order = OrderInfo.objects.create(
-                    order_id=order_id,
-                    user=user,
-                    address=address,
-                    total_count=0,
-                    total_amount=Decimal('0.00'),
-                    freight=Decimal('10.00'),
-                    pay_method=pay_method,
-                    status=status,
-                )
-                # 二、修改sku的库存和销量
-                # 从redis读取购物车中被勾选的商品信息
-                redis_conn = get_redis_connection('carts')
-                redis_dict = redis_conn.hgetall('carts_%s' % user.id)
-                selected_ids = redis_conn.smembers('selected_%s' % user.id)
-                # 定义一个字典用来包装要购买商品的id和count
-                cart_dict = {}
-                # 遍历set集合包装数据
-                for sku_id_bytes in selected_ids:
-                    cart_dict[int(sku_id_bytes)] = int(redis_dict[sku_id_bytes])
-                # 遍历要购买的商品的字典
-                for sku_id in cart_dict:
-                    while True:
-                        # 一次只查询一个sku模型
-                        sku = SKU.objects.get(id=sku_id)
-                        # 获取用户此商品腰骨埋的数据
-                        buy_count = cart_dict[sku_id]
-                        # 低昂以两个变量用来记录当前sku的原本库存和销量
-                        origin_stock = sku.stock
-                        origin_sales = sku.sales
-
-                        # 判断当前要购买的商品库存是否充足
-                        if buy_count > origin_stock:
-                            # 库存不足就回滚
-                            transaction.savepoint_rollback(save_point)
-                            # 如果库存不足，提前响应
-                            return http.JsonResponse({'code': RETCODE.STOCKERR, 'errmsg': '库存不足'})
-                        # 如果能购买，计算新的库存和销量
-                        new_stock = origin_stock - buy_count
-                        new_sales = origin_sales + buy_count
-                        # 修改sku模型库存和销量
-                        # sku.stock = new_stock
-                        # sku.sales = new_sales
-                        # sku.save()
-                        result = SKU.objects.filter(id=sku_id, stock=origin_stock).update(stock=new_stock,
-                                                                                          sales=new_sales)
-                        if result == 0:
-                            continue
-                        # 三、修改spu的销量
-                        spu = sku.spu
-                        spu.sales += buy_count
-                        spu.save()
-                        # 四、保存订单中的商品记录(为了保持商品订单与商品数量一指，将其放在for循环里面)
-                        OrderGoods.objects.create(
-                            order=order,
-                            sku=sku,
-                            count=buy_count,
-                            price=sku.price,
+        # 生成按时间递增且不重复的订单编号，不需要访问数据库
+        order_id = order_ids.next_id()
+        # 从redis购物车中取出并删除勾选的商品，期间其他购物车操作无法穿插执行，下单失败时再归还
+        cart_dict = RedisCart(user.id).checkout_pop()
+        if not cart_dict:
+            return http.JsonResponse({'code': RETCODE.NODATAERR, 'errmsg': '没有勾选商品'})
+        if settings.ORDER_ASYNC_ENABLED:
+            # 异步下单：放入队列后立即返回订单号，客户端轮询订单处理状态
+            code, errmsg = enqueue_order(user, address, pay_method, order_id, cart_dict)
+            if code == RETCODE.THROTTLINGERR:
+                response = http.JsonResponse({'code': code, 'errmsg': errmsg,
+                                              'retry_after': contants.ORDER_QUEUE_RETRY_AFTER})
+                response['Retry-After'] = contants.ORDER_QUEUE_RETRY_AFTER
+                return response
+            return http.JsonResponse({'code': code, 'errmsg': errmsg, 'order_id': order_id, 'queued': True})
+        code, errmsg = place_order(user, address, pay_method, order_id, cart_dict)
+        if code != RETCODE.OK:
+            return http.JsonResponse({'code': code, 'errmsg': errmsg})
+        return http.JsonResponse({'code': RETCODE.OK, 'errmsg': errmsg, 'order_id': order_id})
+
+
+class OrderStatusView(LoginRequiredView):
+    """查询异步下单的处理状态"""
 
-                        )
-                        # 累加商品总数量
-                        order.total_count += buy_count
-                        # 累加商品总量
-                        order.total_amount += (sku.price * buy_count)
-                        # 当前商品下蛋成功
-                        break
-                # 累加运费
-                order.total_amount += order.freight
-                order.save()
-
-                #
-            except Exception:
-                # 暴力回流
-                transaction.savepoint_rollback(save_point)
-                return http.JsonResponse({'code': RETCODE.DBERR, 'errmsg': '下单失败'})
-            else:
-                transaction.savepoint_commit(save_point)
-        # 删除以结算的购物车数据
-        pl = redis_conn.pipeline()
-        pl.hdel('carts_%s' % user.id, *selected_ids)
-        pl.delete('selected_%s' % user.id)  # 删除整个集合
-        # pl.srem('selected_%s' % user.id, *selected_ids)   删除set集合中的元素
-        pl.execute()
-        return http.JsonResponse({'code': RETCODE.OK, 'errmsg': '下单成功', 'order_id': order_id})
+    def get(self, request):
+        order_id = request.GET.get('order_id')
+        status = get_order_status(order_id, request.user.id) if order_id else None
+        if status is None:
+            return http.JsonResponse({'code': RETCODE.NODATAERR, 'errmsg': '订单不存在'})
+        # state: queued排队中 processing处理中 success下单成功 failed下单失败
+        return http.JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'order_id': order_id,
+                                  'state': status['state'], 'order_errmsg': status.get('errmsg', '')})
 
 
 class OrderSuccessView(LoginRequiredView):
@@ -1,13 +1,18 @@
+import logging
 import os
 from django import http
 from django.conf import settings
 from django.shortcuts import render
+from django.utils import timezone
 from meiduo_mall.utils.views import LoginRequiredView
+from orders.expiry import cancel_order_expiry, get_pay_deadline
 from orders.models import OrderInfo
 from meiduo_mall.utils.response_code import RETCODE
 from payment.models import Payment
 from alipay import AliPay
 
+logger = logging.getLogger('django')
+
 
 class PaymentView(LoginRequiredView):
     """订单支付"""
@@ -18,6 +23,10 @@ class PaymentView(LoginRequiredView):
             order = OrderInfo.objects.get(order_id=order_id, status=OrderInfo.ORDER_STATUS_ENUM['UNPAID'])
         except OrderInfo.DoesNotExist:
             return http.HttpResponseForbidden('参数有误')
+        # 超过支付时间的订单即将被取消，不再发起支付
+        pay_deadline = get_pay_deadline(order)
+        if pay_deadline <= timezone.now():
+            return http.HttpResponseForbidden('订单已超时')
 
         # 创建alipay SDK对象
         alipay = AliPay(
@@ -37,7 +46,8 @@ class PaymentView(LoginRequiredView):
             out_trade_no=order_id,  # 美多订单编号
             total_amount=str(order.total_amount),  # 需支付的多少钱
             subject='美多商城_%s' % order_id,  # 支付时的主题
-            return_url=settings.ALIPAY_RETURN_URL  # 支付成功后的回调url
+            return_url=settings.ALIPAY_RETURN_URL,  # 支付成功后的回调url
+            time_expire=pay_deadline.strftime('%Y-%m-%d %H:%M')  # 订单过期取消后支付宝拒绝支付
         )
         # 拼接支付宝支付界面url
         alipay_url = settings.ALIPAY_URL + '?' + order_string
@@ -82,9 +92,16 @@ class PaymentStatusView(LoginRequiredView):
                     trade_id=trade_id
                 )
             # 修改已支付成功的订单状态
-            OrderInfo.objects.filter(order_id=order_id, status=OrderInfo.ORDER_STATUS_ENUM['UNPAID']).update(
+            updated = OrderInfo.objects.filter(order_id=order_id, status=OrderInfo.ORDER_STATUS_ENUM['UNPAID']).update(
                 status=OrderInfo.ORDER_STATUS_ENUM['UNCOMMENT']
             )
+            if updated:
+                # 已支付的订单不需要再过期取消
+                cancel_order_expiry(order_id)
+            elif OrderInfo.objects.filter(order_id=order_id, status=OrderInfo.ORDER_STATUS_ENUM['CANCELED']).exists():
+                # 订单已过期取消，库存已经归还，需要人工退款
+                logger.error('订单%s已过期取消后收到支付，支付宝交易号%s' % (order_id, trade_id))
+                return render(request, 'pay_fail.html', {'trade_id': trade_id})
             # 响应，渲染支付结果界面
             return render(request, 'pay_success.html', {'trade_id': trade_id})
 
@@ -10,6 +10,7 @@ from django_redis import get_redis_connection
 import logging
 from celery_tasks.email.tasks import send_email_verify
 from goods.models import SKU
+from goods.sku_cache import sku_cards
 from meiduo_mall.utils.views import LoginRequiredView
 from .utils import generate_email_verify_url, check_verify_token
 from meiduo_mall.utils.response_code import RETCODE
@@ -555,17 +556,20 @@ class UserBrowseHistory(LoginRequiredView):
         redis_conn = get_redis_connection('history')
         # 获取当前用户在redis中的所有浏览记录列表
         sku_ids = redis_conn.lrange('history_%s' % user.id, 0, -1)
+        # 通过sku卡片缓存批量获取浏览过的sku
+        cards = sku_cards.get_many(sku_ids)
         # 创建一个保存sku字典的列表
         skus = []
-        # 在通过列表中的sku_id获取到每一个sku模型
+        # 按浏览记录的顺序包装sku字典
         for sku_id in sku_ids:
-            # 在将sku模型转换成字典
-            sku_model = SKU.objects.get(id=sku_id)
+            card = cards.get(int(sku_id))
+            if card is None:
+                continue
             skus.append({
-                'id': sku_model.id,
-                'name': sku_model.name,
-                'default_image_url': sku_model.default_image.url,
-                'price': sku_model.price,
+                'id': card['id'],
+                'name': card['name'],
+                'default_image_url': card['default_image_url'],
+                'price': card['price'],
             })
         # 响应
         return http.JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'skus': skus})
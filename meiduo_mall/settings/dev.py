@@ -55,6 +55,8 @@ INSTALLED_APPS = [
     'orders.apps.OrdersConfig',
     # 注册payment子应用
     'payment.apps.PaymentConfig',
+    # 注册carts子应用
+    'carts.apps.CartsConfig',
 
 
 ]
@@ -309,4 +311,24 @@ HAYSTACK_SEARCH_RESULTS_PER_PAGE = 5
 ALIPAY_APPID = '2016092800618125'
 ALIPAY_DEBUG = True  # 表示是沙箱环境还是真实支付环境
 ALIPAY_URL = 'https://openapi.alipaydev.com/gateway.do'
-ALIPAY_RETURN_URL = 'http://www.meiduo.site:8000/payment/status/'
\ No newline at end of file
+ALIPAY_RETURN_URL = 'http://www.meiduo.site:8000/payment/status/'
+
+# 静态化页面的生成目录
+GENERATED_STATIC_HTML_FILES_DIR = os.path.join(os.path.dirname(BASE_DIR), 'static_html')
+
+# 登录时cookie购物车与redis购物车的合并策略：overwrite以cookie为准、sum数量累加、max取较大的数量
+CART_MERGE_POLICY = 'overwrite'
+
+# 登录用户购物车闲置超过这么多天后归档并删除
+CART_IDLE_DAYS = 90
+# 闲置购物车的归档目录
+CART_ARCHIVE_DIR = os.path.join(os.path.dirname(BASE_DIR), 'cart_archive')
+
+# 是否开启热门商品的redis库存，开启后使用hot_stock --enable命令加载的sku在redis中预占库存
+HOT_STOCK_ENABLED = False
+
+# 是否开启异步下单，开启后下单请求只把订单放入队列，由celery worker处理
+ORDER_ASYNC_ENABLED = False
+# 异步下单的队列分片数量，按订单中最小的sku_id分片，每个分片的队列orders_<分片>只启动一个worker进程串行处理:
+# celery -A celery_tasks.main worker -Q orders_0 -c 1
+ORDER_QUEUE_SHARDS = 4
@@ -26,12 +26,12 @@ var vm = new Vue({
                 })
                 .then(response => {
                     this.carts = response.data.cart_skus;
-                    this.cart_total_count = 0;
+                    // 购物车下拉列表只返回部分商品，总数量使用后端统计的结果
+                    this.cart_total_count = response.data.total_count;
                     for(var i=0;i<this.carts.length;i++){
                         if (this.carts[i].name.length>25){
                             this.carts[i].name = this.carts[i].name.substring(0, 25) + '...';
                         }
-                        this.cart_total_count += this.carts[i].count;
                     }
                 })
                 .catch(error => {
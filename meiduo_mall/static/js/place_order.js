@@ -8,6 +8,7 @@ var vm = new Vue({
         pay_method: 2, // 支付方式,默认支付宝支付
         nowsite: '', // 默认地址
         payment_amount: '',
+        poll_max_times: 60, // 异步下单最多查询处理状态的次数
     },
     mounted(){
         // 初始化
@@ -39,12 +40,17 @@ var vm = new Vue({
                         responseType: 'json'
                     })
                     .then(response => {
-                        if (response.data.code == '0') {
-                            location.href = '/orders/success/?order_id='+response.data.order_id
-                                        +'&payment_amount='+this.payment_amount
-                                        +'&pay_method='+this.pay_method;
+                        if (response.data.code == '0' && response.data.queued) {
+                            // 异步下单，轮询订单处理状态
+                            this.poll_order_status(response.data.order_id);
+                        } else if (response.data.code == '0') {
+                            this.to_order_success(response.data.order_id);
                         } else if (response.data.code == '4101') {
                             location.href = '/login/?next=/orders/settlement/';
+                        } else if (response.data.code == '4002') {
+                            // 下单队列已满，稍后重试
+                            this.order_submitting = false;
+                            alert(response.data.errmsg + '，请' + response.data.retry_after + '秒后重试');
                         } else {
                             alert(response.data.errmsg);
                         }
@@ -54,6 +60,41 @@ var vm = new Vue({
                         console.log(error.response);
                     })
             }
+        },
+        // 跳转到下单成功页面
+        to_order_success(order_id){
+            location.href = '/orders/success/?order_id='+order_id
+                        +'&payment_amount='+this.payment_amount
+                        +'&pay_method='+this.pay_method;
+        },
+        // 每秒查询一次异步下单的处理状态，最多查询poll_max_times次
+        poll_order_status(order_id, times){
+            times = times || 1;
+            if (times > this.poll_max_times) {
+                this.order_submitting = false;
+                alert('订单处理超时，请稍后在我的订单中查看，未生成订单时商品会放回购物车');
+                return;
+            }
+            var url = this.host + '/orders/status/?order_id=' + order_id;
+            axios.get(url, {
+                    responseType: 'json'
+                })
+                .then(response => {
+                    if (response.data.code != '0') {
+                        this.order_submitting = false;
+                        alert(response.data.errmsg);
+                    } else if (response.data.state == 'success') {
+                        this.to_order_success(order_id);
+                    } else if (response.data.state == 'failed') {
+                        this.order_submitting = false;
+                        alert(response.data.order_errmsg);
+                    } else {
+                        setTimeout(() => this.poll_order_status(order_id, times + 1), 1000);
+                    }
+                })
+                .catch(error => {
+                    setTimeout(() => this.poll_order_status(order_id, times + 1), 1000);
+                })
         }
     }
 });
@@ -0,0 +1,14 @@
+# 锁的值与加锁时的令牌一致时才删除，锁已过期并被其他进程获取时不会误删
+# KEYS: 锁的键名
+# ARGV: 加锁时的令牌
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def release_lock(redis_conn, key, token):
+    """释放用set(key, token, nx=True, ex=...)获取的redis锁"""
+    return redis_conn.register_script(RELEASE_LOCK_SCRIPT)(keys=[key], args=[token])